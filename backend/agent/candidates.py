@@ -0,0 +1,71 @@
+"""
+多候选策略（best-of-N）的配置和排序
+策略生成节点一次并发生成多个候选策略，候选评估节点并行完成语法检查、预检、预筛选和回测，
+按目标指标选出最优的候选进入评估节点。
+"""
+import os
+from typing import Any, Callable, Dict, List, Optional
+
+# 每次生成的候选策略数量（1 表示关闭多候选模式）
+CANDIDATE_COUNT = int(os.getenv("CANDIDATE_COUNT", "1"))
+# 选择最优候选使用的目标指标
+CANDIDATE_OBJECTIVE = os.getenv("CANDIDATE_OBJECTIVE", "sharpe")
+
+
+def _calmar(metrics: Dict[str, Any]) -> float:
+    """收益回撤比：总收益率 / 最大回撤（没有回撤时按 1% 计算，避免除以 0）"""
+    return metrics.get("profit_total_pct", 0) / max(metrics.get("max_drawdown_pct", 0), 1.0)
+
+
+# 目标指标: 名称 -> 从回测指标计算分数的函数（分数越大越好）
+OBJECTIVES: Dict[str, Callable[[Dict[str, Any]], float]] = {
+    "sharpe": lambda m: m.get("sharpe", 0),
+    "sortino": lambda m: m.get("sortino", 0),
+    "profit_total_pct": lambda m: m.get("profit_total_pct", 0),
+    "profit_factor": lambda m: m.get("profit_factor", 0),
+    "calmar": _calmar,
+    "stability_score": lambda m: m.get("stability_score", 0),
+}
+
+
+def score_candidate(candidate: Dict[str, Any], objective: str = CANDIDATE_OBJECTIVE) -> tuple:
+    """
+    候选策略的排序键（越大越好）
+
+    依次比较: 是否无错误、是否完成了完整回测（只有预筛选结果的排在后面）、是否有交易、目标指标
+    """
+    if objective not in OBJECTIVES:
+        raise ValueError(f"不支持的目标指标: {objective}，可选: {', '.join(OBJECTIVES)}")
+    results = candidate.get("backtest_results")
+    if candidate.get("error_logs") or not results or "metrics" not in results:
+        return (0, 0, 0, float("-inf"))
+    metrics = results["metrics"]
+    return (
+        1,
+        0 if results.get("prescreen") else 1,
+        1 if metrics.get("total_trades", 0) > 0 else 0,
+        float(OBJECTIVES[objective](metrics) or 0),
+    )
+
+
+def rank_candidates(candidates: List[Dict[str, Any]], objective: str = CANDIDATE_OBJECTIVE) -> List[Dict[str, Any]]:
+    """按目标指标从优到劣排序候选策略（分数相同时保持生成顺序）"""
+    return sorted(candidates, key=lambda c: score_candidate(c, objective), reverse=True)
+
+
+def summarize_candidate(candidate: Dict[str, Any], objective: str = CANDIDATE_OBJECTIVE) -> Dict[str, Any]:
+    """候选策略的摘要（用于日志和前端展示）"""
+    results = candidate.get("backtest_results") or {}
+    metrics = results.get("metrics", {})
+    error_logs: Optional[List[str]] = candidate.get("error_logs")
+    return {
+        "index": candidate["index"],
+        "stage": candidate["stage"],
+        "error": error_logs[0].splitlines()[0] if error_logs else None,
+        "prescreen_only": bool(results.get("prescreen")),
+        "total_trades": metrics.get("total_trades"),
+        "profit_total_pct": metrics.get("profit_total_pct"),
+        "sharpe": metrics.get("sharpe"),
+        "objective": objective,
+        "score": score_candidate(candidate, objective)[3] if not error_logs and metrics else None,
+    }
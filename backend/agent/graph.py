@@ -1,18 +1,61 @@
 from langgraph.graph import StateGraph, END
 from langgraph.checkpoint.memory import MemorySaver
 from .state import AgentState
-from .nodes import strategy_generator, syntax_checker, backtest_executor, evaluator, web_search_node, report_generator
+from .nodes import (strategy_generator, syntax_checker, preflight_checker, backtest_executor, evaluator,
+                    candidate_evaluator, hyperopt_node, web_search_node, report_generator)
+from ..tools.hyperopt import HYPEROPT_ENABLED, detect_hyperopt_parameters
 from ..factor_library.factor_query_node import factor_query_node
 
 # 定义最大迭代次数常量 (也可以从 state 中读取配置)
 MAX_ITERATIONS = 5
 
+# 每次迭代最多经过的节点数: strategy_generator -> syntax_checker -> preflight_checker -> backtest_executor -> evaluator
+STEPS_PER_ITERATION = 5
+# 参数优化多经过的节点数: hyperopt -> backtest_executor -> evaluator（每个策略最多优化一次）
+HYPEROPT_STEPS = 3
+# 迭代之外的节点: web_search、factor_query 和 report_generator
+FIXED_STEPS = 3
+
+
+def graph_recursion_limit() -> int:
+    """
+    运行图时使用的 recursion_limit（LangGraph 默认的 25 步不够 MAX_ITERATIONS 次完整的迭代）
+
+    按每次迭代最多经过的节点数计算（启用参数优化时包括优化后重新回测的节点），出错回到生成器的迭代经过的节点更少。
+    """
+    steps_per_iteration = STEPS_PER_ITERATION + (HYPEROPT_STEPS if HYPEROPT_ENABLED else 0)
+    return FIXED_STEPS + MAX_ITERATIONS * steps_per_iteration
+
 # 创建内存检查点保存器，用于管理会话记忆
 checkpointer = MemorySaver()
 
+def route_after_generation(state: AgentState):
+    """生成了多个不同的候选策略时并行评估，否则按单个策略的流程继续"""
+    if len(state.get("candidate_codes") or []) > 1:
+        return "candidate_evaluator"
+    return "syntax_checker"
+
+def route_after_candidates(state: AgentState):
+    """所有候选都出错时回到生成器修复（最优候选的错误信息），已达到最大迭代次数时生成报告；否则评估最优候选"""
+    if state.get("error_logs"):
+        if state["iteration_count"] >= MAX_ITERATIONS:
+            return "report_generator"
+        return "strategy_generator"
+    return "evaluator"
+
 def route_after_syntax_check(state: AgentState):
-    """根据语法检查结果路由"""
+    """根据语法检查结果路由（语法错误且已达到最大迭代次数时生成报告）"""
+    if state.get("error_logs"):
+        if state["iteration_count"] >= MAX_ITERATIONS:
+            return "report_generator"
+        return "strategy_generator"
+    return "preflight_checker"
+
+def route_after_preflight(state: AgentState):
+    """根据预检结果路由（预检失败且已达到最大迭代次数时生成报告）"""
     if state.get("error_logs"):
+        if state["iteration_count"] >= MAX_ITERATIONS:
+            return "report_generator"
         return "strategy_generator"
     return "backtest_executor"
 
@@ -22,11 +65,26 @@ def route_after_evaluation(state: AgentState):
     if state.get("is_satisfactory"):
         return "report_generator"
     
+    # 策略有可优化参数且尚未优化时，先进行参数优化（不消耗迭代次数）
+    if (HYPEROPT_ENABLED and not state.get("error_logs") and not state.get("hyperopt_applied")
+            and detect_hyperopt_parameters(state.get("current_code") or "")):
+        return "hyperopt"
+    
     if state["iteration_count"] >= MAX_ITERATIONS:
         return "report_generator"
         
     return "strategy_generator"
 
+def route_after_hyperopt(state: AgentState):
+    """参数优化成功后用新参数重新回测，否则继续由 LLM 修改策略"""
+    if (state.get("hyperopt_results") or {}).get("success"):
+        return "backtest_executor"
+    
+    if state["iteration_count"] >= MAX_ITERATIONS:
+        return "report_generator"
+    
+    return "strategy_generator"
+
 def create_graph():
     """构建 LangGraph 工作流"""
     workflow = StateGraph(AgentState)
@@ -36,8 +94,11 @@ def create_graph():
     workflow.add_node("factor_query", factor_query_node)  # 因子查询节点
     workflow.add_node("strategy_generator", strategy_generator)
     workflow.add_node("syntax_checker", syntax_checker)
+    workflow.add_node("preflight_checker", preflight_checker)  # 预检节点
     workflow.add_node("backtest_executor", backtest_executor)
+    workflow.add_node("candidate_evaluator", candidate_evaluator)  # 多候选并行评估节点
     workflow.add_node("evaluator", evaluator)
+    workflow.add_node("hyperopt", hyperopt_node)  # 参数优化节点
     workflow.add_node("report_generator", report_generator)  # 报告生成节点
 
     # 定义边
@@ -50,7 +111,25 @@ def create_graph():
     # 因子查询完成后进入策略生成
     workflow.add_edge("factor_query", "strategy_generator")
     
-    workflow.add_edge("strategy_generator", "syntax_checker")
+    # 策略生成后的条件分支（多候选模式下并行评估所有候选）
+    workflow.add_conditional_edges(
+        "strategy_generator",
+        route_after_generation,
+        {
+            "candidate_evaluator": "candidate_evaluator",
+            "syntax_checker": "syntax_checker"
+        }
+    )
+    
+    workflow.add_conditional_edges(
+        "candidate_evaluator",
+        route_after_candidates,
+        {
+            "strategy_generator": "strategy_generator",
+            "evaluator": "evaluator",
+            "report_generator": "report_generator"
+        }
+    )
     
     # 语法检查后的条件分支
     workflow.add_conditional_edges(
@@ -58,7 +137,19 @@ def create_graph():
         route_after_syntax_check,
         {
             "strategy_generator": "strategy_generator",
-            "backtest_executor": "backtest_executor"
+            "preflight_checker": "preflight_checker",
+            "report_generator": "report_generator"
+        }
+    )
+    
+    # 预检后的条件分支
+    workflow.add_conditional_edges(
+        "preflight_checker",
+        route_after_preflight,
+        {
+            "strategy_generator": "strategy_generator",
+            "backtest_executor": "backtest_executor",
+            "report_generator": "report_generator"
         }
     )
     
@@ -69,6 +160,18 @@ def create_graph():
         "evaluator",
         route_after_evaluation,
         {
+            "report_generator": "report_generator",
+            "hyperopt": "hyperopt",
+            "strategy_generator": "strategy_generator"
+        }
+    )
+    
+    # 参数优化后的条件分支
+    workflow.add_conditional_edges(
+        "hyperopt",
+        route_after_hyperopt,
+        {
+            "backtest_executor": "backtest_executor",
             "report_generator": "report_generator",
             "strategy_generator": "strategy_generator"
         }
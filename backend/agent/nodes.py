@@ -1,11 +1,18 @@
 import ast
 import os
 import requests
+from concurrent.futures import ThreadPoolExecutor
 from typing import Dict, Any
 from langchain_core.output_parsers import StrOutputParser
 from .state import AgentState
+from .progress import get_progress_callback
+from .candidates import CANDIDATE_COUNT, CANDIDATE_OBJECTIVE, OBJECTIVES, rank_candidates, summarize_candidate
 from .prompts import generation_prompt, optimization_prompt, generation_with_search_prompt, report_generation_prompt
-from ..tools.freqtrade_mcp_mock import run_freqtrade_backtest_auto
+from ..tools.freqtrade_mcp_mock import MOCK_BACKTEST_ENABLED, run_freqtrade_backtest_auto
+from ..tools.prescreen import run_prescreen, is_promising
+from ..tools.preflight import PREFLIGHT_ENABLED, run_preflight
+from ..tools.hyperopt import run_hyperopt
+from ..tools.walk_forward import WALK_FORWARD_ENABLED, WALK_FORWARD_MIN_STABILITY, run_walk_forward
 from ..llm_config import llm_config
 
 # 初始化不同用途的 LLM 模型
@@ -24,6 +31,12 @@ print("LLM 模型配置信息：")
 llm_config.print_config()
 print("=" * 60)
 
+# 是否在完整回测前进行进程内预筛选
+PRESCREEN_ENABLED = os.getenv("PRESCREEN_ENABLED", "true").lower() == "true"
+# 评估通过所需的最小盈利因子和允许的最大回撤（%），默认不限制
+EVALUATOR_MIN_PROFIT_FACTOR = float(os.getenv("EVALUATOR_MIN_PROFIT_FACTOR", "0"))
+EVALUATOR_MAX_DRAWDOWN_PCT = float(os.getenv("EVALUATOR_MAX_DRAWDOWN_PCT", "100"))
+
 def clean_code(code: str) -> str:
     """清理 LLM 返回的代码，去除 markdown 标记"""
     if "```python" in code:
@@ -135,18 +148,22 @@ def strategy_generator(state: AgentState) -> Dict[str, Any]:
         if backtest_results:
             metrics = backtest_results.get("metrics", {})
             feedback += f"Backtest Metrics:\n{metrics}\n"
+        hyperopt_results = state.get("hyperopt_results")
+        if state.get("hyperopt_applied") and hyperopt_results and hyperopt_results.get("success"):
+            feedback += (f"以上回测使用的参数已经过参数优化（{hyperopt_results['epochs']} 轮）: "
+                         f"{hyperopt_results['params']}，单纯调整这些参数的取值已无法改善，请改进策略逻辑。\n")
         
         # 如果没有反馈，使用用户的新需求作为优化方向
         if not feedback:
             feedback = f"用户新的优化需求: {user_requirement}\n"
             
         chain = optimization_prompt | optimizer_llm | StrOutputParser()
-        code = chain.invoke({
+        inputs = {
             "user_requirement": user_requirement,
             "iteration_count": iteration_count,
             "feedback": feedback,
             "current_code": current_code
-        })
+        }
     else:
         # 首次生成 - 使用代码生成模型，整合搜索结果
         print(f"使用代码生成模型生成初始策略: {user_requirement}")
@@ -162,20 +179,32 @@ def strategy_generator(state: AgentState) -> Dict[str, Any]:
         if additional_info:
             print("整合搜索结果和因子信息到策略生成中...")
             chain = generation_with_search_prompt | code_generator_llm | StrOutputParser()
-            code = chain.invoke({
+            inputs = {
                 "user_requirement": user_requirement,
                 "search_results": "\n\n".join(additional_info)
-            })
+            }
         else:
             chain = generation_prompt | code_generator_llm | StrOutputParser()
-            code = chain.invoke({"user_requirement": user_requirement})
+            inputs = {"user_requirement": user_requirement}
+
+    candidate_codes = None
+    if CANDIDATE_COUNT > 1:
+        # 多候选模式：并发请求 N 个候选策略，去掉重复的代码
+        print(f"并发生成 {CANDIDATE_COUNT} 个候选策略")
+        codes = chain.batch([inputs] * CANDIDATE_COUNT, config={"max_concurrency": CANDIDATE_COUNT})
+        candidate_codes = list(dict.fromkeys(clean_code(code) for code in codes))
+        print(f"得到 {len(candidate_codes)} 个不同的候选策略")
+        clean_c = candidate_codes[0]
+    else:
+        clean_c = clean_code(chain.invoke(inputs))
 
-    clean_c = clean_code(code)
     # 标记会话中已有策略
     return {
         "current_code": clean_c, 
+        "candidate_codes": candidate_codes,
         "iteration_count": iteration_count + 1,
-        "has_strategy": True
+        "has_strategy": True,
+        "hyperopt_applied": False
     }
 
 def syntax_checker(state: AgentState) -> Dict[str, Any]:
@@ -193,6 +222,41 @@ def syntax_checker(state: AgentState) -> Dict[str, Any]:
         print(error_msg)
         return {"error_logs": [error_msg]} # 将错误传递给状态，以便生成器修复
 
+def preflight_checker(state: AgentState) -> Dict[str, Any]:
+    """
+    预检节点
+    在隔离的子进程中用少量K线运行策略的 populate 方法，提前发现代码错误
+    """
+    print("--- Node: Preflight Checker ---")
+    # 模拟回测模式（压力测试）下不启动预检子进程
+    if not PREFLIGHT_ENABLED or MOCK_BACKTEST_ENABLED:
+        return {}
+
+    pairs = state.get("pairs", ["BTC/USDT", "ETH/USDT"])
+    timeframe = state.get("timeframe", "5m")
+    timerange = state.get("timerange", "20230101-20231231")
+    result = run_preflight(state["current_code"], pairs, timeframe, timerange)
+
+    if "error" in result:
+        # 没有数据或预检环境不可用时不阻塞流程，交给完整回测
+        if result.get("error_type") == "preflight_unavailable":
+            print(f"预检跳过: {result['error']}")
+            return {}
+        print(f"预检失败（{result['check']}）: {result['error']}")
+        detailed_error = f"策略预检失败（{result['check']}）: {result['error']}"
+        if result.get("traceback"):
+            detailed_error += "\n\n详细错误信息:\n" + result["traceback"]
+        return {
+            "error_logs": [detailed_error],
+            "backtest_results": None,
+            "is_code_error": True
+        }
+
+    for warning in result["warnings"]:
+        print(f"预检警告: {warning}")
+    print(f"预检通过（{result['elapsed']}s），开仓信号: {result['entries']}")
+    return {}
+
 def backtest_executor(state: AgentState) -> Dict[str, Any]:
     """
     回测执行节点
@@ -213,54 +277,42 @@ def backtest_executor(state: AgentState) -> Dict[str, Any]:
     
     print(f"回测参数: pairs={pairs}, timeframe={timeframe}, timerange={timerange}")
     
-    # 执行回测（自动选择真实回测或模拟回测）
-    result = run_freqtrade_backtest_auto(
-        code, 
-        timerange=timerange,
-        pair_list=pairs,
-        timeframe=timeframe
-    )
+    # 先用进程内向量化引擎预筛选，明显无效（例如一次都不开仓）的策略不再进行完整回测
+    # 预筛选不可用或出错时直接交给 freqtrade，由完整回测给出准确的错误信息
+    if PRESCREEN_ENABLED and not MOCK_BACKTEST_ENABLED:
+        prescreen_result = run_prescreen(code, pairs, timeframe, timerange)
+        if "error" in prescreen_result:
+            print(f"预筛选未完成，继续完整回测: {prescreen_result['error']}")
+        elif not is_promising(prescreen_result):
+            print(f"预筛选未通过（{prescreen_result['elapsed']}s），跳过完整回测: {prescreen_result['metrics']}")
+            return {"backtest_results": prescreen_result, "error_logs": []}
+        else:
+            print(f"预筛选通过（{prescreen_result['elapsed']}s），进行完整回测")
+    
+    # 执行回测（自动选择真实回测或模拟回测），回测进度通过 progress_channel 实时转发
+    # 启用滚动窗口评估时，将时间范围切分为多个样本内/样本外窗口并发回测
+    progress_callback = get_progress_callback(state.get("progress_channel"))
+    # 模拟模式没有真实的样本外结果，不进行滚动窗口评估
+    if WALK_FORWARD_ENABLED and not MOCK_BACKTEST_ENABLED:
+        result = run_walk_forward(code, timerange, pairs, timeframe, progress_callback=progress_callback)
+    else:
+        result = run_freqtrade_backtest_auto(
+            code, 
+            timerange=timerange,
+            pair_list=pairs,
+            timeframe=timeframe,
+            progress_callback=progress_callback
+        )
     
     if "error" in result:
         error_type = result.get("error_type", "execution_error")
         error_msg = result["error"]
         
-        # 如果是代码错误，提取详细的错误信息（包括 stderr）反馈给生成器
+        # 如果是代码错误，将回测工具提取的 Traceback 反馈给生成器
         if error_type == "code_error":
-            stderr = result.get("stderr", "")
-            stdout = result.get("stdout", "")
-            # 提取关键错误信息
             detailed_error = f"{error_msg}\n"
-            if stderr:
-                # 提取完整的 Traceback 和错误信息
-                lines = stderr.split('\n')
-                error_lines = []
-                in_traceback = False
-                last_error_line = -1
-                
-                # 找到 Traceback 开始的位置
-                for i, line in enumerate(lines):
-                    if 'Traceback' in line or 'Fatal exception' in line.lower():
-                        in_traceback = True
-                        error_lines.append(line)
-                    elif in_traceback:
-                        error_lines.append(line)
-                        # 记录最后一个包含 Error 或 Exception 的行
-                        if any(keyword in line for keyword in ['Error', 'Exception', 'AttributeError', 'SyntaxError', 
-                                                               'ImportError', 'NameError', 'TypeError', 'ValueError']):
-                            last_error_line = len(error_lines) - 1
-                        # 如果遇到空行且已经找到了错误信息，可以停止（但继续收集一些上下文）
-                        if not line.strip() and last_error_line >= 0 and len(error_lines) > last_error_line + 3:
-                            break
-                
-                # 如果找到了错误，提取完整的 Traceback 和错误信息
-                if error_lines:
-                    # 如果找到了最后一个错误行，只取到该行及之后2行
-                    if last_error_line >= 0:
-                        detailed_error += "\n详细错误信息:\n" + "\n".join(error_lines[:last_error_line + 3])
-                    else:
-                        # 否则取所有错误行（最多30行）
-                        detailed_error += "\n详细错误信息:\n" + "\n".join(error_lines[:30])
+            if result.get("traceback"):
+                detailed_error += "\n详细错误信息:\n" + result["traceback"]
             print(f"Backtest failed (代码错误): {error_msg}")
             return {
                 "error_logs": [detailed_error],
@@ -274,6 +326,17 @@ def backtest_executor(state: AgentState) -> Dict[str, Any]:
                 "backtest_results": None,
                 "is_timeout": True  # 标记为超时
             }
+        elif error_type == "resource_error":
+            # 超出内存或 CPU 时间限制通常是策略代码的问题（例如构建了过大的 DataFrame），反馈给生成器
+            print(f"Backtest failed (超出资源限制): {error_msg}")
+            resources = result.get("resources") or {}
+            return {
+                "error_logs": [f"回测超出资源限制: {error_msg}\n"
+                               f"峰值内存 {resources.get('peak_rss_mb', '?')} MB，CPU 时间 {resources.get('cpu_seconds', '?')} 秒。"
+                               f"请避免在指标计算中创建过大的中间 DataFrame 或逐行循环。"],
+                "backtest_results": None,
+                "is_resource_error": True  # 标记为超出资源限制
+            }
         else:
             print(f"Backtest failed: {error_msg}")
             return {"error_logs": [error_msg], "backtest_results": None}
@@ -281,6 +344,81 @@ def backtest_executor(state: AgentState) -> Dict[str, Any]:
     print("Backtest completed successfully.")
     return {"backtest_results": result, "error_logs": []}
 
+def _evaluate_candidate(state: AgentState, index: int, code: str) -> Dict[str, Any]:
+    """依次对单个候选策略执行语法检查、预检和回测（与单候选模式的节点相同），在第一个出错的阶段停止"""
+    candidate_state = {**state, "current_code": code, "error_logs": [], "backtest_results": None}
+    for stage, node in (("syntax_checker", syntax_checker), ("preflight_checker", preflight_checker),
+                        ("backtest_executor", backtest_executor)):
+        candidate_state.update(node(candidate_state))
+        if candidate_state.get("error_logs"):
+            break
+    return {
+        "index": index,
+        "code": code,
+        "stage": stage,
+        "error_logs": candidate_state.get("error_logs") or [],
+        "backtest_results": candidate_state.get("backtest_results")
+    }
+
+def candidate_evaluator(state: AgentState) -> Dict[str, Any]:
+    """
+    候选评估节点（多候选模式）
+    并行评估所有候选策略，按目标指标选出最优的一个作为当前策略
+    """
+    print("--- Node: Candidate Evaluator ---")
+    candidate_codes = state.get("candidate_codes") or [state["current_code"]]
+    objective = CANDIDATE_OBJECTIVE
+    if objective not in OBJECTIVES:
+        print(f"警告: 不支持的目标指标 {objective}，使用 sharpe")
+        objective = "sharpe"
+
+    # 回测经过回测调度器排队，实际同时运行的 freqtrade 进程数量受调度器限制
+    with ThreadPoolExecutor(max_workers=len(candidate_codes), thread_name_prefix="candidate") as executor:
+        candidates = list(executor.map(lambda args: _evaluate_candidate(state, *args), enumerate(candidate_codes)))
+
+    ranked = rank_candidates(candidates, objective)
+    summaries = [summarize_candidate(c, objective) for c in candidates]
+    for summary in summaries:
+        print(f"候选 {summary['index'] + 1}: 阶段={summary['stage']}, 错误={summary['error']}, "
+              f"交易={summary['total_trades']}, {objective}={summary['score']}")
+
+    best = ranked[0]
+    print(f"选择候选 {best['index'] + 1}（目标指标: {objective}）")
+    return {
+        "current_code": best["code"],
+        "backtest_results": best["backtest_results"],
+        "error_logs": best["error_logs"],
+        "candidate_results": summaries
+    }
+
+def hyperopt_node(state: AgentState) -> Dict[str, Any]:
+    """
+    参数优化节点
+    对策略中的 IntParameter / DecimalParameter 等参数执行 freqtrade hyperopt，把最优参数写回代码
+    """
+    print("--- Node: Hyperopt ---")
+    from ..tools.backtest_scheduler import get_scheduler
+
+    pairs = state.get("pairs", ["BTC/USDT", "ETH/USDT"])
+    timeframe = state.get("timeframe", "5m")
+    timerange = state.get("timerange", "20230101-20231231")
+    # 提交到回测调度器，与回测共享并发限制，并可以通过 /backtests/jobs 查看和取消
+    result = get_scheduler().run(run_hyperopt, state["current_code"], timerange, pairs, timeframe,
+                                 progress_callback=get_progress_callback(state.get("progress_channel")))
+
+    if "error" in result:
+        print(f"参数优化失败（{result.get('error_type')}）: {result['error']}")
+        return {"hyperopt_applied": True, "hyperopt_results": result}
+
+    print(f"参数优化完成（{result['epochs']} 轮，{result['elapsed']}s"
+          f"{'，已达到时间预算' if result['timed_out'] else ''}）: {result['default_params']} -> {result['params']}")
+    print(f"优化后的样本内指标: {result['metrics']}")
+    return {
+        "current_code": result.pop("code"),
+        "hyperopt_applied": True,
+        "hyperopt_results": result
+    }
+
 def evaluator(state: AgentState) -> Dict[str, Any]:
     """
     评估节点
@@ -300,16 +438,34 @@ def evaluator(state: AgentState) -> Dict[str, Any]:
         return {"is_satisfactory": False, "error_logs": ["No metrics found in backtest results"]}
         
     metrics = results["metrics"]
-    
+
+    # 预筛选未通过（没有进行完整回测）: 近似的模拟指标不能作为最终结果，重新生成策略
+    if results.get("prescreen"):
+        print(f"预筛选未通过，不进行评估: Trades={metrics.get('total_trades', 0)}")
+        return {"is_satisfactory": False}
+
     # 简单的评估逻辑
     profit_pct = metrics.get("profit_total_pct", 0)
     trades = metrics.get("total_trades", 0)
     
-    print(f"Evaluation: Profit={profit_pct}%, Trades={trades}")
+    profit_factor = metrics.get("profit_factor", 0)
+    max_drawdown_pct = metrics.get("max_drawdown_pct", 0)
+    
+    print(f"Evaluation: Profit={profit_pct}%, Trades={trades}, Sharpe={metrics.get('sharpe', 0)}, "
+          f"Sortino={metrics.get('sortino', 0)}, Calmar={metrics.get('calmar', 0)}, "
+          f"ProfitFactor={profit_factor}, MaxDrawdown={max_drawdown_pct}%, Exposure={metrics.get('exposure_pct', 0)}%")
     
-    # 设定简单的通过标准：盈利 > 0 且 有交易
-    # 实际项目中这里会更复杂
-    is_good = profit_pct > 0 and trades > 0
+    # 通过标准：盈利 > 0 且 有交易，盈利因子和最大回撤满足配置的阈值
+    is_good = (profit_pct > 0 and trades > 0
+               and profit_factor >= EVALUATOR_MIN_PROFIT_FACTOR
+               and max_drawdown_pct <= EVALUATOR_MAX_DRAWDOWN_PCT)
+    
+    # 滚动窗口评估：还要求样本外表现足够稳定
+    walk_forward = results.get("walk_forward")
+    if walk_forward:
+        stability = walk_forward["stability_score"]
+        print(f"Walk-forward: 稳定性评分={stability}, 盈利窗口={walk_forward['profitable_windows']}/{len(walk_forward['windows'])}")
+        is_good = is_good and stability >= WALK_FORWARD_MIN_STABILITY
     
     # 或者达到最大迭代次数 (在 graph 中通常会检查，但这里也可以标记)
     # 注意：graph 路由逻辑通常处理最大迭代退出，这里主要评估质量
@@ -331,16 +487,42 @@ def report_generator(state: AgentState) -> Dict[str, Any]:
         print("警告：没有策略代码，无法生成报告")
         return {"strategy_report": "策略生成失败，无法生成报告。"}
     
+    # 参数优化和优化后的回测使用同一时间范围，回测结果是样本内的，可能高估策略的实际表现
+    in_sample_note = ""
+    hyperopt_results = state.get("hyperopt_results") or {}
+    if state.get("hyperopt_applied") and hyperopt_results.get("success"):
+        in_sample_note = (f"注意: 策略参数经过参数优化（{hyperopt_results['epochs']} 轮），参数优化和回测使用同一时间范围 "
+                          f"{state.get('timerange', '20230101-20231231')}，回测结果为样本内结果，可能高估策略在新数据上的表现。")
+    
     # 格式化回测结果
     if backtest_results and "metrics" in backtest_results:
         metrics = backtest_results["metrics"]
         formatted_results = f"""
 总收益率: {metrics.get('profit_total_pct', 0):.2f}%
 总交易次数: {metrics.get('total_trades', 0)}
-胜率: {metrics.get('wins', 0) / max(metrics.get('total_trades', 1), 1) * 100:.2f}%
+胜率: {metrics.get('win_rate', 0):.2f}%
 平均收益: {metrics.get('profit_mean_pct', 0):.2f}%
-最大回撤: {metrics.get('max_drawdown_pct', 0):.2f}%
+最大回撤: {metrics.get('max_drawdown_pct', 0):.2f}%（最长水下持续 {metrics.get('max_drawdown_duration_days', 0):.1f} 天）
+夏普比率: {metrics.get('sharpe', 0):.2f}
+索提诺比率: {metrics.get('sortino', 0):.2f}
+卡玛比率: {metrics.get('calmar', 0):.2f}
+盈利因子: {metrics.get('profit_factor', 0):.3f}
+期望收益（每笔）: {metrics.get('expectancy', 0):.3f}
+持仓暴露度: {metrics.get('exposure_pct', 0):.2f}%（平均同时持仓 {metrics.get('avg_open_trades', 0):.2f} 笔）
+"""
+        results_per_pair = metrics.get("results_per_pair") or []
+        if results_per_pair:
+            formatted_results += "按交易对:\n" + "".join(
+                f"  {row['pair']}: {row.get('trades', 0)} 笔交易，收益 {row.get('profit_total_pct', 0):.2f}%，"
+                f"平均收益 {row.get('profit_mean_pct', 0):.2f}%\n"
+                for row in results_per_pair
+            )
+        walk_forward = backtest_results.get("walk_forward")
+        if walk_forward:
+            formatted_results += f"""滚动窗口评估（样本外）: {walk_forward['profitable_windows']}/{len(walk_forward['windows'])} 个窗口盈利，稳定性评分 {walk_forward['stability_score']:.2f}
 """
+        if in_sample_note:
+            formatted_results += in_sample_note + "\n"
     else:
         formatted_results = "回测未成功完成或无结果数据。"
     
@@ -354,6 +536,9 @@ def report_generator(state: AgentState) -> Dict[str, Any]:
         })
         
         print("策略报告生成成功")
+        # 样本内提示直接附加在报告末尾，不依赖模型是否在报告中提及
+        if in_sample_note and backtest_results and "metrics" in backtest_results:
+            report = f"{report}\n\n> {in_sample_note}"
         return {"strategy_report": report}
     except Exception as e:
         error_msg = f"报告生成失败: {str(e)}"
@@ -0,0 +1,34 @@
+"""
+节点执行过程中的进度事件
+WebSocket 会话为每次图执行注册一个回调，state 中只保存回调对应的 progress_channel，
+节点通过它找到回调并转发进度事件（回调本身不能放进 state，state 需要被 checkpointer 序列化）
+"""
+import threading
+import uuid
+from typing import Any, Callable, Dict, Optional
+
+ProgressCallback = Callable[[Dict[str, Any]], None]
+
+_listeners: Dict[str, ProgressCallback] = {}
+_lock = threading.Lock()
+
+
+def register_progress_listener(callback: ProgressCallback) -> str:
+    """注册进度回调，返回写入 state["progress_channel"] 的标识"""
+    channel = uuid.uuid4().hex
+    with _lock:
+        _listeners[channel] = callback
+    return channel
+
+
+def unregister_progress_listener(channel: str):
+    with _lock:
+        _listeners.pop(channel, None)
+
+
+def get_progress_callback(channel: Optional[str]) -> Optional[ProgressCallback]:
+    """获取 progress_channel 对应的回调，未注册（例如 HTTP 接口）时返回 None"""
+    if not channel:
+        return None
+    with _lock:
+        return _listeners.get(channel)
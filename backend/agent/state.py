@@ -14,4 +14,8 @@ class AgentState(TypedDict):
     timeframe: Optional[str]  # 时间周期
     timerange: Optional[str]  # 回测时间范围
     has_strategy: bool  # 会话中是否已有策略代码（用于判断是优化还是生成新策略）
-
+    progress_channel: Optional[str]  # 进度事件回调的标识（见 progress.py），用于实时推送回测进度
+    hyperopt_applied: bool  # 当前策略代码是否已经过参数优化（重新生成代码后重置）
+    hyperopt_results: Optional[Dict[str, Any]]  # 最近一次参数优化的结果（最优参数、指标、耗时）
+    candidate_codes: Optional[List[str]]  # 多候选模式下本轮生成的候选策略代码
+    candidate_results: Optional[List[Dict[str, Any]]]  # 多候选模式下每个候选的评估摘要
@@ -6,6 +6,7 @@ import json
 import asyncio
 import queue
 import threading
+import time
 
 # 加载环境变量（支持不同编码）
 def load_env_with_fallback():
@@ -27,7 +28,7 @@ def load_env_with_fallback():
 
 load_env_with_fallback()
 
-from ..agent.graph import create_graph
+from ..agent.graph import create_graph, graph_recursion_limit
 from ..agent.state import AgentState
 from fastapi.middleware.cors import CORSMiddleware
 
@@ -54,10 +55,164 @@ class StrategyRequest(BaseModel):
     thread_id: str | None = None  # 会话ID，用于记忆管理
     is_new_conversation: bool = False  # 是否开始新对话
 
+@app.on_event("startup")
+async def probe_capabilities_on_startup():
+    """启动时在后台探测运行环境能力"""
+    from ..tools.capabilities import get_capabilities
+    get_capabilities().warm_up()
+
+@app.on_event("startup")
+async def start_data_prefetch():
+    """启动白名单K线数据的后台预取（PREFETCH_ENABLED=true 时）"""
+    from ..tools.data_prefetch import PREFETCH_ENABLED, get_prefetcher
+    if PREFETCH_ENABLED:
+        get_prefetcher().start()
+
 @app.get("/")
 async def root():
     return {"message": "Strategy Agent API is running"}
 
+@app.get("/health")
+async def health(refresh: bool = False):
+    """
+    健康检查和运行环境能力：freqtrade 版本、TA-Lib / pandas_ta 是否可用、支持的K线存储格式和 CPU 核数
+
+    refresh=true 时立即重新探测，否则返回缓存的结果（CAPABILITY_TTL 秒内有效）
+    """
+    from ..tools.capabilities import get_capabilities
+    capabilities = await asyncio.get_event_loop().run_in_executor(None, get_capabilities().get, refresh)
+    return {
+        "status": "ok" if capabilities["freqtrade"]["available"] else "degraded",
+        "capabilities": capabilities
+    }
+
+@app.get("/backtests/scheduler")
+async def backtest_scheduler_status():
+    """回测调度器状态：队列深度、运行中任务、平均排队时间以及每个任务的等待/执行时间"""
+    from ..tools.backtest_scheduler import get_scheduler
+    scheduler = get_scheduler()
+    return {"stats": scheduler.stats(), "jobs": scheduler.list_jobs()}
+
+@app.get("/backtests/cache")
+async def backtest_cache_status():
+    """回测结果缓存统计：命中/未命中次数、条目数和占用空间"""
+    from ..tools.backtest_cache import get_backtest_cache
+    return get_backtest_cache().stats()
+
+@app.get("/data/coverage")
+async def data_coverage(exchange: str | None = None, timeframe: str | None = None):
+    """K线数据覆盖范围索引：每个交易对的第一根/最后一根K线时间、内部缺口和已确认没有数据的区间"""
+    from ..tools.data_coverage import get_coverage_index
+    return {"entries": get_coverage_index().entries(exchange, timeframe)}
+
+@app.get("/data/quality")
+async def data_quality(exchange: str | None = None, timeframe: str | None = None, rescan: bool = False):
+    """K线数据完整性检查：时间戳乱序、重复、缺口、OHLC 不合法、异常值和连续零成交量（已有最新质量附属文件的数据文件不重新检查）"""
+    from ..tools.data_quality import scan_data_dir
+    timeframes = [timeframe] if timeframe else None
+    return await asyncio.get_event_loop().run_in_executor(None, scan_data_dir, exchange, timeframes, False, rescan)
+
+@app.post("/data/quality/repair")
+async def repair_data_quality(exchange: str | None = None, timeframe: str | None = None):
+    """检查并修复K线数据：就地修复乱序和重复的行，可以补齐的缺口提交给下载管理器（不等待下载完成）"""
+    from ..tools.data_quality import scan_data_dir
+    timeframes = [timeframe] if timeframe else None
+    return await asyncio.get_event_loop().run_in_executor(None, scan_data_dir, exchange, timeframes, True, False)
+
+@app.get("/data/downloads")
+async def data_downloads():
+    """下载管理器状态：并发数、下载/合并/跳过/失败的分片数、正在下载的分片和最近的进度事件"""
+    from ..tools.download_manager import get_download_manager
+    return get_download_manager().stats()
+
+@app.get("/data/prefetch")
+async def data_prefetch_status():
+    """后台数据预取状态：预取的时间周期和时间范围、磁盘预算以及上一轮的下载/跳过/超出预算的交易对"""
+    from ..tools.data_prefetch import get_prefetcher
+    return get_prefetcher().status()
+
+@app.post("/data/prefetch/run")
+async def run_data_prefetch():
+    """立即开始一轮后台数据预取"""
+    from ..tools.data_prefetch import get_prefetcher
+    prefetcher = get_prefetcher()
+    prefetcher.trigger()
+    return prefetcher.status()
+
+def _split_query_list(value: str | None) -> list[str] | None:
+    """逗号分隔的查询参数"""
+    if not value:
+        return None
+    return [item.strip() for item in value.split(",") if item.strip()]
+
+@app.get("/backtests/history")
+async def backtest_history(timeframe: str | None = None, pairs: str | None = None, pair: str | None = None,
+                           timerange: str | None = None, code_hash: str | None = None,
+                           status: str | None = "success", days: float | None = None,
+                           min_trades: int | None = None, sort: str = "created_at", order: str = "desc",
+                           limit: int = 20, offset: int = 0):
+    """
+    筛选和排序回测历史
+
+    pairs 为逗号分隔的交易对集合（完全匹配），pair 为逗号分隔的交易对（回测包含这些交易对即可），
+    days 为最近几天，status 为 all 时不限成功/失败。
+    例如最近一周 1h BTC/USDT 上夏普比率最高的 20 个策略:
+    /backtests/history?timeframe=1h&pairs=BTC/USDT&days=7&sort=sharpe&limit=20
+    """
+    from ..tools.backtest_history import get_backtest_history
+    if order not in ("asc", "desc"):
+        raise HTTPException(status_code=400, detail=f"order 只能为 asc 或 desc: {order}")
+    try:
+        records = get_backtest_history().query(
+            timeframe=timeframe,
+            pairs=_split_query_list(pairs),
+            pair=_split_query_list(pair),
+            timerange=timerange,
+            code_hash=code_hash,
+            status=None if status == "all" else status,
+            since=time.time() - days * 86400 if days is not None else None,
+            min_trades=min_trades,
+            sort=sort,
+            descending=order == "desc",
+            limit=max(1, min(limit, 500)),
+            offset=max(0, offset)
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return {"count": len(records), "records": records}
+
+@app.get("/backtests/history/stats")
+async def backtest_history_stats():
+    """回测历史统计：记录数、成功/失败数、不同策略数和数据库大小"""
+    from ..tools.backtest_history import get_backtest_history
+    return get_backtest_history().stats()
+
+@app.get("/backtests/history/{record_id}")
+async def backtest_history_record(record_id: int):
+    """单条回测记录：完整指标、策略参数、耗时、结果文件路径和策略代码"""
+    from ..tools.backtest_history import get_backtest_history
+    record = get_backtest_history().get(record_id)
+    if record is None:
+        raise HTTPException(status_code=404, detail=f"回测记录不存在: {record_id}")
+    return record
+
+@app.get("/backtests/jobs/{job_id}")
+async def backtest_job_status(job_id: str):
+    """查询单个回测任务的状态"""
+    from ..tools.backtest_scheduler import get_scheduler
+    job = get_scheduler().get_job(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"回测任务不存在: {job_id}")
+    return job.to_dict()
+
+@app.post("/backtests/jobs/{job_id}/cancel")
+async def cancel_backtest_job(job_id: str):
+    """取消排队中或运行中的回测任务"""
+    from ..tools.backtest_scheduler import get_scheduler
+    if not get_scheduler().cancel(job_id):
+        raise HTTPException(status_code=404, detail=f"回测任务不存在或已结束: {job_id}")
+    return {"job_id": job_id, "cancelled": True}
+
 @app.post("/generate_strategy")
 async def generate_strategy(request: StrategyRequest):
     """
@@ -112,7 +267,12 @@ async def generate_strategy(request: StrategyRequest):
         "pairs": request.pairs,
         "timeframe": request.timeframe,
         "timerange": request.timerange,
-        "has_strategy": has_strategy
+        "has_strategy": has_strategy,
+        "progress_channel": None,  # HTTP 接口不推送回测进度
+        "hyperopt_applied": False,
+        "hyperopt_results": None,
+        "candidate_codes": None,
+        "candidate_results": None
     }
     
     # 如果会话中已有策略，恢复状态
@@ -131,7 +291,7 @@ async def generate_strategy(request: StrategyRequest):
     try:
         # 运行图，传入 thread_id
         import asyncio
-        config = {"configurable": {"thread_id": thread_id}}
+        config = {"configurable": {"thread_id": thread_id}, "recursion_limit": graph_recursion_limit()}
         final_state = await asyncio.get_event_loop().run_in_executor(
             None, lambda: agent_graph.invoke(initial_state, config)
         )
@@ -183,28 +343,44 @@ async def websocket_generate_strategy(websocket: WebSocket):
             "node": None
         })
         
+        # 在线程池中下载，每个交易对的进度事件通过队列转发
         from ..tools.data_downloader import download_data_if_needed
-        download_result = download_data_if_needed(
+        download_queue = queue.Queue()
+        download_task = asyncio.get_event_loop().run_in_executor(None, lambda: download_data_if_needed(
             pairs=request.pairs,
             timeframe=request.timeframe,
             timerange=request.timerange,
-            force_download=False
-        )
-        
-        if download_result.get("success"):
+            force_download=False,
+            progress_callback=download_queue.put
+        ))
+        while not download_task.done() or not download_queue.empty():
+            try:
+                event = download_queue.get_nowait()
+            except queue.Empty:
+                await asyncio.sleep(0.1)
+                continue
             await websocket.send_json({
                 "type": "step",
-                "step": "data_downloaded",
-                "message": "数据下载完成",
-                "node": None
+                "step": "download_progress",
+                "node": None,
+                **event
             })
-        elif download_result.get("skipped"):
+        download_result = await download_task
+        
+        if download_result.get("skipped"):
             await websocket.send_json({
                 "type": "step",
                 "step": "data_skipped",
                 "message": "数据已存在，跳过下载",
                 "node": None
             })
+        elif download_result.get("success"):
+            await websocket.send_json({
+                "type": "step",
+                "step": "data_downloaded",
+                "message": "数据下载完成",
+                "node": None
+            })
         else:
             await websocket.send_json({
                 "type": "step",
@@ -252,7 +428,11 @@ async def websocket_generate_strategy(websocket: WebSocket):
             "pairs": request.pairs,
             "timeframe": request.timeframe,
             "timerange": request.timerange,
-            "has_strategy": has_strategy  # 设置会话记忆标志
+            "has_strategy": has_strategy,  # 设置会话记忆标志
+            "hyperopt_applied": False,
+            "hyperopt_results": None,
+            "candidate_codes": None,
+            "candidate_results": None
         }
         
         # 如果会话中已有策略，从之前的检查点恢复状态
@@ -274,13 +454,23 @@ async def websocket_generate_strategy(websocket: WebSocket):
         step_queue = queue.Queue()
         final_state_container = {"state": None, "error": None}
         
+        # 回测进度事件（阶段变化、警告和错误日志）也通过步骤队列推送
+        from ..agent.progress import register_progress_listener, unregister_progress_listener
+        progress_channel = register_progress_listener(lambda event: step_queue.put({
+            "type": "step",
+            "step": "backtest_progress",
+            "node": "backtest_executor",
+            **event
+        }))
+        initial_state["progress_channel"] = progress_channel
+        
         def run_graph_with_stream():
             """在后台线程中运行图，将步骤信息放入队列"""
             try:
                 final_state = None
                 
                 # 配置 thread_id 用于会话记忆
-                config = {"configurable": {"thread_id": thread_id}}
+                config = {"configurable": {"thread_id": thread_id}, "recursion_limit": graph_recursion_limit()}
                 
                 # 使用stream模式获取每个节点的执行信息，传入 thread_id
                 for event in agent_graph.stream(initial_state, config):
@@ -309,11 +499,36 @@ async def websocket_generate_strategy(websocket: WebSocket):
                                 "message": "语法检查完成" if not has_errors else "发现语法错误，需要修复",
                                 "has_errors": has_errors
                             })
+                        elif node_name == "preflight_checker":
+                            has_errors = bool(state_update.get("error_logs"))
+                            step_info.update({
+                                "step": "preflight_checked",
+                                "message": "策略预检完成" if not has_errors else "预检发现错误，需要修复",
+                                "has_errors": has_errors
+                            })
                         elif node_name == "backtest_executor":
                             step_info.update({
                                 "step": "backtest_running",
                                 "message": "正在执行回测...",
                             })
+                        elif node_name == "candidate_evaluator":
+                            has_errors = bool(state_update.get("error_logs"))
+                            step_info.update({
+                                "step": "candidates_evaluated",
+                                "message": "已从多个候选策略中选出最优策略" if not has_errors
+                                           else "所有候选策略都存在错误，需要修复",
+                                "candidates": state_update.get("candidate_results"),
+                                "has_errors": has_errors
+                            })
+                        elif node_name == "hyperopt":
+                            hyperopt_results = state_update.get("hyperopt_results") or {}
+                            step_info.update({
+                                "step": "hyperopt_completed",
+                                "message": "参数优化完成，使用最优参数重新回测" if hyperopt_results.get("success")
+                                           else f"参数优化未完成: {hyperopt_results.get('error', '')}",
+                                "params": hyperopt_results.get("params"),
+                                "has_code": bool(state_update.get("current_code"))
+                            })
                         elif node_name == "evaluator":
                             is_satisfactory = state_update.get("is_satisfactory", False)
                             step_info.update({
@@ -375,7 +590,10 @@ async def websocket_generate_strategy(websocket: WebSocket):
                     break
         
         # 等待executor完成并发送步骤
-        await asyncio.gather(executor_task, send_steps())
+        try:
+            await asyncio.gather(executor_task, send_steps())
+        finally:
+            unregister_progress_listener(progress_channel)
         
         # 获取最终状态
         if final_state_container["error"]:
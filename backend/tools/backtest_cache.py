@@ -0,0 +1,243 @@
+"""
+回测结果缓存
+以策略代码（规范化后的 AST）、回测参数、config.json 内容和 K 线数据文件指纹的哈希为键，
+将成功的回测结果持久化到磁盘，相同的回测直接返回缓存结果而不再启动 freqtrade。
+"""
+import ast
+import copy
+import hashlib
+import json
+import os
+import threading
+import time
+from typing import Any, Dict, List, Optional
+
+from .backtest_timeout import config_pairs
+from .candle_store import CANDLE_DATA_FORMAT, candle_file_path, pair_to_filename
+from .data_quality import data_fingerprint
+
+CURRENT_DIR = os.path.dirname(os.path.abspath(__file__))
+PROJECT_ROOT = os.path.dirname(os.path.dirname(CURRENT_DIR))
+FREQTRADE_WORKER_DIR = os.path.join(PROJECT_ROOT, "freqtrade_worker")
+CONFIG_PATH = os.path.join(FREQTRADE_WORKER_DIR, "user_data", "config.json")
+BACKTEST_CACHE_DIR = os.path.join(FREQTRADE_WORKER_DIR, "user_data", "backtest_cache")
+
+# 是否启用回测结果缓存
+BACKTEST_CACHE_ENABLED = os.getenv("BACKTEST_CACHE_ENABLED", "true").lower() == "true"
+# 缓存总大小上限（MB），超出后按最近访问时间淘汰
+BACKTEST_CACHE_MAX_MB = float(os.getenv("BACKTEST_CACHE_MAX_MB", "200"))
+# 缓存有效期（小时）
+BACKTEST_CACHE_MAX_AGE_HOURS = float(os.getenv("BACKTEST_CACHE_MAX_AGE_HOURS", "168"))
+
+# 缓存键格式版本，键的组成方式变化时递增，使旧缓存失效
+CACHE_KEY_VERSION = 3
+
+
+class _StripDocstrings(ast.NodeTransformer):
+    """移除模块、类和函数的文档字符串（不影响策略行为）"""
+
+    def _strip(self, node):
+        self.generic_visit(node)
+        body = getattr(node, "body", None)
+        if (body and isinstance(body[0], ast.Expr) and isinstance(body[0].value, ast.Constant)
+                and isinstance(body[0].value.value, str)):
+            node.body = body[1:] or [ast.Pass()]
+        return node
+
+    visit_Module = visit_ClassDef = visit_FunctionDef = visit_AsyncFunctionDef = _strip
+
+
+def normalize_strategy_code(strategy_code: str) -> str:
+    """
+    规范化策略代码：解析为 AST 并移除文档字符串
+
+    注释、空行、格式差异以及文档字符串不同的代码得到相同的结果；无法解析时返回原始代码。
+    """
+    try:
+        tree = _StripDocstrings().visit(ast.parse(strategy_code))
+    except SyntaxError:
+        return strategy_code
+    return ast.dump(tree, annotate_fields=False)
+
+
+def _hash_file(path: str) -> str:
+    if not os.path.exists(path):
+        return ""
+    with open(path, "rb") as f:
+        return hashlib.sha256(f.read()).hexdigest()
+
+
+def _result_files_exist(result: Dict[str, Any]) -> bool:
+    """回测结果引用的结果文件（full_result_path，分片回测为 shard_result_paths）是否都还存在"""
+    metrics = result.get("metrics") or {}
+    paths = [metrics.get("full_result_path")] + list(metrics.get("shard_result_paths") or [])
+    return all(os.path.exists(path) for path in paths if path)
+
+
+class BacktestCache:
+    """基于内容寻址的回测结果磁盘缓存"""
+
+    def __init__(self, cache_dir: str = BACKTEST_CACHE_DIR, max_mb: float = BACKTEST_CACHE_MAX_MB,
+                 max_age_hours: float = BACKTEST_CACHE_MAX_AGE_HOURS):
+        self.cache_dir = cache_dir
+        self.max_bytes = int(max_mb * 1024 * 1024)
+        self.max_age_seconds = max_age_hours * 3600
+        self._lock = threading.Lock()
+        self._counters = {"hits": 0, "misses": 0, "stores": 0, "evictions": 0}
+        os.makedirs(self.cache_dir, exist_ok=True)
+
+    def make_key(self, strategy_code: str, pairs: Optional[List[str]], timeframe: str, timerange: str,
+                 exchange: str = "okx", config_path: str = CONFIG_PATH,
+                 execution: Optional[Dict[str, Any]] = None) -> str:
+        """
+        计算缓存键
+
+        组成: 规范化的策略 AST、排序后的交易对、时间周期、时间范围、config.json 内容哈希、
+        每个交易对 K 线文件的指纹（文件名和内容校验和，没有最新的质量附属文件时为大小和修改时间，见 data_quality.py；
+        未指定交易对时为 config.json 的 pair_whitelist 中的交易对）、
+        执行方式 execution（是否模拟、是否按交易对分片及分片数量，见 freqtrade_mcp.execution_mode；
+        分片回测的组合指标与单进程回测不同，不能互相复用）
+        """
+        data_fingerprints = []
+        for pair in sorted(pairs or config_pairs(config_path)):
+            path = candle_file_path(pair, timeframe, exchange, CANDLE_DATA_FORMAT)
+            if not os.path.exists(path):
+                data_fingerprints.append([pair_to_filename(pair), None, None])
+            else:
+                data_fingerprints.append(data_fingerprint(path))
+
+        payload = json.dumps({
+            "version": CACHE_KEY_VERSION,
+            "strategy": normalize_strategy_code(strategy_code),
+            "pairs": sorted(pairs or []),
+            "timeframe": timeframe,
+            "timerange": timerange,
+            "config": _hash_file(config_path),
+            "data": data_fingerprints,
+            "execution": execution or {},
+        }, sort_keys=True)
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def _entry_path(self, key: str) -> str:
+        return os.path.join(self.cache_dir, key[:2], f"{key}.json")
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        """读取缓存结果，不存在或已过期时返回 None"""
+        path = self._entry_path(key)
+        try:
+            if time.time() - os.path.getmtime(path) > self.max_age_seconds:
+                os.remove(path)
+                raise FileNotFoundError(path)
+            with open(path, "r", encoding="utf-8") as f:
+                entry = json.load(f)
+            # 结果引用的回测工作目录已被清理（BACKTEST_RUNS_KEEP）时作为未命中处理，重新回测
+            if not _result_files_exist(entry["result"]):
+                os.remove(path)
+                raise FileNotFoundError(path)
+            # 更新访问时间，用于按最近访问淘汰
+            os.utime(path, None)
+        except (OSError, ValueError, KeyError):
+            with self._lock:
+                self._counters["misses"] += 1
+            return None
+
+        with self._lock:
+            self._counters["hits"] += 1
+        result = entry["result"]
+        result["cache_hit"] = True
+        result["cached_at"] = entry["created_at"]
+        return result
+
+    def put(self, key: str, result: Dict[str, Any]):
+        """写入缓存（先写临时文件再原子性替换），然后执行淘汰"""
+        path = self._entry_path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        entry = {"key": key, "created_at": time.time(), "result": copy.deepcopy(result)}
+        temp_path = f"{path}.{threading.get_ident()}.tmp"
+        with open(temp_path, "w", encoding="utf-8") as f:
+            json.dump(entry, f, ensure_ascii=False)
+        os.replace(temp_path, path)
+
+        with self._lock:
+            self._counters["stores"] += 1
+        self.evict()
+
+    def _entries(self) -> List[os.DirEntry]:
+        entries = []
+        for sub in os.scandir(self.cache_dir):
+            if sub.is_dir():
+                entries.extend(e for e in os.scandir(sub.path) if e.name.endswith(".json"))
+        return entries
+
+    def evict(self) -> int:
+        """删除过期的缓存，并在总大小超过上限时按最近访问时间从旧到新删除"""
+        now = time.time()
+        entries = []
+        evicted = 0
+        for entry in self._entries():
+            try:
+                stat = entry.stat()
+            except OSError:
+                continue
+            if now - stat.st_mtime > self.max_age_seconds:
+                evicted += self._remove(entry.path)
+            else:
+                entries.append((stat.st_mtime, stat.st_size, entry.path))
+
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            evicted += self._remove(path)
+            total -= size
+
+        with self._lock:
+            self._counters["evictions"] += evicted
+        return evicted
+
+    @staticmethod
+    def _remove(path: str) -> int:
+        try:
+            os.remove(path)
+            return 1
+        except OSError:
+            return 0
+
+    def clear(self):
+        """清空缓存"""
+        for entry in self._entries():
+            self._remove(entry.path)
+
+    def stats(self) -> Dict[str, Any]:
+        """缓存统计：命中/未命中次数、命中率、条目数和占用空间"""
+        sizes = []
+        for entry in self._entries():
+            try:
+                sizes.append(entry.stat().st_size)
+            except OSError:
+                # 统计期间被其他线程淘汰
+                continue
+        with self._lock:
+            counters = dict(self._counters)
+        lookups = counters["hits"] + counters["misses"]
+        return {
+            **counters,
+            "hit_rate": round(counters["hits"] / lookups, 4) if lookups else 0.0,
+            "entries": len(sizes),
+            "size_mb": round(sum(sizes) / (1024 * 1024), 3),
+            "max_mb": self.max_bytes / (1024 * 1024),
+            "max_age_hours": self.max_age_seconds / 3600,
+        }
+
+
+_cache: Optional[BacktestCache] = None
+_cache_lock = threading.Lock()
+
+
+def get_backtest_cache() -> BacktestCache:
+    """获取全局回测缓存实例"""
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            _cache = BacktestCache()
+        return _cache
@@ -0,0 +1,332 @@
+"""
+回测历史记录
+每次真实回测（成功或失败）写入本地 SQLite 数据库，记录策略代码哈希、回测参数、完整指标、耗时和结果文件路径，
+不依赖 LangGraph 的会话状态，可以跨迭代、跨会话比较和筛选策略（例如最近一周 1h BTC/USDT 上夏普比率最高的 20 个策略）。
+"""
+import ast
+import contextlib
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from typing import Any, Dict, List, Optional
+
+from .backtest_cache import normalize_strategy_code
+
+CURRENT_DIR = os.path.dirname(os.path.abspath(__file__))
+PROJECT_ROOT = os.path.dirname(os.path.dirname(CURRENT_DIR))
+FREQTRADE_WORKER_DIR = os.path.join(PROJECT_ROOT, "freqtrade_worker")
+CONFIG_PATH = os.path.join(FREQTRADE_WORKER_DIR, "user_data", "config.json")
+BACKTEST_HISTORY_PATH = os.path.join(FREQTRADE_WORKER_DIR, "user_data", "backtest_history.sqlite")
+
+# 是否记录回测历史
+BACKTEST_HISTORY_ENABLED = os.getenv("BACKTEST_HISTORY_ENABLED", "true").lower() == "true"
+
+# 单独存为列（可筛选、排序）的指标，完整指标以 JSON 保存在 metrics 列
+METRIC_COLUMNS = [
+    "total_trades", "profit_total_pct", "profit_total_abs", "max_drawdown_pct", "win_rate",
+    "sharpe", "sortino", "profit_factor", "expectancy",
+]
+SORTABLE_COLUMNS = set(METRIC_COLUMNS) | {"created_at", "elapsed", "id"}
+# 查询结果中列表项返回的列（不含代码和完整指标）
+SUMMARY_COLUMNS = [
+    "id", "created_at", "code_hash", "strategy_name", "exchange", "timeframe", "timerange", "pairs",
+    "status", "error_type", *METRIC_COLUMNS, "elapsed", "run_id", "artifact_path",
+]
+
+SCHEMA = f"""
+CREATE TABLE IF NOT EXISTS strategy_code (
+    code_hash TEXT PRIMARY KEY,
+    code TEXT NOT NULL,
+    created_at REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS backtest_runs (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    created_at REAL NOT NULL,
+    code_hash TEXT NOT NULL,
+    strategy_name TEXT,
+    strategy_params TEXT,
+    exchange TEXT,
+    timeframe TEXT NOT NULL,
+    timerange TEXT,
+    pairs TEXT NOT NULL,
+    status TEXT NOT NULL,
+    error_type TEXT,
+    error TEXT,
+    {", ".join(f"{column} REAL" for column in METRIC_COLUMNS)},
+    metrics TEXT,
+    elapsed REAL,
+    timeout_budget TEXT,
+    run_id TEXT,
+    log_path TEXT,
+    artifact_path TEXT
+);
+CREATE TABLE IF NOT EXISTS backtest_run_pairs (
+    run_id INTEGER NOT NULL REFERENCES backtest_runs(id) ON DELETE CASCADE,
+    pair TEXT NOT NULL,
+    PRIMARY KEY (pair, run_id)
+);
+CREATE INDEX IF NOT EXISTS idx_runs_timeframe_pairs_created ON backtest_runs (timeframe, pairs, created_at);
+CREATE INDEX IF NOT EXISTS idx_runs_created ON backtest_runs (created_at);
+CREATE INDEX IF NOT EXISTS idx_runs_sharpe ON backtest_runs (status, sharpe);
+CREATE INDEX IF NOT EXISTS idx_runs_code_hash ON backtest_runs (code_hash, created_at);
+"""
+
+
+def hash_strategy_code(strategy_code: str) -> str:
+    """策略代码哈希（规范化 AST，忽略注释和格式差异，与回测缓存一致）"""
+    return hashlib.sha256(normalize_strategy_code(strategy_code).encode("utf-8")).hexdigest()
+
+
+def extract_strategy_info(strategy_code: str) -> Dict[str, Any]:
+    """
+    从策略代码中提取策略类名和类属性中的常量参数（stoploss、minimal_roi、trailing_* 等）
+
+    只解析 AST，不执行代码；无法解析或不是常量的属性忽略。
+    """
+    try:
+        tree = ast.parse(strategy_code)
+    except SyntaxError:
+        return {"name": None, "params": {}}
+    for node in tree.body:
+        if not isinstance(node, ast.ClassDef):
+            continue
+        params = {}
+        for statement in node.body:
+            if isinstance(statement, ast.Assign) and len(statement.targets) == 1:
+                target, value = statement.targets[0], statement.value
+            elif isinstance(statement, ast.AnnAssign) and statement.value is not None:
+                target, value = statement.target, statement.value
+            else:
+                continue
+            if not isinstance(target, ast.Name):
+                continue
+            try:
+                params[target.id] = ast.literal_eval(value)
+            except (ValueError, TypeError, SyntaxError, RecursionError):
+                continue
+        return {"name": node.name, "params": params}
+    return {"name": None, "params": {}}
+
+
+def normalize_pairs(pairs: Optional[List[str]]) -> List[str]:
+    return sorted(set(pairs or []))
+
+
+def _config_exchange(config_path: str = CONFIG_PATH) -> Dict[str, Any]:
+    try:
+        with open(config_path, "r", encoding="utf-8") as f:
+            return json.load(f).get("exchange", {})
+    except (OSError, ValueError):
+        return {}
+
+
+def _to_float(value: Any) -> Optional[float]:
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+
+class BacktestHistory:
+    """基于 SQLite 的回测历史记录"""
+
+    def __init__(self, path: str = BACKTEST_HISTORY_PATH):
+        self.path = path
+        self._write_lock = threading.Lock()
+        self._local = threading.local()
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with self._connect() as conn:
+            conn.executescript(SCHEMA)
+
+    @contextlib.contextmanager
+    def _connect(self):
+        """
+        当前线程的数据库连接，正常结束时提交事务
+
+        每个线程复用自己的连接：关闭 WAL 模式下的最后一个连接会触发检查点和 fsync，每次操作都重新连接会很慢。
+        """
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30)
+            conn.row_factory = sqlite3.Row
+            conn.execute("PRAGMA journal_mode=WAL")
+            # WAL 模式下 NORMAL 不会损坏数据库，只是断电时可能丢失最近提交的记录
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute("PRAGMA foreign_keys=ON")
+            self._local.conn = conn
+        with conn:
+            yield conn
+
+    def record(self, strategy_code: str, result: Dict[str, Any], pairs: Optional[List[str]], timeframe: str,
+               timerange: Optional[str], elapsed: Optional[float] = None,
+               exchange: Optional[str] = None) -> int:
+        """
+        记录一次回测
+
+        Args:
+            strategy_code: 策略代码
+            result: run_freqtrade_backtest / run_sharded_backtest 的返回值
+            pairs: 交易对列表（未指定时为 config.json 的 pair_whitelist）
+            timeframe: 时间周期
+            timerange: 时间范围
+            elapsed: 回测耗时（秒，包括排队时间）
+            exchange: 交易所名称，默认读取 config.json
+
+        Returns:
+            int: 记录 ID
+        """
+        code_hash = hash_strategy_code(strategy_code)
+        info = extract_strategy_info(strategy_code)
+        config_exchange = _config_exchange()
+        pairs = normalize_pairs(pairs or config_exchange.get("pair_whitelist"))
+        metrics = result.get("metrics") or {}
+        success = "error" not in result
+        if elapsed is None:
+            elapsed = result.get("elapsed")
+
+        row = {
+            "created_at": time.time(),
+            "code_hash": code_hash,
+            "strategy_name": info["name"],
+            "strategy_params": json.dumps(info["params"], ensure_ascii=False, default=str),
+            "exchange": exchange or config_exchange.get("name"),
+            "timeframe": timeframe,
+            "timerange": timerange,
+            "pairs": ",".join(pairs),
+            "status": "success" if success else "error",
+            "error_type": None if success else result.get("error_type", "execution_error"),
+            "error": None if success else str(result.get("error", ""))[:2000],
+            **{column: _to_float(metrics.get(column)) for column in METRIC_COLUMNS},
+            "metrics": json.dumps(metrics, ensure_ascii=False, default=str) if metrics else None,
+            "elapsed": _to_float(elapsed),
+            "timeout_budget": json.dumps(result["timeout_budget"]) if result.get("timeout_budget") else None,
+            "run_id": result.get("run_id"),
+            "log_path": result.get("log_path"),
+            "artifact_path": metrics.get("full_result_path") or None,
+        }
+
+        columns = ", ".join(row)
+        placeholders = ", ".join(f":{column}" for column in row)
+        with self._write_lock, self._connect() as conn:
+            conn.execute(
+                "INSERT OR IGNORE INTO strategy_code (code_hash, code, created_at) VALUES (?, ?, ?)",
+                (code_hash, strategy_code, row["created_at"])
+            )
+            cursor = conn.execute(f"INSERT INTO backtest_runs ({columns}) VALUES ({placeholders})", row)
+            run_id = cursor.lastrowid
+            conn.executemany(
+                "INSERT INTO backtest_run_pairs (run_id, pair) VALUES (?, ?)",
+                [(run_id, pair) for pair in pairs]
+            )
+        return run_id
+
+    def query(self, timeframe: Optional[str] = None, pairs: Optional[List[str]] = None,
+              pair: Optional[List[str]] = None, timerange: Optional[str] = None,
+              code_hash: Optional[str] = None, status: Optional[str] = "success",
+              since: Optional[float] = None, until: Optional[float] = None,
+              min_trades: Optional[int] = None, sort: str = "created_at", descending: bool = True,
+              limit: int = 20, offset: int = 0) -> List[Dict[str, Any]]:
+        """
+        筛选和排序回测历史
+
+        Args:
+            timeframe: 时间周期
+            pairs: 交易对集合完全相同的回测
+            pair: 包含所有这些交易对的回测
+            timerange: 时间范围
+            code_hash: 策略代码哈希
+            status: "success" / "error"，None 表示不限
+            since, until: 记录时间范围（Unix 时间戳）
+            min_trades: 最少交易次数
+            sort: 排序列（SORTABLE_COLUMNS 之一）
+            descending: 是否降序
+            limit, offset: 分页
+
+        Returns:
+            List[Dict]: 回测摘要（SUMMARY_COLUMNS）
+        """
+        if sort not in SORTABLE_COLUMNS:
+            raise ValueError(f"不支持的排序字段: {sort}，可选: {', '.join(sorted(SORTABLE_COLUMNS))}")
+
+        conditions = []
+        params: List[Any] = []
+        for column, value in (("timeframe", timeframe), ("timerange", timerange),
+                              ("code_hash", code_hash), ("status", status)):
+            if value is not None:
+                conditions.append(f"{column} = ?")
+                params.append(value)
+        if pairs:
+            conditions.append("pairs = ?")
+            params.append(",".join(normalize_pairs(pairs)))
+        for single_pair in normalize_pairs(pair):
+            conditions.append("EXISTS (SELECT 1 FROM backtest_run_pairs p WHERE p.pair = ? AND p.run_id = r.id)")
+            params.append(single_pair)
+        if since is not None:
+            conditions.append("created_at >= ?")
+            params.append(since)
+        if until is not None:
+            conditions.append("created_at < ?")
+            params.append(until)
+        if min_trades is not None:
+            conditions.append("total_trades >= ?")
+            params.append(min_trades)
+
+        where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+        # 排序字段为空的记录（如失败的回测没有夏普比率）排在最后
+        order = f"{sort} IS NULL, {sort} {'DESC' if descending else 'ASC'}, id DESC"
+        sql = (f"SELECT {', '.join(SUMMARY_COLUMNS)} FROM backtest_runs r {where} "
+               f"ORDER BY {order} LIMIT ? OFFSET ?")
+        with self._connect() as conn:
+            rows = conn.execute(sql, [*params, limit, offset]).fetchall()
+        return [self._summary(row) for row in rows]
+
+    @staticmethod
+    def _summary(row: sqlite3.Row) -> Dict[str, Any]:
+        item = dict(row)
+        item["pairs"] = item["pairs"].split(",") if item["pairs"] else []
+        return item
+
+    def get(self, record_id: int, include_code: bool = True) -> Optional[Dict[str, Any]]:
+        """读取单条回测记录（含完整指标、策略参数和策略代码）"""
+        with self._connect() as conn:
+            row = conn.execute("SELECT * FROM backtest_runs WHERE id = ?", (record_id,)).fetchone()
+            if row is None:
+                return None
+            item = self._summary(row)
+            for column in ("strategy_params", "metrics", "timeout_budget"):
+                item[column] = json.loads(item[column]) if item[column] else None
+            if include_code:
+                code = conn.execute("SELECT code FROM strategy_code WHERE code_hash = ?",
+                                    (item["code_hash"],)).fetchone()
+                item["code"] = code["code"] if code else None
+        return item
+
+    def stats(self) -> Dict[str, Any]:
+        """记录总数、成功/失败数、不同策略数和数据库大小"""
+        with self._connect() as conn:
+            row = conn.execute(
+                "SELECT COUNT(*) AS total, SUM(status = 'success') AS succeeded, "
+                "COUNT(DISTINCT code_hash) AS strategies, MIN(created_at) AS first_at, "
+                "MAX(created_at) AS last_at FROM backtest_runs"
+            ).fetchone()
+        stats = dict(row)
+        stats["succeeded"] = stats["succeeded"] or 0
+        stats["failed"] = stats["total"] - stats["succeeded"]
+        stats["size_mb"] = round(os.path.getsize(self.path) / (1024 * 1024), 3) if os.path.exists(self.path) else 0.0
+        return stats
+
+
+_history: Optional[BacktestHistory] = None
+_history_lock = threading.Lock()
+
+
+def get_backtest_history() -> BacktestHistory:
+    """获取全局回测历史实例"""
+    global _history
+    with _history_lock:
+        if _history is None:
+            _history = BacktestHistory()
+        return _history
@@ -0,0 +1,242 @@
+"""
+Freqtrade 回测结果文件读取工具
+直接读取 freqtrade 导出的 .meta.json / .zip 结果文件（旧版本为 .json），
+不再从 stdout 的文本表格中解析指标
+"""
+import json
+import os
+import zipfile
+from typing import Any, Dict, List, Optional
+
+# 本次回测最新结果文件的索引，由 freqtrade 写入导出目录
+LAST_RESULT_FILENAME = ".last_result.json"
+
+# 每个交易对保留的统计字段
+PAIR_FIELDS = ["trades", "profit_total_abs", "profit_total_pct", "profit_mean_pct", "wins", "draws", "losses",
+               "max_drawdown_account"]
+
+# detailed_metrics 中由交易明细计算的字段及没有交易时的默认值
+TRADE_METRIC_DEFAULTS = {
+    "max_drawdown_duration_days": 0.0,
+    "holding_avg_hours": 0.0,
+    "exposure_pct": 0.0,
+    "avg_open_trades": 0.0,
+    "max_open_trades": 0,
+}
+
+
+def _round(value: Any, digits: int = 4) -> Any:
+    return round(value, digits) if isinstance(value, float) else value
+
+
+def _pct(value: Optional[float]) -> float:
+    """比例转换为百分比"""
+    return round((value or 0.0) * 100, 2)
+
+
+class BacktestResult:
+    """
+    单次回测的结果
+
+    metrics 为结构化的汇总指标（字段名与评估节点和报告使用的一致，百分比字段以 % 为单位），只使用 freqtrade 的统计；
+    detailed_metrics 另外包含由交易明细计算的指标，trades 在首次访问时才构建 DataFrame。
+    """
+
+    def __init__(self, result_path: str, strategy_name: str, stats: Dict[str, Any],
+                 meta: Optional[Dict[str, Any]] = None):
+        self.result_path = result_path
+        self.strategy_name = strategy_name
+        self.meta = meta or {}
+        self._raw_trades: List[Dict[str, Any]] = stats.pop("trades", [])
+        self.stats = stats
+        self._trades = None
+        self._trade_metrics: Optional[Dict[str, Any]] = None
+
+    @classmethod
+    def from_export_dir(cls, export_dir: str, strategy_name: Optional[str] = None) -> Optional["BacktestResult"]:
+        """
+        从回测导出目录读取结果
+
+        freqtrade 会在导出目录写入 .last_result.json 记录最新的结果文件名，
+        每次回测都有独立的导出目录，因此不需要扫描目录或按修改时间猜测。
+
+        Returns:
+            BacktestResult: 导出目录中没有结果时返回 None
+        """
+        last_result_path = os.path.join(export_dir, LAST_RESULT_FILENAME)
+        if not os.path.exists(last_result_path):
+            return None
+        with open(last_result_path, "r", encoding="utf-8") as f:
+            latest = json.load(f).get("latest_backtest")
+        if not latest:
+            return None
+        return cls.from_file(os.path.join(export_dir, latest), strategy_name)
+
+    @classmethod
+    def from_file(cls, result_path: str, strategy_name: Optional[str] = None) -> "BacktestResult":
+        """
+        读取结果文件（新版 freqtrade 的 .zip 或旧版的 .json）
+
+        Args:
+            result_path: 结果文件路径
+            strategy_name: 策略类名，未指定时取结果中的第一个策略
+        """
+        stem = result_path[:-4] if result_path.endswith(".zip") else result_path[:-5]
+
+        if result_path.endswith(".zip"):
+            with zipfile.ZipFile(result_path) as zf:
+                data = json.loads(zf.read(f"{os.path.basename(stem)}.json"))
+        else:
+            with open(result_path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+
+        meta = {}
+        meta_path = f"{stem}.meta.json"
+        if os.path.exists(meta_path):
+            with open(meta_path, "r", encoding="utf-8") as f:
+                meta = json.load(f)
+
+        strategies = data.get("strategy", {})
+        if not strategies:
+            raise ValueError(f"回测结果中没有策略数据: {result_path}")
+        if strategy_name is None or strategy_name not in strategies:
+            strategy_name = next(iter(strategies))
+
+        return cls(result_path, strategy_name, strategies[strategy_name], meta.get(strategy_name, {}))
+
+    @property
+    def trades(self):
+        """交易明细（pandas DataFrame，首次访问时构建）"""
+        if self._trades is None:
+            import pandas as pd
+
+            trades = pd.DataFrame(self._raw_trades)
+            for col in ("open_date", "close_date"):
+                if col in trades.columns:
+                    trades[col] = pd.to_datetime(trades[col], utc=True)
+            self._trades = trades
+        return self._trades
+
+    @property
+    def trade_metrics(self) -> Dict[str, Any]:
+        """由交易明细计算的指标（freqtrade 统计中没有的持仓暴露度、水下持续时间等，首次访问时计算）"""
+        if self._trade_metrics is None:
+            from .trade_metrics import compute_trade_metrics
+
+            s = self.stats
+            if len(self.trades):
+                self._trade_metrics = compute_trade_metrics(
+                    self.trades, s.get("starting_balance") or 0.0, s.get("backtest_start"), s.get("backtest_end"))
+            else:
+                self._trade_metrics = {}
+        return self._trade_metrics
+
+    @property
+    def metrics(self) -> Dict[str, Any]:
+        """结构化的汇总指标（可 JSON 序列化，不构建交易明细）"""
+        s = self.stats
+        total_trades = s.get("total_trades", 0)
+        wins = s.get("wins", 0)
+        winrate = s.get("winrate")
+        if winrate is None:
+            winrate = wins / total_trades if total_trades else 0.0
+        max_drawdown = s.get("max_drawdown_account", s.get("max_relative_drawdown", 0.0))
+
+        per_pair = [
+            {"pair": row.get("key"), **{k: _round(row.get(k)) for k in PAIR_FIELDS if k in row}}
+            for row in s.get("results_per_pair", [])
+            if row.get("key") != "TOTAL"
+        ]
+        return {
+            # 评估节点和报告使用的字段
+            "total_trades": total_trades,
+            "profit_total_abs": _round(s.get("profit_total_abs", 0.0), 3),
+            "profit_total_pct": _pct(s.get("profit_total")),
+            "max_drawdown_pct": _pct(max_drawdown),
+            "sharpe": _round(s.get("sharpe", 0.0), 2),
+            "sortino": _round(s.get("sortino", 0.0), 2),
+            "win_rate": _pct(winrate),
+            # 完整的汇总指标
+            "calmar": _round(s.get("calmar", 0.0), 2),
+            "sqn": _round(s.get("sqn", 0.0), 2),
+            "cagr_pct": _pct(s.get("cagr")),
+            "profit_factor": _round(s.get("profit_factor", 0.0), 3),
+            "expectancy": _round(s.get("expectancy", 0.0), 3),
+            "expectancy_ratio": _round(s.get("expectancy_ratio", 0.0), 3),
+            "profit_mean_pct": _pct(s.get("profit_mean")),
+            "profit_median_pct": _pct(s.get("profit_median")),
+            "wins": wins,
+            "losses": s.get("losses", 0),
+            "draws": s.get("draws", 0),
+            "trades_per_day": s.get("trades_per_day", 0.0),
+            "holding_avg": s.get("holding_avg"),
+            "starting_balance": s.get("starting_balance"),
+            "final_balance": _round(s.get("final_balance"), 3),
+            "max_drawdown_abs": _round(s.get("max_drawdown_abs", 0.0), 3),
+            "drawdown_duration": s.get("drawdown_duration"),
+            "market_change_pct": _pct(s.get("market_change")),
+            "max_consecutive_wins": s.get("max_consecutive_wins"),
+            "max_consecutive_losses": s.get("max_consecutive_losses"),
+            "best_pair": (s.get("best_pair") or {}).get("key"),
+            "worst_pair": (s.get("worst_pair") or {}).get("key"),
+            "backtest_start": s.get("backtest_start"),
+            "backtest_end": s.get("backtest_end"),
+            "timeframe": s.get("timeframe"),
+            "results_per_pair": per_pair,
+            "exit_reasons": {
+                row.get("key"): row.get("trades") for row in s.get("exit_reason_summary", []) if row.get("key") != "TOTAL"
+            },
+            "full_result_path": self.result_path,
+        }
+
+    @property
+    def detailed_metrics(self) -> Dict[str, Any]:
+        """汇总指标加上由交易明细计算的水下持续时间、持仓时长和持仓暴露度（需要构建交易明细）"""
+        trade_metrics = self.trade_metrics
+        return {
+            **self.metrics,
+            **{field: trade_metrics.get(field, default) for field, default in TRADE_METRIC_DEFAULTS.items()},
+        }
+
+
+def merge_backtest_results(results: List[BacktestResult]) -> Dict[str, Any]:
+    """
+    合并按交易对分片的多个回测结果，在合并后的交易列表上重新计算组合指标
+
+    每个分片相当于一个独立的子账户：合并后的起始资金为各分片起始资金之和，
+    回撤按所有交易按平仓时间排序后的资金曲线计算，其余指标由 trade_metrics 按 freqtrade 的方法计算。
+    注意 max_open_trades 在每个分片内单独生效，分片数大于 1 时同时持仓数上限相应放大。
+
+    Returns:
+        Dict: 与 BacktestResult.metrics 字段兼容的组合指标
+    """
+    import pandas as pd
+
+    from .trade_metrics import compute_trade_metrics
+
+    frames = [r.trades for r in results if len(r.trades)]
+    trades = (pd.concat(frames, ignore_index=True) if frames
+              else pd.DataFrame({"close_date": pd.Series(dtype="datetime64[ns, UTC]"),
+                                 "profit_ratio": pd.Series(dtype=float), "profit_abs": pd.Series(dtype=float)}))
+
+    starting_balance = sum(r.stats.get("starting_balance") or 0.0 for r in results)
+    backtest_start = min(r.stats.get("backtest_start") for r in results)
+    backtest_end = max(r.stats.get("backtest_end") for r in results)
+    metrics = compute_trade_metrics(trades, starting_balance, backtest_start, backtest_end)
+
+    exit_reasons: Dict[str, int] = {}
+    for r in results:
+        for reason, count in r.metrics["exit_reasons"].items():
+            exit_reasons[reason] = exit_reasons.get(reason, 0) + count
+
+    metrics.update({
+        "backtest_start": backtest_start,
+        "backtest_end": backtest_end,
+        "timeframe": results[0].stats.get("timeframe"),
+        # 每个交易对只在一个分片中回测，直接使用 freqtrade 的统计（包含单交易对的回撤）
+        "results_per_pair": [row for r in results for row in r.metrics["results_per_pair"]],
+        "exit_reasons": exit_reasons,
+        "full_result_path": "",
+        "shard_result_paths": [r.result_path for r in results],
+    })
+    return metrics
@@ -0,0 +1,321 @@
+"""
+回测调度器
+限制同时运行的 freqtrade 回测进程数量，排队执行回测任务
+
+- 可配置的工作线程数（每个工作线程同一时间只运行一个回测子进程）
+- 优先级队列（优先级相同时先进先出）
+- 每个任务的状态、排队等待时间、超时和取消
+"""
+import itertools
+import os
+import queue
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from typing import Any, Callable, Dict, List, Optional
+
+# 最大并发回测数量，未设置时根据 CPU 核数和内存自动计算
+BACKTEST_MAX_WORKERS = os.getenv("BACKTEST_MAX_WORKERS", "")
+# 单个回测进程预估占用内存（MB），用于限制并发数量避免内存超卖
+BACKTEST_JOB_MEMORY_MB = int(os.getenv("BACKTEST_JOB_MEMORY_MB", "1024"))
+# 保留的已完成任务数量（用于查询状态）
+FINISHED_JOBS_KEEP = 500
+
+
+class JobStatus:
+    """任务状态"""
+    PENDING = "pending"
+    RUNNING = "running"
+    COMPLETED = "completed"
+    FAILED = "failed"
+    CANCELLED = "cancelled"
+    TIMEOUT = "timeout"
+
+
+FINAL_STATUSES = {JobStatus.COMPLETED, JobStatus.FAILED, JobStatus.CANCELLED, JobStatus.TIMEOUT}
+
+
+def default_worker_count() -> int:
+    """根据 CPU 核数和物理内存计算默认的并发回测数量"""
+    if BACKTEST_MAX_WORKERS:
+        return max(1, int(BACKTEST_MAX_WORKERS))
+
+    cpu_count = os.cpu_count() or 1
+    try:
+        total_memory_mb = os.sysconf("SC_PAGE_SIZE") * os.sysconf("SC_PHYS_PAGES") // (1024 * 1024)
+    except (AttributeError, ValueError, OSError):
+        # Windows 等平台不支持 sysconf，只按 CPU 核数限制
+        return cpu_count
+
+    # 预留一个任务的内存给 API 服务本身
+    memory_slots = max(1, total_memory_mb // max(BACKTEST_JOB_MEMORY_MB, 1) - 1)
+    return max(1, min(cpu_count, memory_slots))
+
+
+@dataclass
+class BacktestJob:
+    """回测任务"""
+    job_id: str
+    func: Callable[..., Dict[str, Any]]
+    args: tuple
+    kwargs: Dict[str, Any]
+    priority: int = 0  # 数值越大越先执行
+    timeout: Optional[float] = None  # 开始执行后的最长运行时间（秒）
+    status: str = JobStatus.PENDING
+    submitted_at: float = field(default_factory=time.time)
+    started_at: Optional[float] = None
+    finished_at: Optional[float] = None
+    result: Optional[Dict[str, Any]] = None
+    error: Optional[str] = None
+    cancel_event: threading.Event = field(default_factory=threading.Event)
+    done_event: threading.Event = field(default_factory=threading.Event)
+    timed_out: bool = False
+
+    @property
+    def wait_time(self) -> float:
+        """排队等待时间（秒）"""
+        end = self.started_at or self.finished_at or time.time()
+        return end - self.submitted_at
+
+    @property
+    def run_time(self) -> float:
+        """执行时间（秒）"""
+        if self.started_at is None:
+            return 0.0
+        return (self.finished_at or time.time()) - self.started_at
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "job_id": self.job_id,
+            "status": self.status,
+            "priority": self.priority,
+            "timeout": self.timeout,
+            "submitted_at": self.submitted_at,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+            "wait_time": round(self.wait_time, 3),
+            "run_time": round(self.run_time, 3),
+            "error": self.error
+        }
+
+
+class BacktestScheduler:
+    """
+    回测调度器
+
+    提交的任务函数必须接受 cancel_event 关键字参数，并在该事件被设置时尽快终止子进程并返回。
+    取消和超时都通过 cancel_event 通知正在运行的任务。
+    """
+
+    def __init__(self, max_workers: Optional[int] = None):
+        self.max_workers = max_workers or default_worker_count()
+        self._queue: "queue.PriorityQueue" = queue.PriorityQueue()
+        self._counter = itertools.count()
+        self._jobs: "OrderedDict[str, BacktestJob]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._shutdown = False
+        self._running = 0
+        self._total_wait_time = 0.0
+        self._started_count = 0
+
+        self._workers: List[threading.Thread] = []
+        for i in range(self.max_workers):
+            worker = threading.Thread(target=self._worker_loop, name=f"backtest-worker-{i}", daemon=True)
+            worker.start()
+            self._workers.append(worker)
+
+        self._watchdog = threading.Thread(target=self._watchdog_loop, name="backtest-watchdog", daemon=True)
+        self._watchdog.start()
+
+    def submit(self, func: Callable[..., Dict[str, Any]], *args, priority: int = 0,
+               timeout: Optional[float] = None, **kwargs) -> BacktestJob:
+        """
+        提交回测任务
+
+        Args:
+            func: 任务函数（例如 run_freqtrade_backtest）
+            priority: 优先级，数值越大越先执行
+            timeout: 开始执行后的最长运行时间（秒），超时后任务被取消
+
+        Returns:
+            BacktestJob: 任务对象
+        """
+        if self._shutdown:
+            raise RuntimeError("回测调度器已关闭")
+
+        job = BacktestJob(
+            job_id=uuid.uuid4().hex,
+            func=func,
+            args=args,
+            kwargs=kwargs,
+            priority=priority,
+            timeout=timeout
+        )
+        with self._lock:
+            self._jobs[job.job_id] = job
+            self._prune_finished_jobs()
+        # 优先级取负数，使数值大的先出队；相同优先级按提交顺序
+        self._queue.put((-priority, next(self._counter), job))
+        return job
+
+    def wait(self, job: BacktestJob, timeout: Optional[float] = None,
+             cancel_event: Optional[threading.Event] = None) -> Dict[str, Any]:
+        """
+        等待任务完成并返回结果（任务未在 timeout 内完成时返回 None）
+
+        指定 cancel_event 时，该事件被设置后取消任务，并继续等待任务结束（返回取消结果）。
+        """
+        if cancel_event is None:
+            if not job.done_event.wait(timeout):
+                return None
+            return job.result
+
+        deadline = None if timeout is None else time.time() + timeout
+        while not job.done_event.wait(0.2):
+            if cancel_event.is_set():
+                self.cancel(job.job_id)
+            if deadline is not None and time.time() > deadline:
+                return None
+        return job.result
+
+    def run(self, func: Callable[..., Dict[str, Any]], *args, priority: int = 0,
+            timeout: Optional[float] = None, cancel_event: Optional[threading.Event] = None,
+            **kwargs) -> Dict[str, Any]:
+        """
+        提交任务并阻塞等待结果，结果中附带调度信息（job_id、排队时间等）
+
+        cancel_event 为调用方的取消事件（见 wait），不会传给任务函数。
+        """
+        job = self.submit(func, *args, priority=priority, timeout=timeout, **kwargs)
+        result = self.wait(job, cancel_event=cancel_event) or {}
+        result["scheduler"] = job.to_dict()
+        return result
+
+    def cancel(self, job_id: str) -> bool:
+        """
+        取消任务
+
+        排队中的任务直接标记为已取消；运行中的任务通过 cancel_event 通知其终止子进程。
+
+        Returns:
+            bool: 任务存在且尚未结束时返回 True
+        """
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is None or job.status in FINAL_STATUSES:
+                return False
+            job.cancel_event.set()
+            if job.status == JobStatus.PENDING:
+                self._finish(job, JobStatus.CANCELLED, {"error": "回测任务已取消", "error_type": "cancelled"})
+        return True
+
+    def get_job(self, job_id: str) -> Optional[BacktestJob]:
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def list_jobs(self, status: Optional[str] = None) -> List[Dict[str, Any]]:
+        with self._lock:
+            return [job.to_dict() for job in self._jobs.values() if status is None or job.status == status]
+
+    def stats(self) -> Dict[str, Any]:
+        """调度器统计信息：队列深度、运行中任务数、平均排队时间等"""
+        with self._lock:
+            pending = [job for job in self._jobs.values() if job.status == JobStatus.PENDING]
+            counts: Dict[str, int] = {}
+            for job in self._jobs.values():
+                counts[job.status] = counts.get(job.status, 0) + 1
+            return {
+                "max_workers": self.max_workers,
+                "queue_depth": len(pending),
+                "running": self._running,
+                "status_counts": counts,
+                "avg_wait_time": round(self._total_wait_time / self._started_count, 3) if self._started_count else 0.0,
+                "max_pending_wait_time": round(max((job.wait_time for job in pending), default=0.0), 3)
+            }
+
+    def shutdown(self, cancel_pending: bool = True):
+        """关闭调度器（可选取消所有排队中的任务）"""
+        self._shutdown = True
+        if cancel_pending:
+            for job_info in self.list_jobs(JobStatus.PENDING):
+                self.cancel(job_info["job_id"])
+        for _ in self._workers:
+            self._queue.put((float("inf"), next(self._counter), None))
+
+    def _worker_loop(self):
+        while True:
+            _, _, job = self._queue.get()
+            if job is None:
+                return
+
+            with self._lock:
+                # 排队期间已被取消
+                if job.status != JobStatus.PENDING:
+                    continue
+                job.status = JobStatus.RUNNING
+                job.started_at = time.time()
+                self._running += 1
+                self._started_count += 1
+                self._total_wait_time += job.wait_time
+
+            try:
+                result = job.func(*job.args, cancel_event=job.cancel_event, **job.kwargs)
+                if job.timed_out:
+                    status = JobStatus.TIMEOUT
+                    result = {"error": f"回测任务超时（超过{job.timeout:.0f}秒）", "error_type": "timeout"}
+                elif job.cancel_event.is_set():
+                    status = JobStatus.CANCELLED
+                elif result and "error" in result:
+                    status = JobStatus.FAILED
+                else:
+                    status = JobStatus.COMPLETED
+            except Exception as e:
+                status = JobStatus.FAILED
+                result = {"error": f"Exception during backtest job: {str(e)}", "error_type": "execution_error"}
+
+            with self._lock:
+                self._running -= 1
+                self._finish(job, status, result)
+
+    def _watchdog_loop(self):
+        """检查运行中的任务是否超时，超时则通过 cancel_event 通知任务终止"""
+        while not self._shutdown:
+            now = time.time()
+            with self._lock:
+                for job in self._jobs.values():
+                    if (job.status == JobStatus.RUNNING and job.timeout is not None
+                            and not job.cancel_event.is_set() and now - job.started_at > job.timeout):
+                        job.timed_out = True
+                        job.cancel_event.set()
+            time.sleep(0.5)
+
+    def _finish(self, job: BacktestJob, status: str, result: Optional[Dict[str, Any]]):
+        """标记任务结束（调用方需持有 self._lock）"""
+        job.status = status
+        job.result = result
+        job.finished_at = time.time()
+        if result and "error" in result:
+            job.error = result["error"]
+        job.done_event.set()
+
+    def _prune_finished_jobs(self):
+        """只保留最近的已结束任务（调用方需持有 self._lock）"""
+        finished = [job_id for job_id, job in self._jobs.items() if job.status in FINAL_STATUSES]
+        for job_id in finished[:max(0, len(finished) - FINISHED_JOBS_KEEP)]:
+            del self._jobs[job_id]
+
+
+_scheduler: Optional[BacktestScheduler] = None
+_scheduler_lock = threading.Lock()
+
+
+def get_scheduler() -> BacktestScheduler:
+    """获取全局回测调度器（首次调用时创建）"""
+    global _scheduler
+    with _scheduler_lock:
+        if _scheduler is None:
+            _scheduler = BacktestScheduler()
+            print(f"回测调度器已启动: {_scheduler.max_workers} 个工作线程")
+        return _scheduler
@@ -0,0 +1,184 @@
+"""
+根据回测工作量计算超时时间
+超时预算 = (固定开销 + K线数量（交易对数 × 时间范围内的K线根数）× 每根K线耗时) × 安全系数，
+固定开销和每根K线耗时从历次成功回测中学习，保存在磁盘上，服务重启后继续使用。
+"""
+import json
+import os
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+from typing import Any, Dict, List, Optional
+
+from .candle_store import parse_timerange, timeframe_to_seconds
+
+CURRENT_DIR = os.path.dirname(os.path.abspath(__file__))
+PROJECT_ROOT = os.path.dirname(os.path.dirname(CURRENT_DIR))
+FREQTRADE_WORKER_DIR = os.path.join(PROJECT_ROOT, "freqtrade_worker")
+CONFIG_PATH = os.path.join(FREQTRADE_WORKER_DIR, "user_data", "config.json")
+THROUGHPUT_PATH = os.path.join(FREQTRADE_WORKER_DIR, "user_data", "backtest_throughput.json")
+
+# 超时时间的上下限（秒）
+BACKTEST_TIMEOUT_MIN = float(os.getenv("BACKTEST_TIMEOUT_MIN", "30"))
+BACKTEST_TIMEOUT_MAX = float(os.getenv("BACKTEST_TIMEOUT_MAX", "3600"))
+# 没有历史数据时使用的固定开销（秒，freqtrade 启动、加载配置和交易所信息）和每根K线耗时（秒），偏保守
+BACKTEST_TIMEOUT_OVERHEAD = float(os.getenv("BACKTEST_TIMEOUT_OVERHEAD", "15"))
+DEFAULT_SECONDS_PER_CANDLE = 2e-4
+# 安全系数：预计耗时的倍数
+BACKTEST_TIMEOUT_SAFETY_FACTOR = float(os.getenv("BACKTEST_TIMEOUT_SAFETY_FACTOR", "3"))
+# 每次记录新样本时旧样本权重的衰减系数
+SAMPLE_DECAY = 0.9
+# 每根K线耗时的下限（秒），避免估计值过小
+MIN_SECONDS_PER_CANDLE = 1e-6
+# 时间范围缺少开始日期时按一年估算
+DEFAULT_TIMERANGE_DAYS = 365
+
+
+def config_pairs(config_path: str = CONFIG_PATH) -> List[str]:
+    """config.json 的 pair_whitelist（未指定交易对时 freqtrade 回测的交易对）"""
+    try:
+        with open(config_path, "r", encoding="utf-8") as f:
+            return json.load(f).get("exchange", {}).get("pair_whitelist", [])
+    except (OSError, ValueError):
+        return []
+
+
+def count_candles(pairs: Optional[List[str]], timeframe: str, timerange: Optional[str]) -> int:
+    """
+    回测需要处理的K线数量：交易对数 × 时间范围内的K线根数
+
+    未指定交易对时使用 config.json 的 pair_whitelist。
+    """
+    start, end = parse_timerange(timerange)
+    end = end or datetime.now(timezone.utc)
+    start = start or end - timedelta(days=DEFAULT_TIMERANGE_DAYS)
+    bars = max(0, int((end - start).total_seconds() // timeframe_to_seconds(timeframe)))
+    pair_count = len(pairs) if pairs else max(1, len(config_pairs()))
+    return pair_count * bars
+
+
+class ThroughputModel:
+    """
+    回测耗时的在线估计（保存在 JSON 文件中）
+
+    对历次成功回测的 (K线数量, 耗时) 做带衰减权重的线性回归：耗时 = 固定开销 + K线数量 × 每根K线耗时。
+    只有一种规模的样本时无法区分两者，按各占一半估计。
+    """
+
+    def __init__(self, path: str = THROUGHPUT_PATH):
+        self.path = path
+        self._lock = threading.Lock()
+        self.overhead = BACKTEST_TIMEOUT_OVERHEAD
+        self.seconds_per_candle = DEFAULT_SECONDS_PER_CANDLE
+        self.samples = 0
+        # 加权和: 权重、x、y、x²、xy（x 为K线数量，y 为耗时）
+        self._sums = {"w": 0.0, "x": 0.0, "y": 0.0, "xx": 0.0, "xy": 0.0}
+        self._load()
+
+    def _load(self):
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+            self._sums.update({k: float(v) for k, v in data["sums"].items()})
+            self.samples = int(data.get("samples", 0))
+            self._fit()
+        except (OSError, ValueError, KeyError, AttributeError):
+            pass
+
+    def _save(self):
+        temp_path = f"{self.path}.{threading.get_ident()}.tmp"
+        with open(temp_path, "w", encoding="utf-8") as f:
+            json.dump({
+                "overhead": self.overhead,
+                "seconds_per_candle": self.seconds_per_candle,
+                "samples": self.samples,
+                "sums": self._sums,
+                "updated_at": time.time()
+            }, f)
+        os.replace(temp_path, self.path)
+
+    def _fit(self):
+        """根据加权和重新估计固定开销和每根K线耗时（调用方需持有 self._lock 或在初始化中调用）"""
+        w, sx, sy, sxx, sxy = (self._sums[k] for k in ("w", "x", "y", "xx", "xy"))
+        if w <= 0 or sx <= 0:
+            return
+        mean_x, mean_y = sx / w, sy / w
+        variance = sxx / w - mean_x ** 2
+        if variance > (0.1 * mean_x) ** 2:
+            # 有不同规模的样本，做线性回归
+            slope = (sxy / w - mean_x * mean_y) / variance
+            intercept = mean_y - slope * mean_x
+        else:
+            slope = mean_y * 0.5 / mean_x
+            intercept = mean_y * 0.5
+        if intercept < 0:
+            intercept, slope = 0.0, mean_y / mean_x
+        self.seconds_per_candle = max(slope, MIN_SECONDS_PER_CANDLE)
+        self.overhead = intercept
+
+    def record(self, candles: int, elapsed: float):
+        """记录一次成功回测的K线数量和耗时"""
+        if candles <= 0:
+            return
+        with self._lock:
+            for key in self._sums:
+                self._sums[key] *= SAMPLE_DECAY
+            self._sums["w"] += 1
+            self._sums["x"] += candles
+            self._sums["y"] += elapsed
+            self._sums["xx"] += candles * candles
+            self._sums["xy"] += candles * elapsed
+            self.samples += 1
+            self._fit()
+            try:
+                self._save()
+            except OSError as e:
+                print(f"Warning: 保存回测吞吐量失败: {e}")
+
+    def budget(self, candles: int) -> Dict[str, Any]:
+        """
+        计算超时预算
+
+        Returns:
+            Dict: timeout（秒）以及计算所用的K线数量、固定开销、每根K线耗时和安全系数
+        """
+        with self._lock:
+            overhead = self.overhead
+            seconds_per_candle = self.seconds_per_candle
+            samples = self.samples
+        expected = overhead + candles * seconds_per_candle
+        timeout = min(BACKTEST_TIMEOUT_MAX, max(BACKTEST_TIMEOUT_MIN, expected * BACKTEST_TIMEOUT_SAFETY_FACTOR))
+        return {
+            "timeout": round(timeout, 1),
+            "expected_seconds": round(expected, 1),
+            "candles": candles,
+            "overhead": round(overhead, 2),
+            "seconds_per_candle": seconds_per_candle,
+            "safety_factor": BACKTEST_TIMEOUT_SAFETY_FACTOR,
+            "samples": samples,
+            "source": "adaptive"
+        }
+
+
+_model: Optional[ThroughputModel] = None
+_model_lock = threading.Lock()
+
+
+def get_throughput_model() -> ThroughputModel:
+    """获取全局回测吞吐量模型"""
+    global _model
+    with _model_lock:
+        if _model is None:
+            _model = ThroughputModel()
+        return _model
+
+
+def compute_timeout_budget(pairs: Optional[List[str]], timeframe: str, timerange: Optional[str]) -> Dict[str, Any]:
+    """根据交易对、时间周期和时间范围计算回测的超时预算"""
+    try:
+        candles = count_candles(pairs, timeframe, timerange)
+    except ValueError as e:
+        # 时间周期或时间范围格式错误（freqtrade 会给出具体错误），只使用固定开销
+        print(f"Warning: 无法计算回测K线数量: {e}")
+        candles = 0
+    return get_throughput_model().budget(candles)
@@ -0,0 +1,185 @@
+"""
+由较小时间周期的 K 线合成较大时间周期
+例如已下载 5m 数据时，15m / 1h / 4h / 1d 由 5m 数据向量化聚合得到，不再分别下载和存储；
+按时间周期扫描参数时只需要下载一次最小周期的数据。
+
+- 合成的 K 线写入与下载数据相同路径的文件（freqtrade 回测直接读取），并在 resample_index.json 中记录来源文件的指纹，
+  来源文件变化（增量下载、补齐缺口）后重新合成
+- 目标周期已有下载的原始数据文件时不覆盖（下载的数据可能比来源周期覆盖更长的时间范围），仍按原方式下载
+- 下载时只在来源周期已经覆盖请求的时间范围时合成，否则直接下载目标周期（较大周期的数据量小得多）
+- 只合成能整除一天的周期（m / h 和 1d），这些周期的 K 线与交易所一样按 UTC 0 点对齐；
+  首尾不完整的 K 线（来源数据从周期中间开始，或最后一根还没有走完）不生成
+"""
+import json
+import os
+import threading
+import time
+from typing import Any, Dict, Optional
+
+import numpy as np
+import pandas as pd
+
+from .candle_store import (CANDLE_DATA_FORMAT, DATA_DIR, candle_file_path, pair_to_filename, read_candle_file,
+                           timeframe_to_seconds, write_candle_file)
+from .data_coverage import get_coverage_index
+
+# 是否由较小时间周期合成较大时间周期（true/false）
+RESAMPLE_ENABLED = os.getenv("RESAMPLE_ENABLED", "true").lower() == "true"
+RESAMPLE_INDEX_PATH = os.path.join(DATA_DIR, "resample_index.json")
+
+# 可作为合成来源的时间周期（从小到大，优先使用最小的）
+SOURCE_TIMEFRAMES = ["1m", "3m", "5m", "15m", "30m", "1h", "2h", "4h", "6h", "8h", "12h"]
+
+_records: Optional[Dict[str, Dict[str, Any]]] = None
+_records_lock = threading.Lock()
+
+
+def can_resample(source_timeframe: str, timeframe: str) -> bool:
+    """目标周期能否由来源周期合成（目标是来源的整数倍，且能整除一天）"""
+    try:
+        source, target = timeframe_to_seconds(source_timeframe), timeframe_to_seconds(timeframe)
+    except (ValueError, KeyError):
+        return False
+    return source < target <= 86400 and target % source == 0 and 86400 % target == 0
+
+
+def resample_ohlcv(df: pd.DataFrame, source_timeframe: str, timeframe: str) -> pd.DataFrame:
+    """
+    把 K 线聚合为更大的时间周期
+
+    按周期起点分组: open 取第一根、close 取最后一根、high / low 取最大 / 最小、volume 求和（numpy reduceat，不逐组循环）。
+    内部缺少部分来源 K 线的周期照常生成（与交易所按实际成交生成 K 线一致），首尾不完整的周期丢弃。
+    """
+    source_step = timeframe_to_seconds(source_timeframe)
+    step = timeframe_to_seconds(timeframe)
+    if df.empty:
+        return df.iloc[:0][["date", "open", "high", "low", "close", "volume"]]
+
+    timestamps = df["date"].to_numpy(dtype="datetime64[s]").astype(np.int64)
+    buckets = timestamps // step * step
+    starts = np.concatenate(([0], np.flatnonzero(np.diff(buckets)) + 1))
+    ends = np.append(starts[1:], len(timestamps)) - 1
+
+    keep = np.ones(len(starts), dtype=bool)
+    # 第一个周期从中间开始（开盘价不对）、最后一个周期还没有走完时丢弃
+    keep[0] &= timestamps[starts[0]] == buckets[starts[0]]
+    keep[-1] &= timestamps[ends[-1]] == buckets[ends[-1]] + step - source_step
+
+    high = df["high"].to_numpy(dtype=np.float64)
+    low = df["low"].to_numpy(dtype=np.float64)
+    volume = df["volume"].to_numpy(dtype=np.float64)
+    result = pd.DataFrame({
+        "date": pd.to_datetime(buckets[starts], unit="s", utc=True),
+        "open": df["open"].to_numpy(dtype=np.float64)[starts],
+        "high": np.maximum.reduceat(high, starts),
+        "low": np.minimum.reduceat(low, starts),
+        "close": df["close"].to_numpy(dtype=np.float64)[ends],
+        "volume": np.add.reduceat(volume, starts),
+    })
+    return result[keep].reset_index(drop=True)
+
+
+def _key(pair: str, timeframe: str, exchange: str) -> str:
+    return f"{exchange}/{pair_to_filename(pair)}-{timeframe}"
+
+
+def _load_records() -> Dict[str, Dict[str, Any]]:
+    """合成记录（调用方需持有 _records_lock）"""
+    global _records
+    if _records is None:
+        try:
+            with open(RESAMPLE_INDEX_PATH, "r", encoding="utf-8") as f:
+                _records = json.load(f)
+        except (OSError, ValueError):
+            _records = {}
+    return _records
+
+
+def _save_records():
+    """保存合成记录（调用方需持有 _records_lock）"""
+    os.makedirs(os.path.dirname(RESAMPLE_INDEX_PATH), exist_ok=True)
+    temp_path = f"{RESAMPLE_INDEX_PATH}.{threading.get_ident()}.tmp"
+    with open(temp_path, "w", encoding="utf-8") as f:
+        json.dump(_records, f)
+    os.replace(temp_path, RESAMPLE_INDEX_PATH)
+
+
+def _stat(path: Optional[str]) -> Optional[list]:
+    try:
+        stat = os.stat(path)
+    except (OSError, TypeError):
+        return None
+    return [stat.st_size, stat.st_mtime_ns]
+
+
+def is_derived(pair: str, timeframe: str, exchange: str = "okx") -> bool:
+    """目标周期的数据文件是否是合成的（文件被下载覆盖后不再算合成的）"""
+    path = candle_file_path(pair, timeframe, exchange, CANDLE_DATA_FORMAT)
+    with _records_lock:
+        record = _load_records().get(_key(pair, timeframe, exchange))
+    return record is not None and record["target"] == _stat(path)
+
+
+def resample_source(pair: str, timeframe: str, exchange: str = "okx", timerange: Optional[str] = None) -> Optional[str]:
+    """
+    合成目标周期使用的来源周期: 已下载的（不是合成的）能合成目标周期的最小周期
+
+    目标周期已有下载的原始数据文件时返回 None（不覆盖下载的数据）。
+    指定 timerange 时只使用已经完整覆盖该范围的来源周期（见 data_coverage.py），
+    都没有覆盖时返回 None，由调用方直接下载目标周期（不为了合成去下载更多的小周期数据）。
+    """
+    if not RESAMPLE_ENABLED:
+        return None
+    target_path = candle_file_path(pair, timeframe, exchange, CANDLE_DATA_FORMAT)
+    if os.path.exists(target_path) and not is_derived(pair, timeframe, exchange):
+        return None
+    for source_timeframe in SOURCE_TIMEFRAMES:
+        if not can_resample(source_timeframe, timeframe):
+            continue
+        source_path = candle_file_path(pair, source_timeframe, exchange, CANDLE_DATA_FORMAT)
+        if not os.path.exists(source_path) or is_derived(pair, source_timeframe, exchange):
+            continue
+        if timerange and get_coverage_index().missing_ranges(pair, source_timeframe, exchange, timerange):
+            continue
+        return source_timeframe
+    return None
+
+
+def ensure_resampled(pair: str, timeframe: str, exchange: str = "okx") -> Optional[Dict[str, Any]]:
+    """
+    确保目标周期的合成数据与来源数据一致（来源文件的指纹变化后重新合成）
+
+    Returns:
+        Dict: 合成记录（来源周期、来源/目标文件指纹、K 线数量和耗时），不能合成时返回 None
+    """
+    source_timeframe = resample_source(pair, timeframe, exchange)
+    if source_timeframe is None:
+        return None
+    source_path = candle_file_path(pair, source_timeframe, exchange, CANDLE_DATA_FORMAT)
+    target_path = candle_file_path(pair, timeframe, exchange, CANDLE_DATA_FORMAT)
+    key = _key(pair, timeframe, exchange)
+
+    with _records_lock:
+        record = _load_records().get(key)
+        source_stat = _stat(source_path)
+        if (record is not None and record["source_timeframe"] == source_timeframe
+                and record["source"] == source_stat and record["target"] == _stat(target_path)):
+            return dict(record)
+
+        start_time = time.perf_counter()
+        derived = resample_ohlcv(read_candle_file(source_path), source_timeframe, timeframe)
+        write_candle_file(derived, target_path)
+        record = {
+            "source_timeframe": source_timeframe,
+            "source": source_stat,
+            "target": _stat(target_path),
+            "candles": len(derived),
+            "resampled_at": time.time(),
+            "elapsed": round(time.perf_counter() - start_time, 4),
+        }
+        _records[key] = record
+        try:
+            _save_records()
+        except OSError as e:
+            print(f"Warning: 保存K线合成记录失败: {e}")
+        return dict(record)
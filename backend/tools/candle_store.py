@@ -0,0 +1,333 @@
+"""
+K线数据读取工具
+直接读取 freqtrade 下载到 user_data/data/<exchange>/ 下的 OHLCV 文件，供进程内的回测引擎使用
+
+K 线统一以 CANDLE_DATA_FORMAT（默认 feather）格式存储，下载和回测时通过 --data-format-ohlcv 传给 freqtrade。
+feather 文件以内存映射方式读取，数值列直接引用映射的页面（只读，写入时由 pandas 写时复制），
+多个进程读取同一文件时共享操作系统的页缓存，不再各自解析 JSON。
+
+旧的 JSON 数据可以用转换命令迁移:
+    python -m backend.tools.candle_store convert --exchange okx [--timeframes 5m 1h] [--erase]
+"""
+import argparse
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime, timezone
+from typing import Any, Dict, List, Optional, Tuple
+
+import pandas as pd
+
+# 定义 Freqtrade 数据目录路径
+CURRENT_DIR = os.path.dirname(os.path.abspath(__file__))
+PROJECT_ROOT = os.path.dirname(os.path.dirname(CURRENT_DIR))
+FREQTRADE_WORKER_DIR = os.path.join(PROJECT_ROOT, "freqtrade_worker")
+DATA_DIR = os.path.join(FREQTRADE_WORKER_DIR, "user_data", "data")
+
+OHLCV_COLUMNS = ["date", "open", "high", "low", "close", "volume"]
+
+# freqtrade 支持的 OHLCV 存储格式及对应的文件扩展名（按查找优先级排列）
+DATA_FORMAT_EXTENSIONS = {
+    "feather": ".feather",
+    "parquet": ".parquet",
+    "json": ".json",
+    "jsongz": ".json.gz",
+}
+
+# 统一使用的 K 线存储格式（freqtrade 的 --data-format-ohlcv）
+CANDLE_DATA_FORMAT = os.getenv("CANDLE_DATA_FORMAT", "feather")
+
+# K 线文件名: <交易对>-<时间周期>.<扩展名>（排除 -trades 等非 K 线文件）
+CANDLE_FILENAME_PATTERN = re.compile(r"^(?P<pair>.+)-(?P<timeframe>\d+[smhdwM])(?P<ext>\.json\.gz|\.json|\.feather|\.parquet)$")
+
+# 内存中缓存的 K 线数量上限（按文件计）
+CANDLE_CACHE_SIZE = int(os.getenv("CANDLE_CACHE_SIZE", "32"))
+
+_cache: "OrderedDict[Tuple, pd.DataFrame]" = OrderedDict()
+_cache_lock = threading.Lock()
+
+
+def timeframe_to_seconds(timeframe: str) -> int:
+    """将时间周期字符串转换为秒数，例如 "5m" -> 300"""
+    units = {"s": 1, "m": 60, "h": 3600, "d": 86400, "w": 604800, "M": 2592000}
+    unit = timeframe[-1]
+    if unit not in units:
+        raise ValueError(f"不支持的时间周期: {timeframe}")
+    return int(timeframe[:-1]) * units[unit]
+
+
+def parse_timerange(timerange: Optional[str]) -> Tuple[Optional[datetime], Optional[datetime]]:
+    """
+    解析 freqtrade 格式的时间范围
+
+    Args:
+        timerange: "YYYYMMDD-YYYYMMDD"，两端均可省略（例如 "20230101-"）
+
+    Returns:
+        tuple: (开始时间, 结束时间)，均为 UTC 时间，缺省的一端为 None
+    """
+    if not timerange:
+        return None, None
+    start_str, _, end_str = timerange.partition("-")
+
+    def _parse(value: str) -> Optional[datetime]:
+        if not value:
+            return None
+        if len(value) == 8:
+            return datetime.strptime(value, "%Y%m%d").replace(tzinfo=timezone.utc)
+        # freqtrade 也支持 Unix 时间戳
+        return datetime.fromtimestamp(int(value), tz=timezone.utc)
+
+    return _parse(start_str), _parse(end_str)
+
+
+def pair_to_filename(pair: str) -> str:
+    """将交易对转换为 freqtrade 的文件名格式: BTC/USDT -> BTC_USDT，BTC/USDT:USDT -> BTC_USDT_USDT"""
+    return pair.replace("/", "_").replace(":", "_")
+
+
+def candle_file_path(pair: str, timeframe: str, exchange: str = "okx",
+                     data_format: Optional[str] = None) -> Optional[str]:
+    """
+    获取 K 线数据文件路径
+
+    指定 data_format 时直接返回该格式的路径（文件不一定存在）；
+    未指定时优先返回 CANDLE_DATA_FORMAT 格式的文件（回测实际读取的文件），
+    其次按 DATA_FORMAT_EXTENSIONS 的顺序返回第一个存在的文件，都不存在时返回 None。
+    """
+    base = os.path.join(DATA_DIR, exchange, f"{pair_to_filename(pair)}-{timeframe}")
+    if data_format:
+        return base + DATA_FORMAT_EXTENSIONS[data_format]
+    formats = [CANDLE_DATA_FORMAT, *(f for f in DATA_FORMAT_EXTENSIONS if f != CANDLE_DATA_FORMAT)]
+    for fmt in formats:
+        if os.path.exists(base + DATA_FORMAT_EXTENSIONS[fmt]):
+            return base + DATA_FORMAT_EXTENSIONS[fmt]
+    return None
+
+
+def file_fingerprint(path: str) -> Tuple[str, int, int]:
+    """文件指纹（路径、大小、修改时间），文件内容变化时指纹随之变化"""
+    stat = os.stat(path)
+    return path, stat.st_size, stat.st_mtime_ns
+
+
+def _read_feather_mmap(path: str) -> pd.DataFrame:
+    """
+    以内存映射方式读取 feather 文件
+
+    未压缩且只有一个数据块的数值列直接引用映射的页面（零拷贝）；
+    freqtrade 自己写入的文件使用 lz4 压缩，读取时仍需解压到进程内存。
+    """
+    import pyarrow.feather as feather
+
+    table = feather.read_table(path, memory_map=True)
+    columns = {}
+    for name in table.column_names:
+        column = table.column(name)
+        # 带时区的时间戳 to_numpy 后为 UTC 时间（去掉时区），freqtrade 的时间均为 UTC
+        columns[name] = pd.to_datetime(column.to_numpy(), utc=True) if name == "date" else column.to_numpy()
+    return pd.DataFrame(columns, copy=False)
+
+
+def read_candle_file(path: str, sort: bool = True) -> pd.DataFrame:
+    """
+    读取 freqtrade 格式的 K 线文件，返回按时间排序的 DataFrame（date 列为 UTC 时间）
+
+    sort=False 时保留文件中的原始顺序（数据完整性检查需要发现乱序的行）。
+    """
+    if path.endswith(".feather"):
+        df = _read_feather_mmap(path)
+    elif path.endswith(".parquet"):
+        df = pd.read_parquet(path)
+    else:
+        # json / jsongz 格式: [[timestamp_ms, open, high, low, close, volume], ...]
+        df = pd.read_json(path, orient="values", compression="infer")
+        df.columns = OHLCV_COLUMNS
+
+    df = df[OHLCV_COLUMNS]
+    if not pd.api.types.is_datetime64_any_dtype(df["date"]):
+        df["date"] = pd.to_datetime(df["date"], unit="ms", utc=True)
+    elif df["date"].dt.tz is None:
+        df["date"] = df["date"].dt.tz_localize("UTC")
+    df = df.astype({col: "float64" for col in OHLCV_COLUMNS[1:]})
+    # freqtrade 写入的数据本来就是有序的，只在需要时排序（排序会复制内存映射的数据）
+    if sort and not df["date"].is_monotonic_increasing:
+        df = df.sort_values("date")
+    return df.reset_index(drop=True)
+
+
+def write_candle_file(df: pd.DataFrame, path: str):
+    """
+    以 freqtrade 能读取的格式写入 K 线文件（先写临时文件再替换，读取方不会看到写了一半的文件）
+
+    feather 不压缩，使读取时可以零拷贝内存映射。
+    """
+    df = df[OHLCV_COLUMNS].reset_index(drop=True)
+    tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    try:
+        if path.endswith(".feather"):
+            import pyarrow.feather as feather
+
+            feather.write_feather(df, tmp_path, compression="uncompressed")
+        elif path.endswith(".parquet"):
+            df.to_parquet(tmp_path, index=False)
+        else:
+            values = df.copy()
+            values["date"] = values["date"].astype("datetime64[ms, UTC]").astype("int64")
+            values.to_json(tmp_path, orient="values", double_precision=15,
+                           compression="gzip" if path.endswith(".gz") else None)
+        os.replace(tmp_path, path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+
+def _candle_files(exchange: str) -> Dict[Tuple[str, str], Dict[str, str]]:
+    """交易所数据目录中的 K 线文件: {(文件名中的交易对, 时间周期): {格式: 路径}}"""
+    data_dir = os.path.join(DATA_DIR, exchange)
+    extension_formats = {ext: fmt for fmt, ext in DATA_FORMAT_EXTENSIONS.items()}
+    files: Dict[Tuple[str, str], Dict[str, str]] = {}
+    if not os.path.isdir(data_dir):
+        return files
+    for entry in os.scandir(data_dir):
+        match = CANDLE_FILENAME_PATTERN.match(entry.name)
+        if match and entry.is_file():
+            key = (match.group("pair"), match.group("timeframe"))
+            files.setdefault(key, {})[extension_formats[match.group("ext")]] = entry.path
+    return files
+
+
+def convert_candle_data(exchange: str = "okx", timeframes: Optional[List[str]] = None,
+                        pairs: Optional[List[str]] = None, format_to: str = CANDLE_DATA_FORMAT,
+                        erase: bool = False) -> Dict[str, Any]:
+    """
+    把其他格式的 K 线文件转换为 format_to 格式
+
+    目标文件不存在或比源文件旧时才转换（同一交易对有多个旧格式文件时使用最新的一个），
+    已经是目标格式的数据不做任何处理，因此可以在每次下载/回测前调用。
+
+    Args:
+        exchange: 交易所名称
+        timeframes: 只转换这些时间周期（默认全部）
+        pairs: 只转换这些交易对（默认全部）
+        format_to: 目标格式
+        erase: 转换后删除源文件
+
+    Returns:
+        Dict: {"converted": [目标文件], "skipped": 已是最新的数量, "errors": {源文件: 错误}, "elapsed": 秒}
+    """
+    if format_to not in DATA_FORMAT_EXTENSIONS:
+        raise ValueError(f"不支持的 K 线格式: {format_to}，可选: {', '.join(DATA_FORMAT_EXTENSIONS)}")
+    start_time = time.perf_counter()
+    pair_names = {pair_to_filename(pair) for pair in pairs} if pairs else None
+    converted, errors, skipped = [], {}, 0
+    for (pair_name, timeframe), formats in sorted(_candle_files(exchange).items()):
+        if (timeframes and timeframe not in timeframes) or (pair_names is not None and pair_name not in pair_names):
+            continue
+        sources = [path for fmt, path in formats.items() if fmt != format_to]
+        if not sources:
+            continue
+        source = max(sources, key=os.path.getmtime)
+        target = formats.get(format_to) or os.path.join(
+            DATA_DIR, exchange, f"{pair_name}-{timeframe}{DATA_FORMAT_EXTENSIONS[format_to]}")
+        if os.path.exists(target) and os.path.getmtime(target) >= os.path.getmtime(source):
+            skipped += 1
+        else:
+            try:
+                write_candle_file(read_candle_file(source), target)
+            except Exception as e:
+                errors[source] = f"{type(e).__name__}: {e}"
+                continue
+            converted.append(target)
+        if erase:
+            for path in sources:
+                os.remove(path)
+    return {
+        "converted": converted,
+        "skipped": skipped,
+        "errors": errors,
+        "elapsed": round(time.perf_counter() - start_time, 3),
+    }
+
+
+def load_candles(pair: str, timeframe: str, exchange: str = "okx",
+                 timerange: Optional[str] = None, startup_candles: int = 0) -> Optional[pd.DataFrame]:
+    """
+    加载 K 线数据（带进程内缓存，文件变化后自动失效）
+
+    Args:
+        pair: 交易对
+        timeframe: 时间周期
+        exchange: 交易所名称
+        timerange: 时间范围（可选）
+        startup_candles: 时间范围开始前额外保留的 K 线数量（用于指标预热）
+
+    Returns:
+        DataFrame: OHLCV 数据，文件不存在时返回 None
+    """
+    from .candle_resample import RESAMPLE_ENABLED, ensure_resampled
+
+    # 能由较小周期合成的周期先确保合成数据是最新的（来源数据变化后重新合成，见 candle_resample.py）
+    if RESAMPLE_ENABLED:
+        ensure_resampled(pair, timeframe, exchange)
+    path = candle_file_path(pair, timeframe, exchange)
+    if path is None:
+        return None
+
+    key = file_fingerprint(path)
+    with _cache_lock:
+        df = _cache.get(key)
+        if df is not None:
+            _cache.move_to_end(key)
+    if df is None:
+        df = read_candle_file(path)
+        with _cache_lock:
+            _cache[key] = df
+            while len(_cache) > CANDLE_CACHE_SIZE:
+                _cache.popitem(last=False)
+
+    start, end = parse_timerange(timerange)
+    if start is not None:
+        start_index = int(df["date"].searchsorted(pd.Timestamp(start)))
+        df = df.iloc[max(0, start_index - startup_candles):]
+    if end is not None:
+        # 用位置切片代替布尔索引，结果仍引用缓存（内存映射）的数据而不复制
+        df = df.iloc[:int(df["date"].searchsorted(pd.Timestamp(end)))]
+    return df.reset_index(drop=True)
+
+
+def load_pairs_candles(pairs: list, timeframe: str, exchange: str = "okx",
+                       timerange: Optional[str] = None, startup_candles: int = 0) -> Dict[str, pd.DataFrame]:
+    """批量加载多个交易对的 K 线数据，跳过没有数据的交易对"""
+    result = {}
+    for pair in pairs:
+        df = load_candles(pair, timeframe, exchange, timerange, startup_candles)
+        if df is not None and not df.empty:
+            result[pair] = df
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description="K 线数据工具")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    convert = subparsers.add_parser("convert", help="把 JSON 等格式的 K 线数据转换为统一的存储格式")
+    convert.add_argument("--exchange", default="okx")
+    convert.add_argument("--timeframes", nargs="*", help="只转换这些时间周期（默认全部）")
+    convert.add_argument("--pairs", nargs="*", help="只转换这些交易对（默认全部）")
+    convert.add_argument("--format-to", default=CANDLE_DATA_FORMAT, choices=list(DATA_FORMAT_EXTENSIONS))
+    convert.add_argument("--erase", action="store_true", help="转换后删除源文件")
+    args = parser.parse_args()
+
+    result = convert_candle_data(args.exchange, args.timeframes, args.pairs, args.format_to, args.erase)
+    for path in result["converted"]:
+        print(f"已转换: {path}")
+    for path, error in result["errors"].items():
+        print(f"转换失败: {path}: {error}")
+    print(f"转换 {len(result['converted'])} 个文件，跳过 {result['skipped']} 个已是最新的文件，"
+          f"失败 {len(result['errors'])} 个，耗时 {result['elapsed']} 秒")
+
+
+if __name__ == "__main__":
+    main()
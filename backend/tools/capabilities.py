@@ -0,0 +1,140 @@
+"""
+运行环境能力探测
+探测 freqtrade 版本、TA-Lib / pandas_ta 是否可用、支持的 K 线存储格式和 CPU 核数，结果缓存 CAPABILITY_TTL 秒，
+过期后或手动刷新时重新探测。回测和预检读取缓存的结果，不再每次启动 freqtrade --version 子进程。
+"""
+import importlib.metadata
+import importlib.util
+import os
+import platform
+import re
+import subprocess
+import threading
+import time
+from typing import Any, Dict, Optional
+
+# 探测结果的有效期（秒）
+CAPABILITY_TTL = float(os.getenv("CAPABILITY_TTL", "300"))
+# freqtrade --version 的超时时间（秒）
+CAPABILITY_PROBE_TIMEOUT = float(os.getenv("CAPABILITY_PROBE_TIMEOUT", "30"))
+
+
+def _probe_freqtrade() -> Dict[str, Any]:
+    """运行 freqtrade --version（回测实际调用的可执行文件）"""
+    start_time = time.perf_counter()
+    try:
+        result = subprocess.run(
+            ["freqtrade", "--version"],
+            capture_output=True,
+            text=True,
+            timeout=CAPABILITY_PROBE_TIMEOUT
+        )
+    except FileNotFoundError:
+        return {"available": False, "version": None, "error": "freqtrade 命令不存在"}
+    except subprocess.TimeoutExpired:
+        return {"available": False, "version": None, "error": f"freqtrade --version 超时（{CAPABILITY_PROBE_TIMEOUT:.0f}秒）"}
+    except OSError as e:
+        return {"available": False, "version": None, "error": str(e)}
+
+    output = result.stdout + result.stderr
+    match = re.search(r"freqtrade\s+([\w.\-+]+)", output)
+    return {
+        "available": result.returncode == 0,
+        "version": match.group(1) if match else None,
+        "error": None if result.returncode == 0 else output.strip()[-500:],
+        "probe_seconds": round(time.perf_counter() - start_time, 3),
+    }
+
+
+def _probe_module(module: str) -> Dict[str, Any]:
+    """模块是否可导入（只查找不导入，避免在 API 进程中加载 C 扩展）及其所属发行包的版本"""
+    if importlib.util.find_spec(module) is None:
+        return {"available": False, "version": None}
+    # 发行包名与模块名不一定相同（例如 talib 来自 TA-Lib，pandas_ta 可能来自 ft-pandas-ta）
+    distributions = importlib.metadata.packages_distributions().get(module, [])
+    version = None
+    for distribution in distributions:
+        try:
+            version = importlib.metadata.version(distribution)
+            break
+        except importlib.metadata.PackageNotFoundError:
+            continue
+    return {"available": True, "version": version}
+
+
+def _cpu_count() -> int:
+    """当前进程可用的 CPU 核数（考虑 CPU 亲和性限制）"""
+    if hasattr(os, "sched_getaffinity"):
+        return len(os.sched_getaffinity(0))
+    return os.cpu_count() or 1
+
+
+def probe_capabilities() -> Dict[str, Any]:
+    """探测当前运行环境的能力"""
+    pyarrow = _probe_module("pyarrow")
+    return {
+        "freqtrade": _probe_freqtrade(),
+        "talib": _probe_module("talib"),
+        "pandas_ta": _probe_module("pandas_ta"),
+        # freqtrade 的 feather / parquet 格式依赖 pyarrow
+        "data_formats": {
+            "json": True,
+            "jsongz": True,
+            "feather": pyarrow["available"],
+            "parquet": pyarrow["available"],
+        },
+        "cpu_count": _cpu_count(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+    }
+
+
+class CapabilityRegistry:
+    """缓存的运行环境能力（并发请求共享同一次探测）"""
+
+    def __init__(self, ttl: float = CAPABILITY_TTL):
+        self.ttl = ttl
+        self._capabilities: Optional[Dict[str, Any]] = None
+        self._probed_at = 0.0
+        self._lock = threading.Lock()
+
+    def get(self, refresh: bool = False) -> Dict[str, Any]:
+        """
+        获取能力探测结果
+
+        Args:
+            refresh: 忽略缓存立即重新探测
+
+        Returns:
+            Dict: 探测结果，附带 probed_at（探测时间戳）和 age（距探测的秒数）
+        """
+        with self._lock:
+            if refresh or self._capabilities is None or time.time() - self._probed_at > self.ttl:
+                self._capabilities = probe_capabilities()
+                self._probed_at = time.time()
+            capabilities = dict(self._capabilities)
+            probed_at = self._probed_at
+        capabilities["probed_at"] = probed_at
+        capabilities["age"] = round(time.time() - probed_at, 1)
+        return capabilities
+
+    def freqtrade_available(self) -> bool:
+        """freqtrade 命令是否可用"""
+        return self.get()["freqtrade"]["available"]
+
+    def warm_up(self):
+        """在后台线程中完成首次探测，使第一个回测请求不需要等待"""
+        threading.Thread(target=self.get, name="capability-probe", daemon=True).start()
+
+
+_registry: Optional[CapabilityRegistry] = None
+_registry_lock = threading.Lock()
+
+
+def get_capabilities() -> CapabilityRegistry:
+    """获取全局运行环境能力实例"""
+    global _registry
+    with _registry_lock:
+        if _registry is None:
+            _registry = CapabilityRegistry()
+        return _registry
@@ -0,0 +1,250 @@
+"""
+K线数据覆盖范围索引
+记录每个 (交易所, 交易对, 时间周期) 的 K 线文件中第一根/最后一根 K 线的时间和内部缺口，
+下载前据此计算请求的时间范围中实际缺少的区间，只下载这些区间（见 data_downloader.download_data_if_needed）:
+- 第一根 K 线之前缺少的部分（head）用 freqtrade download-data --prepend 向前补齐
+- 最后一根 K 线之后缺少的部分（tail）由 freqtrade 从最后一根 K 线开始增量追加，没有数据文件时（full）下载整个范围
+- 内部缺口（gap）下载到临时目录，再合并进原文件
+
+下载后仍然缺失的区间（例如交易对上线之前、交易所停机）记录为空区间，之后不再重复下载。
+索引保存在 user_data/data/coverage_index.json，K 线文件的大小或修改时间变化后重新扫描该文件。
+"""
+import json
+import os
+import threading
+import time
+from datetime import datetime, timezone
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+
+from .candle_store import (CANDLE_DATA_FORMAT, DATA_DIR, candle_file_path, pair_to_filename, parse_timerange,
+                           read_candle_file, timeframe_to_seconds)
+
+COVERAGE_INDEX_PATH = os.path.join(DATA_DIR, "coverage_index.json")
+# 内部缺口至少缺少多少根 K 线才尝试补齐
+COVERAGE_MIN_GAP_CANDLES = int(os.getenv("COVERAGE_MIN_GAP_CANDLES", "1"))
+# 结束时间距今不足这么多秒的缺失区间不记录为空区间（交易所可能还没有生成这些 K 线）
+RECENT_RANGE_SECONDS = 86400
+
+
+def _subtract(ranges: List[List[int]], removed: List[List[int]]) -> List[List[int]]:
+    """从区间列表中减去另一组区间（均为左闭右开的 [开始, 结束) 时间戳）"""
+    result = []
+    for start, end in ranges:
+        pieces = [[start, end]]
+        for removed_start, removed_end in removed:
+            next_pieces = []
+            for piece_start, piece_end in pieces:
+                if removed_end <= piece_start or removed_start >= piece_end:
+                    next_pieces.append([piece_start, piece_end])
+                    continue
+                if piece_start < removed_start:
+                    next_pieces.append([piece_start, removed_start])
+                if removed_end < piece_end:
+                    next_pieces.append([removed_end, piece_end])
+            pieces = next_pieces
+        result.extend(pieces)
+    return result
+
+
+def _merge(ranges: List[List[int]]) -> List[List[int]]:
+    """合并重叠或相邻的区间"""
+    merged: List[List[int]] = []
+    for start, end in sorted(ranges):
+        if merged and start <= merged[-1][1]:
+            merged[-1][1] = max(merged[-1][1], end)
+        else:
+            merged.append([start, end])
+    return merged
+
+
+def _isoformat(timestamp: Optional[int]) -> Optional[str]:
+    return datetime.fromtimestamp(timestamp, tz=timezone.utc).isoformat() if timestamp is not None else None
+
+
+def scan_candle_file(path: str, timeframe: str) -> Dict[str, Any]:
+    """
+    扫描 K 线文件的覆盖范围
+
+    Returns:
+        Dict: first / last（第一根和最后一根 K 线的开盘时间，Unix 秒）、candles（K 线数量）、
+              gaps（内部缺口 [[开始, 结束), ...]，即两根相邻 K 线之间缺少的时间）
+    """
+    step = timeframe_to_seconds(timeframe)
+    df = read_candle_file(path)
+    if df.empty:
+        return {"first": None, "last": None, "candles": 0, "gaps": []}
+    timestamps = df["date"].to_numpy(dtype="datetime64[s]").astype(np.int64)
+    gap_index = np.flatnonzero(np.diff(timestamps) > step)
+    return {
+        "first": int(timestamps[0]),
+        "last": int(timestamps[-1]),
+        "candles": int(len(timestamps)),
+        "gaps": [[int(timestamps[i]) + step, int(timestamps[i + 1])] for i in gap_index],
+    }
+
+
+class CoverageIndex:
+    """K 线覆盖范围索引（保存在 JSON 文件中，文件变化时按需重新扫描）"""
+
+    def __init__(self, path: str = COVERAGE_INDEX_PATH):
+        self.path = path
+        self._lock = threading.Lock()
+        self._entries: Dict[str, Dict[str, Any]] = {}
+        self._load()
+
+    def _load(self):
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                self._entries = json.load(f).get("entries", {})
+        except (OSError, ValueError, AttributeError):
+            self._entries = {}
+
+    def _save(self):
+        """保存索引（调用方需持有 self._lock）"""
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        temp_path = f"{self.path}.{threading.get_ident()}.tmp"
+        with open(temp_path, "w", encoding="utf-8") as f:
+            json.dump({"entries": self._entries, "updated_at": time.time()}, f)
+        os.replace(temp_path, self.path)
+
+    @staticmethod
+    def key(pair: str, timeframe: str, exchange: str) -> str:
+        return f"{exchange}/{pair_to_filename(pair)}-{timeframe}"
+
+    def get(self, pair: str, timeframe: str, exchange: str = "okx") -> Dict[str, Any]:
+        """
+        交易对的覆盖范围（K 线文件变化后重新扫描）
+
+        Returns:
+            Dict: scan_candle_file 的字段，另外包含 path、size、mtime_ns 和 empty（已确认交易所没有数据的区间）；
+                  没有数据文件时 first / last 为 None
+        """
+        key = self.key(pair, timeframe, exchange)
+        path = candle_file_path(pair, timeframe, exchange, CANDLE_DATA_FORMAT)
+        try:
+            stat = os.stat(path)
+            fingerprint = (stat.st_size, stat.st_mtime_ns)
+        except OSError:
+            fingerprint = None
+
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and (entry.get("size"), entry.get("mtime_ns")) == (fingerprint or (None, None)):
+                return dict(entry)
+
+        if fingerprint is None:
+            coverage = {"first": None, "last": None, "candles": 0, "gaps": []}
+        else:
+            coverage = scan_candle_file(path, timeframe)
+
+        with self._lock:
+            empty = (self._entries.get(key) or {}).get("empty", [])
+            entry = {
+                "pair": pair,
+                "timeframe": timeframe,
+                "exchange": exchange,
+                "path": path,
+                "size": fingerprint[0] if fingerprint else None,
+                "mtime_ns": fingerprint[1] if fingerprint else None,
+                **coverage,
+                "empty": empty,
+                "scanned_at": time.time(),
+            }
+            self._entries[key] = entry
+            try:
+                self._save()
+            except OSError as e:
+                print(f"Warning: 保存K线覆盖范围索引失败: {e}")
+            return dict(entry)
+
+    def missing_ranges(self, pair: str, timeframe: str, exchange: str = "okx",
+                       timerange: Optional[str] = None) -> List[Dict[str, Any]]:
+        """
+        请求的时间范围中缺少的区间（不含已确认没有数据的区间）
+
+        未指定开始时间时不要求第一根 K 线之前的数据；未指定结束时间或结束时间晚于当前时间时以当前时间为准。
+
+        Returns:
+            List[Dict]: [{"kind": "full" | "head" | "tail" | "gap", "start": Unix 秒, "end": Unix 秒}, ...]
+        """
+        step = timeframe_to_seconds(timeframe)
+        start_dt, end_dt = parse_timerange(timerange)
+        now = int(time.time()) // step * step
+        end = min(int(end_dt.timestamp()), now) if end_dt is not None else now
+        start = int(start_dt.timestamp()) if start_dt is not None else None
+
+        entry = self.get(pair, timeframe, exchange)
+        ranges = []
+        if entry["first"] is None:
+            if start is not None and start < end:
+                ranges.append(("full", [start, end]))
+        else:
+            if start is not None and start < entry["first"]:
+                ranges.append(("head", [start, min(entry["first"], end)]))
+            if entry["last"] + step < end:
+                ranges.append(("tail", [max(entry["last"] + step, start or 0), end]))
+            for gap_start, gap_end in entry["gaps"]:
+                if gap_end - gap_start < COVERAGE_MIN_GAP_CANDLES * step:
+                    continue
+                gap_start, gap_end = max(gap_start, start or gap_start), min(gap_end, end)
+                if gap_start < gap_end:
+                    ranges.append(("gap", [gap_start, gap_end]))
+
+        missing = []
+        for kind, candidate in ranges:
+            for range_start, range_end in _subtract([candidate], entry["empty"]):
+                # 不足一根 K 线的剩余部分不算缺失
+                if range_end - range_start >= step:
+                    missing.append({"kind": kind, "start": range_start, "end": range_end})
+        return missing
+
+    def mark_empty(self, pair: str, timeframe: str, exchange: str, ranges: List[Dict[str, Any]]):
+        """记录下载后仍然缺失的区间为空区间（结束时间距今太近的区间除外）"""
+        cutoff = time.time() - RECENT_RANGE_SECONDS
+        ranges = [[r["start"], r["end"]] for r in ranges if r["end"] <= cutoff]
+        if not ranges:
+            return
+        self.get(pair, timeframe, exchange)
+        key = self.key(pair, timeframe, exchange)
+        with self._lock:
+            entry = self._entries[key]
+            entry["empty"] = _merge(entry.get("empty", []) + ranges)
+            try:
+                self._save()
+            except OSError as e:
+                print(f"Warning: 保存K线覆盖范围索引失败: {e}")
+
+    def entries(self, exchange: Optional[str] = None, timeframe: Optional[str] = None) -> List[Dict[str, Any]]:
+        """索引中的所有条目（时间转换为 ISO 格式，便于查看）"""
+        with self._lock:
+            entries = [dict(entry) for entry in self._entries.values()]
+        result = []
+        for entry in sorted(entries, key=lambda e: (e["exchange"], e["pair"], e["timeframe"])):
+            if (exchange and entry["exchange"] != exchange) or (timeframe and entry["timeframe"] != timeframe):
+                continue
+            result.append({
+                "exchange": entry["exchange"],
+                "pair": entry["pair"],
+                "timeframe": entry["timeframe"],
+                "first": _isoformat(entry["first"]),
+                "last": _isoformat(entry["last"]),
+                "candles": entry["candles"],
+                "gaps": [[_isoformat(s), _isoformat(e)] for s, e in entry["gaps"]],
+                "empty": [[_isoformat(s), _isoformat(e)] for s, e in entry["empty"]],
+            })
+        return result
+
+
+_index: Optional[CoverageIndex] = None
+_index_lock = threading.Lock()
+
+
+def get_coverage_index() -> CoverageIndex:
+    """获取全局K线覆盖范围索引"""
+    global _index
+    with _index_lock:
+        if _index is None:
+            _index = CoverageIndex()
+        return _index
@@ -1,24 +1,42 @@
 """
 数据下载工具
 封装 freqtrade download-data 命令，用于下载历史K线数据
+K 线以 CANDLE_DATA_FORMAT 格式保存（见 candle_store.py），下载前会先把已有的旧格式（JSON）数据转换过来；
+根据覆盖范围索引（见 data_coverage.py）只下载请求的时间范围中缺少的区间，
+按交易对分片并发下载（见 download_manager.py）；能由已下载的较小时间周期合成的周期不单独下载（见 candle_resample.py）
 """
 import subprocess
 import os
+import shutil
 import sys
-from typing import List, Optional, Dict, Any
+import uuid
+from datetime import datetime, timezone
+from typing import Callable, List, Optional, Dict, Any
+
+import pandas as pd
+
+from .candle_resample import RESAMPLE_ENABLED, ensure_resampled, resample_source
+from .candle_store import (CANDLE_DATA_FORMAT, DATA_DIR, candle_file_path, convert_candle_data, read_candle_file,
+                           write_candle_file)
+from .data_coverage import get_coverage_index
+from .data_quality import ensure_quality, read_quality
 
 # 定义 Freqtrade 工作目录路径
 CURRENT_DIR = os.path.dirname(os.path.abspath(__file__))
 PROJECT_ROOT = os.path.dirname(os.path.dirname(CURRENT_DIR))
 FREQTRADE_WORKER_DIR = os.path.join(PROJECT_ROOT, "freqtrade_worker")
 CONFIG_PATH = os.path.join(FREQTRADE_WORKER_DIR, "user_data", "config.json")
+# 单次 freqtrade download-data 的超时时间（秒）
+DOWNLOAD_TIMEOUT = int(os.getenv("DOWNLOAD_TIMEOUT", "300"))
 
 
 def download_market_data(
     pairs: List[str],
     timeframe: str,
     timerange: str = "20230101-20231231",
-    exchange: str = "okx"
+    exchange: str = "okx",
+    prepend: bool = False,
+    datadir: Optional[str] = None
 ) -> Dict[str, Any]:
     """
     下载指定交易对和时间周期的历史数据
@@ -28,6 +46,8 @@ def download_market_data(
         timeframe: 时间周期，例如 "5m", "1h", "1d"
         timerange: 时间范围，格式 "YYYYMMDD-YYYYMMDD"
         exchange: 交易所名称，默认 "okx"
+        prepend: 在已有数据的第一根 K 线之前补充数据（freqtrade 的 --prepend），否则从最后一根 K 线之后追加
+        datadir: 数据目录（默认 user_data/data/<exchange>），补齐内部缺口时下载到临时目录
         
     Returns:
         Dict: 包含下载结果的字典
@@ -53,8 +73,13 @@ def download_market_data(
         "--timeframe", timeframe,
         "--timerange", timerange,
         "--config", CONFIG_PATH,
-        "--userdir", os.path.join(FREQTRADE_WORKER_DIR, "user_data")
+        "--userdir", os.path.join(FREQTRADE_WORKER_DIR, "user_data"),
+        "--data-format-ohlcv", CANDLE_DATA_FORMAT
     ]
+    if prepend:
+        cmd.append("--prepend")
+    if datadir:
+        cmd.extend(["--datadir", datadir])
     
     # 添加交易对
     for pair in pairs:
@@ -71,7 +96,7 @@ def download_market_data(
             capture_output=True,
             text=True,
             cwd=FREQTRADE_WORKER_DIR,
-            timeout=300,  # 5分钟超时
+            timeout=DOWNLOAD_TIMEOUT,
             creationflags=0x00000200 if os.name == 'nt' else 0  # Windows 下创建新进程组
         )
         
@@ -93,7 +118,7 @@ def download_market_data(
     except subprocess.TimeoutExpired:
         return {
             "success": False,
-            "message": "数据下载超时（超过5分钟）",
+            "message": f"数据下载超时（超过{DOWNLOAD_TIMEOUT}秒）",
             "stdout": "",
             "stderr": ""
         }
@@ -113,14 +138,19 @@ def download_market_data(
         }
 
 
-def check_data_exists(pairs: List[str], timeframe: str, exchange: str = "okx") -> Dict[str, bool]:
+def check_data_exists(pairs: List[str], timeframe: str, exchange: str = "okx",
+                      timerange: Optional[str] = None) -> Dict[str, bool]:
     """
-    检查指定交易对和时间周期的数据是否已存在
+    检查指定交易对和时间周期的数据是否已存在（以回测使用的 CANDLE_DATA_FORMAT 格式）
     
     Args:
         pairs: 交易对列表
         timeframe: 时间周期
         exchange: 交易所名称
+        timerange: 时间范围（可选），指定时还要求数据完整覆盖该范围（见 data_coverage.py）
+        
+    有最新的质量附属文件时（见 data_quality.py）直接读取其中的行数和检查结果，不打开数据文件；
+    数据文件乱序、有重复时间戳或 OHLC 不合法时视为不存在。
         
     Returns:
         Dict: 每个交易对的数据是否存在
@@ -129,59 +159,178 @@ def check_data_exists(pairs: List[str], timeframe: str, exchange: str = "okx") -
             "ETH/USDT": False
         }
     """
-    data_dir = os.path.join(FREQTRADE_WORKER_DIR, "user_data", "data", exchange)
     result = {}
     
     for pair in pairs:
-        # 将交易对格式转换为文件名格式: BTC/USDT -> BTC_USDT
-        filename = pair.replace("/", "_") + f"-{timeframe}.json"
-        filepath = os.path.join(data_dir, filename)
-        result[pair] = os.path.exists(filepath) and os.path.getsize(filepath) > 0
+        filepath = candle_file_path(pair, timeframe, exchange, CANDLE_DATA_FORMAT)
+        quality = read_quality(pair, timeframe, exchange)
+        if quality is not None:
+            result[pair] = quality["rows"] > 0 and quality["status"] != "error"
+        else:
+            result[pair] = os.path.exists(filepath) and os.path.getsize(filepath) > 0
+        if result[pair] and timerange:
+            result[pair] = not get_coverage_index().missing_ranges(pair, timeframe, exchange, timerange)
     
     return result
 
 
+def format_timerange(start: int, end: int) -> str:
+    """Unix 秒的区间转换为 freqtrade 的 YYYYMMDD-YYYYMMDD（按整天向外取整）"""
+    day = 86400
+    start_date = datetime.fromtimestamp(start // day * day, tz=timezone.utc)
+    end_date = datetime.fromtimestamp(-(-end // day) * day, tz=timezone.utc)
+    return f"{start_date:%Y%m%d}-{end_date:%Y%m%d}"
+
+
+def _merge_candle_file(source: str, target: str) -> int:
+    """
+    把临时目录中下载的 K 线合并进数据文件（已有的 K 线保留不变）
+
+    Returns:
+        int: 新增的 K 线数量
+    """
+    downloaded = read_candle_file(source)
+    existing = read_candle_file(target) if os.path.exists(target) else downloaded.iloc[:0]
+    new_rows = downloaded[~downloaded["date"].isin(existing["date"])]
+    if new_rows.empty:
+        return 0
+    merged = pd.concat([existing, new_rows], ignore_index=True).sort_values("date", kind="stable")
+    write_candle_file(merged, target)
+    return len(new_rows)
+
+
+def download_missing_ranges(missing: Dict[str, List[Dict[str, Any]]], timeframe: str, exchange: str = "okx",
+                            fetcher: Optional[Callable[..., Dict[str, Any]]] = None) -> List[Dict[str, Any]]:
+    """
+    下载各交易对缺少的区间
+
+    没有数据文件（full）和最后一根 K 线之后（tail）缺少的部分一起下载（freqtrade 对已有文件从最后一根 K 线开始追加）；
+    第一根 K 线之前缺少的部分（head）用 --prepend 下载；内部缺口（gap）下载到临时目录后合并。
+    开始时间相同的交易对合并为一条命令。
+
+    Args:
+        missing: {交易对: CoverageIndex.missing_ranges 的结果}
+        fetcher: 下载函数（默认 download_market_data，离线时为 local_exchange.fetch_candles）
+
+    Returns:
+        List[Dict]: 每条下载命令的 download_market_data 结果
+    """
+    fetcher = fetcher or download_market_data
+    # (模式, 时间范围) -> 交易对列表
+    groups: Dict[tuple, List[str]] = {}
+    for pair, ranges in missing.items():
+        by_mode: Dict[str, List[int]] = {}
+        for r in ranges:
+            mode = {"full": "append", "tail": "append"}.get(r["kind"], r["kind"])
+            span = by_mode.setdefault(mode, [r["start"], r["end"]])
+            span[0], span[1] = min(span[0], r["start"]), max(span[1], r["end"])
+        for mode, (start, end) in by_mode.items():
+            groups.setdefault((mode, format_timerange(start, end)), []).append(pair)
+
+    results = []
+    for (mode, timerange), pairs in sorted(groups.items()):
+        print(f"下载缺少的数据（{mode}）: {pairs} {timeframe} {timerange}")
+        if mode != "gap":
+            results.append(fetcher(pairs, timeframe, timerange, exchange, prepend=mode == "head"))
+            continue
+
+        scratch_dir = os.path.join(DATA_DIR, f".gapfill-{uuid.uuid4().hex[:12]}", exchange)
+        try:
+            result = fetcher(pairs, timeframe, timerange, exchange, datadir=scratch_dir)
+            if result["success"]:
+                for pair in pairs:
+                    source = candle_file_path(pair, timeframe, exchange, CANDLE_DATA_FORMAT).replace(
+                        os.path.join(DATA_DIR, exchange), scratch_dir, 1)
+                    if os.path.exists(source):
+                        added = _merge_candle_file(source, candle_file_path(pair, timeframe, exchange, CANDLE_DATA_FORMAT))
+                        print(f"补齐 {pair} {timeframe} 的内部缺口: 新增 {added} 根K线")
+            results.append(result)
+        finally:
+            shutil.rmtree(os.path.dirname(scratch_dir), ignore_errors=True)
+    return results
+
+
 def download_data_if_needed(
     pairs: List[str],
     timeframe: str,
     timerange: str = "20230101-20231231",
     exchange: str = "okx",
-    force_download: bool = False
+    force_download: bool = False,
+    progress_callback: Optional[Callable[[Dict[str, Any]], None]] = None
 ) -> Dict[str, Any]:
     """
-    检查数据是否存在，如果不存在则下载
+    检查数据是否覆盖请求的时间范围，只下载缺少的区间
+    
+    每个交易对作为一个分片提交到下载管理器并发下载，其他请求正在下载的相同分片不会重复下载（见 download_manager.py）。
+    已下载的较小周期完整覆盖请求的时间范围时（见 candle_resample.py），由来源周期合成目标周期，不再下载；
+    否则直接下载目标周期。
     
     Args:
         pairs: 交易对列表
         timeframe: 时间周期
         timerange: 时间范围
         exchange: 交易所名称
-        force_download: 是否强制重新下载
+        force_download: 是否强制按整个时间范围重新下载（不使用覆盖范围索引）
+        progress_callback: 进度回调，以 dict 形式接收每个交易对的排队、开始、完成、跳过和失败事件
         
     Returns:
-        Dict: 下载结果
+        Dict: 下载结果，missing 为下载前每个交易对缺少的区间，remaining 为下载后仍然缺少的区间
+              （已确认交易所没有数据的区间记录到索引中，之后不再重复下载），
+              resampled 为由较小周期合成目标周期的交易对及其来源周期，
+              quality_errors 为修复乱序和重复行后数据文件仍有错误（见 data_quality.py）的交易对及问题说明
     """
-    if not force_download:
-        # 检查数据是否已存在
-        data_status = check_data_exists(pairs, timeframe, exchange)
-        missing_pairs = [pair for pair, exists in data_status.items() if not exists]
-        
-        if not missing_pairs:
-            print(f"数据已存在，跳过下载: {pairs}")
-            return {
-                "success": True,
-                "message": f"数据已存在: {', '.join(pairs)} ({timeframe})",
-                "skipped": True,
-                "stdout": "",
-                "stderr": ""
-            }
-        
-        # 只下载缺失的交易对
-        pairs_to_download = missing_pairs
-        print(f"部分数据缺失，仅下载: {pairs_to_download}")
-    else:
-        pairs_to_download = pairs
-        print(f"强制下载: {pairs_to_download}")
-    
-    return download_market_data(pairs_to_download, timeframe, timerange, exchange)
+    from .download_manager import get_download_manager
+
+    # 已有的旧格式数据先转换为统一格式（已转换过的直接跳过），避免重新下载；合成时来源周期的数据也需要转换
+    conversion = convert_candle_data(exchange, None if RESAMPLE_ENABLED else [timeframe], pairs)
+    if conversion["converted"]:
+        print(f"已将 {len(conversion['converted'])} 个K线文件转换为 {CANDLE_DATA_FORMAT} 格式")
+    for path, error in conversion["errors"].items():
+        print(f"Warning: K线文件转换失败 {path}: {error}")
+
+    if force_download:
+        print(f"强制下载: {pairs}")
+
+    # 按实际使用的周期分组: 来源周期已覆盖时间范围的交易对由来源周期合成（来源周期的下载分片直接跳过）
+    groups: Dict[str, List[str]] = {}
+    for pair in pairs:
+        source_timeframe = None if force_download else resample_source(pair, timeframe, exchange, timerange)
+        groups.setdefault(source_timeframe or timeframe, []).append(pair)
+
+    manager = get_download_manager()
+    results = []
+    resampled = {}
+    quality_errors = {}
+    for download_timeframe, group in groups.items():
+        results.append(manager.download(group, download_timeframe, timerange, exchange, force=force_download,
+                                        progress_callback=progress_callback))
+        # 回测（或合成）使用的数据文件: 乱序和重复就地修复，修复后仍有错误的交易对不合成，视为数据不可用
+        quality_errors.update(ensure_quality(group, download_timeframe, exchange))
+        if download_timeframe == timeframe:
+            continue
+        for pair in group:
+            if pair in quality_errors:
+                continue
+            record = ensure_resampled(pair, timeframe, exchange)
+            if record is not None:
+                resampled[pair] = download_timeframe
+                print(f"由 {download_timeframe} 合成 {pair} {timeframe}: {record['candles']} 根K线")
 
+    skipped = all(r["skipped"] for r in results) and not quality_errors
+    if skipped:
+        print(f"数据已覆盖 {timerange}，跳过下载: {pairs}")
+    messages = [r["message"] for r in results if not r["skipped"]]
+    for pair, report in quality_errors.items():
+        messages.append(f"{pair} 数据文件有错误: {'，'.join(report['issues'])}")
+        print(f"Warning: {messages[-1]}")
+    return {
+        "success": all(r["success"] for r in results) and not quality_errors,
+        "message": f"数据已存在: {', '.join(pairs)} ({timeframe})" if skipped else "；".join(messages),
+        "skipped": skipped,
+        "stdout": "".join(r["stdout"] for r in results),
+        "stderr": "".join(r["stderr"] for r in results),
+        "missing": {pair: ranges for r in results for pair, ranges in r["missing"].items()},
+        "remaining": {pair: ranges for r in results for pair, ranges in r["remaining"].items()},
+        "resampled": resampled,
+        "quality_errors": {pair: report["issues"] for pair, report in quality_errors.items()},
+    }
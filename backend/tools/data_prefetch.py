@@ -0,0 +1,217 @@
+"""
+K线数据后台预取
+在后台线程中定期为 config.json 的 pair_whitelist 和常用时间周期下载缺少的 K 线（只增量下载缺少的区间，见 data_coverage.py），
+使用户请求使用白名单交易对时数据通常已经就绪，不需要在请求中等待下载。
+
+- 通过下载管理器下载（见 download_manager.py），与用户请求共享单飞和文件锁；每次只提交一个分片，最多占用一个下载线程
+- 磁盘预算: 数据目录的总大小加上预计新增的大小超过 PREFETCH_DISK_BUDGET_MB 时跳过该交易对/时间周期
+- 按 PREFETCH_TIMEFRAMES 的顺序、同一时间周期内按白名单顺序预取，预算不足时靠后的先被跳过
+- 已下载的较小周期覆盖预取范围时只合成，不下载（见 candle_resample.py），因此最小的周期应放在最前面
+"""
+import json
+import os
+import threading
+import time
+from typing import Any, Dict, List, Optional
+
+from .candle_resample import ensure_resampled, resample_source
+from .candle_store import CANDLE_DATA_FORMAT, DATA_DIR, timeframe_to_seconds
+from .data_coverage import get_coverage_index
+
+CURRENT_DIR = os.path.dirname(os.path.abspath(__file__))
+PROJECT_ROOT = os.path.dirname(os.path.dirname(CURRENT_DIR))
+FREQTRADE_WORKER_DIR = os.path.join(PROJECT_ROOT, "freqtrade_worker")
+CONFIG_PATH = os.path.join(FREQTRADE_WORKER_DIR, "user_data", "config.json")
+
+# 是否在服务启动时开始后台预取（true/false）
+PREFETCH_ENABLED = os.getenv("PREFETCH_ENABLED", "false").lower() == "true"
+# 预取的时间周期（逗号分隔，靠前的优先）
+PREFETCH_TIMEFRAMES = [tf.strip() for tf in os.getenv("PREFETCH_TIMEFRAMES", "5m,15m,1h,4h,1d").split(",") if tf.strip()]
+# 预取的时间范围（结束日期为空表示到当前时间，之后每轮只追加新的 K 线）
+PREFETCH_TIMERANGE = os.getenv("PREFETCH_TIMERANGE", "20230101-")
+# 两轮预取之间的间隔（秒）
+PREFETCH_INTERVAL_SECONDS = float(os.getenv("PREFETCH_INTERVAL_SECONDS", "3600"))
+# K 线数据目录的磁盘预算（MB，0 表示不限制）
+PREFETCH_DISK_BUDGET_MB = float(os.getenv("PREFETCH_DISK_BUDGET_MB", "2048"))
+
+# 没有已有文件可参考时每根 K 线预计占用的字节数（未压缩 feather，6 列 × 8 字节）
+DEFAULT_BYTES_PER_CANDLE = 48
+
+
+def _config_whitelist(config_path: str = CONFIG_PATH) -> tuple:
+    """config.json 中的 (交易所名称, pair_whitelist)"""
+    try:
+        with open(config_path, "r", encoding="utf-8") as f:
+            exchange = json.load(f).get("exchange", {})
+    except (OSError, ValueError):
+        return "okx", []
+    return exchange.get("name") or "okx", list(exchange.get("pair_whitelist") or [])
+
+
+def data_dir_size(exchange: Optional[str] = None) -> int:
+    """K 线数据目录（或其中一个交易所的子目录）的总字节数"""
+    root = os.path.join(DATA_DIR, exchange) if exchange else DATA_DIR
+    total = 0
+    for dirpath, _, filenames in os.walk(root):
+        for filename in filenames:
+            try:
+                total += os.path.getsize(os.path.join(dirpath, filename))
+            except OSError:
+                continue
+    return total
+
+
+def _bytes_per_candle(entry: Dict[str, Any]) -> float:
+    """由已有文件估计每根 K 线的字节数"""
+    if entry.get("size") and entry.get("candles"):
+        return entry["size"] / entry["candles"]
+    return DEFAULT_BYTES_PER_CANDLE
+
+
+class DataPrefetcher:
+    """白名单 K 线数据的后台预取"""
+
+    def __init__(self, timeframes: Optional[List[str]] = None, timerange: str = PREFETCH_TIMERANGE,
+                 interval: float = PREFETCH_INTERVAL_SECONDS, disk_budget_mb: float = PREFETCH_DISK_BUDGET_MB):
+        self.timeframes = timeframes or PREFETCH_TIMEFRAMES
+        self.timerange = timerange
+        self.interval = interval
+        self.disk_budget_mb = disk_budget_mb
+        self._lock = threading.Lock()
+        self._run_lock = threading.Lock()
+        self._stop_event = threading.Event()
+        self._wake_event = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self.rounds = 0
+        self.last_run: Optional[Dict[str, Any]] = None
+        self.next_run_at: Optional[float] = None
+
+    def run_once(self) -> Dict[str, Any]:
+        """
+        执行一轮预取（已有一轮在执行时等待它完成）
+
+        Returns:
+            Dict: 本轮的 downloaded / resampled（由较小周期合成）/ skipped（已覆盖）/ over_budget / failed
+                  交易对列表、数据目录大小和耗时
+        """
+        from .download_manager import get_download_manager
+
+        with self._run_lock:
+            start_time = time.time()
+            exchange, pairs = _config_whitelist()
+            index = get_coverage_index()
+            manager = get_download_manager()
+            budget_bytes = self.disk_budget_mb * 1024 * 1024
+            used_bytes = data_dir_size()
+            summary: Dict[str, Any] = {"downloaded": [], "resampled": [], "skipped": [], "over_budget": [], "failed": []}
+
+            for timeframe in self.timeframes:
+                if self._stop_event.is_set():
+                    break
+                step = timeframe_to_seconds(timeframe)
+                for pair in pairs:
+                    if self._stop_event.is_set():
+                        break
+                    target = f"{pair} {timeframe}"
+                    # 来源周期已覆盖预取范围时只合成（来源周期通常在 PREFETCH_TIMEFRAMES 中靠前，本轮已经更新）
+                    if resample_source(pair, timeframe, exchange, self.timerange) is not None:
+                        if ensure_resampled(pair, timeframe, exchange) is not None:
+                            summary["resampled"].append(target)
+                        continue
+                    missing = index.missing_ranges(pair, timeframe, exchange, self.timerange)
+                    if not missing:
+                        summary["skipped"].append(target)
+                        continue
+
+                    entry = index.get(pair, timeframe, exchange)
+                    estimate = sum(r["end"] - r["start"] for r in missing) / step * _bytes_per_candle(entry)
+                    if budget_bytes > 0 and used_bytes + estimate > budget_bytes:
+                        summary["over_budget"].append(target)
+                        continue
+
+                    result = manager.download([pair], timeframe, self.timerange, exchange)
+                    if result["success"]:
+                        summary["downloaded"].append(target)
+                    else:
+                        summary["failed"].append(target)
+                        print(f"Warning: 预取 {target} 失败: {result['message']}")
+                    used_bytes = data_dir_size()
+
+            summary.update({
+                "exchange": exchange,
+                "timeframes": self.timeframes,
+                "timerange": self.timerange,
+                "data_format": CANDLE_DATA_FORMAT,
+                "disk_used_mb": round(used_bytes / (1024 * 1024), 1),
+                "disk_budget_mb": self.disk_budget_mb,
+                "started_at": start_time,
+                "elapsed": round(time.time() - start_time, 2),
+            })
+            with self._lock:
+                self.rounds += 1
+                self.last_run = summary
+            if summary["downloaded"] or summary["over_budget"] or summary["failed"]:
+                print(f"数据预取完成: 下载 {len(summary['downloaded'])} 个，合成 {len(summary['resampled'])} 个，已覆盖 {len(summary['skipped'])} 个，"
+                      f"超出磁盘预算 {len(summary['over_budget'])} 个，失败 {len(summary['failed'])} 个")
+            return summary
+
+    def _loop(self):
+        while not self._stop_event.is_set():
+            try:
+                self.run_once()
+            except Exception as e:
+                print(f"Warning: 数据预取异常: {e}")
+            with self._lock:
+                self.next_run_at = time.time() + self.interval
+            self._wake_event.wait(self.interval)
+            self._wake_event.clear()
+
+    def start(self):
+        """启动后台预取线程（已启动时不重复启动）"""
+        with self._lock:
+            if self._thread is not None and self._thread.is_alive():
+                return
+            self._stop_event.clear()
+            self._wake_event.clear()
+            self._thread = threading.Thread(target=self._loop, name="data-prefetch", daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        """停止后台预取（正在下载的分片会完成）"""
+        self._stop_event.set()
+        self._wake_event.set()
+
+    def trigger(self):
+        """立即开始下一轮预取（后台线程未启动时启动）"""
+        with self._lock:
+            running = self._thread is not None and self._thread.is_alive()
+        if running:
+            self._wake_event.set()
+        else:
+            self.start()
+
+    def status(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "running": self._thread is not None and self._thread.is_alive() and not self._stop_event.is_set(),
+                "timeframes": self.timeframes,
+                "timerange": self.timerange,
+                "interval": self.interval,
+                "disk_budget_mb": self.disk_budget_mb,
+                "rounds": self.rounds,
+                "next_run_at": self.next_run_at,
+                "last_run": self.last_run,
+            }
+
+
+_prefetcher: Optional[DataPrefetcher] = None
+_prefetcher_lock = threading.Lock()
+
+
+def get_prefetcher() -> DataPrefetcher:
+    """获取全局数据预取器"""
+    global _prefetcher
+    with _prefetcher_lock:
+        if _prefetcher is None:
+            _prefetcher = DataPrefetcher()
+        return _prefetcher
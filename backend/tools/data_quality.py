@@ -0,0 +1,398 @@
+"""
+K线数据完整性检查和修复
+对数据目录中的 K 线文件做向量化检查（每个文件一次 numpy 计算，不逐行循环）:
+
+- 时间戳是否单调递增、重复的时间戳
+- 按时间周期计算缺少的 K 线（缺口）
+- OHLC 不合法的行（high 低于 open/close、low 高于 open/close、价格非正数或为空）
+- 异常值: 收盘价对数收益率或 K 线振幅的稳健 z 分数（中位数 / MAD）超过 QUALITY_OUTLIER_ZSCORE
+- 连续的零成交量 K 线（至少 QUALITY_ZERO_VOLUME_RUN 根）
+
+每个文件的检查结果写入质量附属文件 user_data/data/quality/<exchange>/<文件名>.json（行数、缺口、校验和等），
+附属文件记录数据文件的大小和修改时间，数据文件变化后视为过期。
+check_data_exists 和回测结果缓存读取附属文件，不需要打开数据文件（见 read_quality / data_fingerprint）；
+download_data_if_needed 在下载后用 ensure_quality 检查回测使用的文件，有错误的交易对视为数据不可用。
+
+修复: 乱序和重复的行在文件锁内就地排序去重；可以从交易所补齐的缺口提交给下载管理器（见 download_manager.py），
+由下载管理器下载缺口后合并。零成交量和异常值通常是交易所的真实数据，只报告不修复。
+
+命令行:
+    python -m backend.tools.data_quality scan --exchange okx [--timeframes 5m 1h] [--repair]
+"""
+import argparse
+import hashlib
+import json
+import os
+import threading
+import time
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+
+from .candle_store import (CANDLE_DATA_FORMAT, CANDLE_FILENAME_PATTERN, DATA_DIR, candle_file_path, read_candle_file,
+                           timeframe_to_seconds, write_candle_file)
+
+QUALITY_DIR = os.path.join(DATA_DIR, "quality")
+# 异常值的稳健 z 分数阈值
+QUALITY_OUTLIER_ZSCORE = float(os.getenv("QUALITY_OUTLIER_ZSCORE", "12"))
+# 至少连续多少根零成交量 K 线才报告
+QUALITY_ZERO_VOLUME_RUN = int(os.getenv("QUALITY_ZERO_VOLUME_RUN", "6"))
+
+# 附属文件格式版本，格式或检查规则变化时递增，使旧附属文件失效
+QUALITY_VERSION = 1
+# 附属文件中保留的最大缺口和异常值数量
+QUALITY_SAMPLES_KEEP = 20
+
+
+def _filename_to_pair(name: str) -> str:
+    """文件名中的交易对还原为 freqtrade 格式: BTC_USDT -> BTC/USDT，BTC_USDT_USDT -> BTC/USDT:USDT"""
+    parts = name.split("_")
+    if len(parts) == 3:
+        return f"{parts[0]}/{parts[1]}:{parts[2]}"
+    if len(parts) == 2:
+        return f"{parts[0]}/{parts[1]}"
+    return name
+
+
+def quality_path(data_path: str) -> str:
+    """数据文件对应的质量附属文件路径"""
+    exchange = os.path.basename(os.path.dirname(data_path))
+    return os.path.join(QUALITY_DIR, exchange, os.path.basename(data_path) + ".json")
+
+
+def file_checksum(path: str) -> str:
+    """数据文件内容的校验和（blake2b）"""
+    digest = hashlib.blake2b(digest_size=16)
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _robust_outliers(values: np.ndarray, threshold: float) -> np.ndarray:
+    """稳健 z 分数（以中位数和 MAD 代替均值和标准差）超过阈值的位置"""
+    finite = values[np.isfinite(values)]
+    if len(finite) < 10:
+        return np.array([], dtype=np.int64)
+    median = np.median(finite)
+    mad = np.median(np.abs(finite - median)) * 1.4826
+    if mad == 0:
+        return np.array([], dtype=np.int64)
+    with np.errstate(invalid="ignore"):
+        return np.flatnonzero(np.abs(values - median) / mad > threshold)
+
+
+def _runs(mask: np.ndarray, min_length: int) -> List[List[int]]:
+    """布尔数组中长度至少为 min_length 的连续 True 区间 [[开始位置, 结束位置), ...]"""
+    edges = np.diff(np.concatenate(([0], mask.astype(np.int8), [0])))
+    starts, ends = np.flatnonzero(edges == 1), np.flatnonzero(edges == -1)
+    long_runs = (ends - starts) >= min_length
+    return [[int(s), int(e)] for s, e in zip(starts[long_runs], ends[long_runs])]
+
+
+def check_candles(df, timeframe: str) -> Dict[str, Any]:
+    """
+    检查 K 线数据（保留文件中的原始顺序）
+
+    Returns:
+        Dict: rows、first / last（Unix 秒）、unsorted（时间戳比上一行小的行数）、duplicates（重复时间戳数量）、
+              gaps / missing_bars（缺口数量和缺少的 K 线数）、gap_samples（最大的几个缺口 [开始, 结束)）、
+              invalid_ohlc、outliers / outlier_samples（异常 K 线的开盘时间）、zero_volume_runs / zero_volume_bars、
+              status（ok / warning / error）和 issues（问题说明）
+    """
+    step = timeframe_to_seconds(timeframe)
+    rows = len(df)
+    report: Dict[str, Any] = {
+        "rows": rows, "first": None, "last": None, "unsorted": 0, "duplicates": 0, "gaps": 0, "missing_bars": 0,
+        "gap_samples": [], "invalid_ohlc": 0, "outliers": 0, "outlier_samples": [],
+        "zero_volume_runs": 0, "zero_volume_bars": 0,
+    }
+    if rows:
+        timestamps = df["date"].to_numpy(dtype="datetime64[s]").astype(np.int64)
+        report["unsorted"] = int(np.count_nonzero(np.diff(timestamps) < 0))
+        unique = np.unique(timestamps)
+        report["duplicates"] = rows - len(unique)
+        report["first"], report["last"] = int(unique[0]), int(unique[-1])
+
+        # 缺口按排序去重后的时间戳计算
+        deltas = np.diff(unique)
+        gap_index = np.flatnonzero(deltas > step)
+        missing = deltas[gap_index] // step - 1
+        report["gaps"] = int(len(gap_index))
+        report["missing_bars"] = int(missing.sum())
+        largest = gap_index[np.argsort(-missing, kind="stable")[:QUALITY_SAMPLES_KEEP]]
+        report["gap_samples"] = [[int(unique[i]) + step, int(unique[i + 1])] for i in np.sort(largest)]
+
+        open_, high, low, close, volume = (df[col].to_numpy(dtype=np.float64)
+                                           for col in ("open", "high", "low", "close", "volume"))
+        with np.errstate(invalid="ignore"):
+            invalid = (~np.isfinite(open_) | ~np.isfinite(high) | ~np.isfinite(low) | ~np.isfinite(close)
+                       | (low <= 0) | (high < np.maximum(open_, close)) | (low > np.minimum(open_, close))
+                       | (volume < 0))
+        report["invalid_ohlc"] = int(np.count_nonzero(invalid))
+
+        order = np.argsort(timestamps, kind="stable") if report["unsorted"] else slice(None)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            returns = np.diff(np.log(close[order]))
+            ranges = np.log(high[order] / low[order])
+        outliers = np.union1d(_robust_outliers(returns, QUALITY_OUTLIER_ZSCORE) + 1,
+                              _robust_outliers(ranges, QUALITY_OUTLIER_ZSCORE))
+        sorted_timestamps = timestamps[order]
+        report["outliers"] = int(len(outliers))
+        report["outlier_samples"] = [int(sorted_timestamps[i]) for i in outliers[:QUALITY_SAMPLES_KEEP]]
+
+        runs = _runs(volume[order] == 0, QUALITY_ZERO_VOLUME_RUN)
+        report["zero_volume_runs"] = len(runs)
+        report["zero_volume_bars"] = int(sum(end - start for start, end in runs))
+
+    issues = []
+    if report["unsorted"]:
+        issues.append(f"{report['unsorted']} 行时间戳乱序")
+    if report["duplicates"]:
+        issues.append(f"{report['duplicates']} 个重复的时间戳")
+    if report["invalid_ohlc"]:
+        issues.append(f"{report['invalid_ohlc']} 行 OHLC 不合法")
+    if report["gaps"]:
+        issues.append(f"{report['gaps']} 个缺口，共缺少 {report['missing_bars']} 根K线")
+    if report["outliers"]:
+        issues.append(f"{report['outliers']} 根异常K线")
+    if report["zero_volume_runs"]:
+        issues.append(f"{report['zero_volume_runs']} 段连续零成交量（共 {report['zero_volume_bars']} 根）")
+    if not rows or report["unsorted"] or report["duplicates"] or report["invalid_ohlc"]:
+        report["status"] = "error"
+    elif issues:
+        report["status"] = "warning"
+    else:
+        report["status"] = "ok"
+    report["issues"] = issues if rows else ["没有数据"]
+    return report
+
+
+def scan_file(path: str, timeframe: str) -> Dict[str, Any]:
+    """检查一个数据文件并写入质量附属文件"""
+    start_time = time.perf_counter()
+    stat = os.stat(path)
+    report = check_candles(read_candle_file(path, sort=False), timeframe)
+    report.update({
+        "version": QUALITY_VERSION,
+        "file": os.path.basename(path),
+        "timeframe": timeframe,
+        "size": stat.st_size,
+        "mtime_ns": stat.st_mtime_ns,
+        "checksum": file_checksum(path),
+        "scanned_at": time.time(),
+        "elapsed": round(time.perf_counter() - start_time, 4),
+    })
+
+    sidecar = quality_path(path)
+    os.makedirs(os.path.dirname(sidecar), exist_ok=True)
+    temp_path = f"{sidecar}.{threading.get_ident()}.tmp"
+    with open(temp_path, "w", encoding="utf-8") as f:
+        json.dump(report, f)
+    os.replace(temp_path, sidecar)
+    return report
+
+
+def _read_sidecar(path: str) -> Optional[Dict[str, Any]]:
+    """读取数据文件的质量附属文件，附属文件不存在或已过期（数据文件变化）时返回 None"""
+    try:
+        stat = os.stat(path)
+        with open(quality_path(path), "r", encoding="utf-8") as f:
+            report = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if (report.get("version") != QUALITY_VERSION
+            or (report.get("size"), report.get("mtime_ns")) != (stat.st_size, stat.st_mtime_ns)):
+        return None
+    return report
+
+
+def read_quality(pair: str, timeframe: str, exchange: str = "okx") -> Optional[Dict[str, Any]]:
+    """读取交易对 CANDLE_DATA_FORMAT 数据文件（回测实际读取的文件）的质量报告（不打开数据文件），没有最新的报告时返回 None"""
+    return _read_sidecar(candle_file_path(pair, timeframe, exchange, CANDLE_DATA_FORMAT))
+
+
+def data_fingerprint(path: str) -> list:
+    """
+    缓存键中使用的数据文件指纹
+
+    质量附属文件是最新的时使用内容校验和（内容相同的文件被重写后缓存仍然有效），否则使用大小和修改时间。
+    """
+    report = _read_sidecar(path)
+    if report is not None:
+        return [os.path.basename(path), report["checksum"]]
+    stat = os.stat(path)
+    return [os.path.basename(path), stat.st_size, stat.st_mtime_ns]
+
+
+def _data_files(exchange: Optional[str], timeframes: Optional[List[str]]) -> List[Dict[str, str]]:
+    """数据目录中的 K 线文件（只包含每个交易所目录的顶层，不含 futures 等子目录）"""
+    exchanges = [exchange] if exchange else sorted(
+        name for name in os.listdir(DATA_DIR)
+        if os.path.isdir(os.path.join(DATA_DIR, name)) and name != "quality" and not name.startswith(".")
+    ) if os.path.isdir(DATA_DIR) else []
+    files = []
+    for exchange_name in exchanges:
+        data_dir = os.path.join(DATA_DIR, exchange_name)
+        if not os.path.isdir(data_dir):
+            continue
+        for entry in sorted(os.scandir(data_dir), key=lambda e: e.name):
+            match = CANDLE_FILENAME_PATTERN.match(entry.name)
+            if not match or not entry.is_file():
+                continue
+            if timeframes and match.group("timeframe") not in timeframes:
+                continue
+            files.append({"exchange": exchange_name, "pair": _filename_to_pair(match.group("pair")),
+                          "timeframe": match.group("timeframe"), "path": entry.path})
+    return files
+
+
+def _repair_order(file: Dict[str, str]) -> Dict[str, Any]:
+    """就地排序去重（重复的时间戳保留最后一行，即最后下载的数据），在下载管理器的文件锁内执行"""
+    from .download_manager import get_download_manager
+
+    with get_download_manager().file_lock(file["exchange"], file["pair"], file["timeframe"]):
+        df = read_candle_file(file["path"])
+        deduplicated = df.drop_duplicates("date", keep="last").reset_index(drop=True)
+        write_candle_file(deduplicated, file["path"])
+    return scan_file(file["path"], file["timeframe"])
+
+
+def repair_file(file: Dict[str, str], report: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    修复一个数据文件
+
+    Returns:
+        Dict: rewritten（是否就地排序去重）、queued（提交给下载管理器的缺口时间范围，没有时为 None）
+    """
+    from .candle_resample import is_derived
+    from .data_coverage import get_coverage_index
+    from .data_downloader import format_timerange
+    from .download_manager import get_download_manager
+
+    result: Dict[str, Any] = {"rewritten": False, "queued": None}
+    # 合成的数据由来源数据重新合成，其他格式的旧文件不是回测读取的文件，都不单独修复
+    if (is_derived(file["pair"], file["timeframe"], file["exchange"])
+            or file["path"] != candle_file_path(file["pair"], file["timeframe"], file["exchange"], CANDLE_DATA_FORMAT)):
+        return result
+
+    if report["unsorted"] or report["duplicates"]:
+        report = _repair_order(file)
+        result["rewritten"] = True
+
+    if report["gaps"]:
+        step = timeframe_to_seconds(file["timeframe"])
+        timerange = format_timerange(report["first"], report["last"] + step)
+        # 已确认交易所没有数据的缺口不再提交
+        missing = get_coverage_index().missing_ranges(file["pair"], file["timeframe"], file["exchange"], timerange)
+        if any(r["kind"] == "gap" for r in missing):
+            get_download_manager().submit(file["pair"], file["timeframe"], timerange, file["exchange"])
+            result["queued"] = timerange
+    return result
+
+
+def ensure_quality(pairs: List[str], timeframe: str, exchange: str = "okx") -> Dict[str, Dict[str, Any]]:
+    """
+    回测前检查交易对的 CANDLE_DATA_FORMAT 数据文件（有最新的附属文件时直接读取），乱序和重复的行就地修复
+
+    Returns:
+        Dict: 修复后仍有错误（没有数据、OHLC 不合法）的交易对及其质量报告，没有数据文件的交易对不包含在内
+    """
+    from .candle_resample import is_derived
+
+    errors = {}
+    for pair in pairs:
+        path = candle_file_path(pair, timeframe, exchange, CANDLE_DATA_FORMAT)
+        if not os.path.exists(path):
+            continue
+        report = read_quality(pair, timeframe, exchange)
+        if report is None:
+            report = scan_file(path, timeframe)
+        # 合成的数据由来源数据重新合成，不就地修复
+        if (report["status"] == "error" and (report["unsorted"] or report["duplicates"])
+                and not is_derived(pair, timeframe, exchange)):
+            report = _repair_order({"exchange": exchange, "pair": pair, "timeframe": timeframe, "path": path})
+            print(f"已修复 {pair} {timeframe} 数据文件的乱序和重复行")
+        if report["status"] == "error":
+            errors[pair] = report
+    return errors
+
+
+def scan_data_dir(exchange: Optional[str] = None, timeframes: Optional[List[str]] = None,
+                  repair: bool = False, rescan: bool = False) -> Dict[str, Any]:
+    """
+    检查数据目录中的所有 K 线文件（附属文件是最新的文件直接读取附属文件，除非 rescan）
+
+    Args:
+        exchange: 只检查这个交易所（默认全部）
+        timeframes: 只检查这些时间周期（默认全部）
+        repair: 修复发现的问题（乱序和重复就地修复，缺口提交给下载管理器，不等待下载完成）
+        rescan: 忽略最新的附属文件，重新检查
+
+    Returns:
+        Dict: files（每个文件的 exchange / pair / timeframe / status / issues 和修复情况）、
+              按状态统计的数量、scanned（实际检查的文件数）和耗时
+    """
+    start_time = time.perf_counter()
+    files = []
+    counts = {"ok": 0, "warning": 0, "error": 0}
+    scanned = 0
+    for file in _data_files(exchange, timeframes):
+        report = None if rescan else _read_sidecar(file["path"])
+        if report is None:
+            try:
+                report = scan_file(file["path"], file["timeframe"])
+            except Exception as e:
+                print(f"Warning: 检查K线文件失败 {file['path']}: {e}")
+                continue
+            scanned += 1
+        summary = {
+            "exchange": file["exchange"],
+            "pair": file["pair"],
+            "timeframe": file["timeframe"],
+            "file": report["file"],
+            "rows": report["rows"],
+            "status": report["status"],
+            "issues": report["issues"],
+        }
+        if repair and report["status"] != "ok":
+            summary["repair"] = repair_file(file, report)
+        counts[report["status"]] += 1
+        files.append(summary)
+    return {
+        "files": files,
+        **counts,
+        "scanned": scanned,
+        "elapsed": round(time.perf_counter() - start_time, 3),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="K 线数据完整性检查")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    scan = subparsers.add_parser("scan", help="检查数据目录中的 K 线文件并写入质量附属文件")
+    scan.add_argument("--exchange", help="只检查这个交易所（默认全部）")
+    scan.add_argument("--timeframes", nargs="*", help="只检查这些时间周期（默认全部）")
+    scan.add_argument("--repair", action="store_true", help="修复乱序和重复的行，并下载可以补齐的缺口")
+    scan.add_argument("--rescan", action="store_true", help="忽略已有的附属文件重新检查")
+    args = parser.parse_args()
+
+    result = scan_data_dir(args.exchange, args.timeframes, args.repair, args.rescan)
+    for file in result["files"]:
+        if file["status"] != "ok":
+            print(f"[{file['status']}] {file['exchange']} {file['pair']} {file['timeframe']}: {'；'.join(file['issues'])}")
+        if file.get("repair", {}).get("queued"):
+            print(f"    已提交补齐缺口: {file['repair']['queued']}")
+    print(f"正常 {result['ok']} 个，警告 {result['warning']} 个，错误 {result['error']} 个，"
+          f"本次检查 {result['scanned']} 个文件，耗时 {result['elapsed']} 秒")
+
+    if args.repair:
+        # 等待提交的缺口下载完成
+        from .download_manager import get_download_manager
+        manager = get_download_manager()
+        while manager.stats()["inflight"]:
+            time.sleep(0.5)
+
+
+if __name__ == "__main__":
+    main()
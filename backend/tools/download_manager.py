@@ -0,0 +1,262 @@
+"""
+K线数据下载管理器
+按 (交易所, 交易对, 时间周期) 把下载请求拆分为分片，提交到有界的线程池并发下载（每个分片一个 freqtrade download-data 进程）:
+
+- 相同的分片（交易对、时间周期和时间范围都相同）正在下载时，后来的请求直接等待同一个下载结果（single-flight）
+- 同一个数据文件同一时间只有一个分片在写入（按文件加锁），时间范围不同的请求排队，拿到锁后重新计算缺少的区间
+- 每个分片的排队、开始、完成、跳过和失败都以进度事件通知调用方，最近的事件可以通过 /data/downloads 查看
+
+实际下载由 DOWNLOAD_FETCHER 选择: freqtrade（data_downloader.download_market_data）或 local（离线的本地替身交易所，见 local_exchange.py）。
+"""
+import itertools
+import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any, Callable, Dict, List, Optional
+
+from .data_coverage import get_coverage_index
+
+# 同时下载的分片数量（每个分片一个 freqtrade 进程，主要受交易所限速约束）
+DOWNLOAD_MAX_WORKERS = int(os.getenv("DOWNLOAD_MAX_WORKERS", "4"))
+# 下载方式: freqtrade / local（离线的本地替身交易所）
+DOWNLOAD_FETCHER = os.getenv("DOWNLOAD_FETCHER", "freqtrade")
+# 保留的最近进度事件数量
+DOWNLOAD_EVENTS_KEEP = 200
+
+ProgressCallback = Callable[[Dict[str, Any]], None]
+
+
+def get_fetcher(name: str = DOWNLOAD_FETCHER) -> Callable[..., Dict[str, Any]]:
+    """下载函数（参数和返回值与 data_downloader.download_market_data 相同）"""
+    if name == "local":
+        from .local_exchange import fetch_candles
+        return fetch_candles
+    from .data_downloader import download_market_data
+    return download_market_data
+
+
+class _Shard:
+    """一个正在进行的分片下载，以及等待它的所有调用方的进度回调"""
+
+    def __init__(self, key: tuple):
+        self.key = key
+        self.future: Future = Future()
+        self.callbacks: List[ProgressCallback] = []
+        self.waiters = 1
+
+
+class DownloadManager:
+    """按交易对/时间周期分片的并发下载管理器"""
+
+    def __init__(self, max_workers: int = DOWNLOAD_MAX_WORKERS, fetcher: Optional[Callable[..., Dict[str, Any]]] = None):
+        self.max_workers = max(1, max_workers)
+        self.fetcher = fetcher or get_fetcher()
+        self._executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="download")
+        self._lock = threading.Lock()
+        self._inflight: Dict[tuple, _Shard] = {}
+        self._file_locks: Dict[tuple, threading.Lock] = {}
+        self._events: deque = deque(maxlen=DOWNLOAD_EVENTS_KEEP)
+        self._sequence = itertools.count(1)
+        self._stats = {"submitted": 0, "coalesced": 0, "downloaded": 0, "skipped": 0, "failed": 0}
+
+    def file_lock(self, exchange: str, pair: str, timeframe: str) -> threading.Lock:
+        """数据文件的写入锁（下载和就地修复数据文件时持有）"""
+        with self._lock:
+            return self._file_locks.setdefault((exchange, pair, timeframe), threading.Lock())
+
+    def _emit(self, shard: _Shard, status: str, message: str, **extra):
+        exchange, pair, timeframe, timerange, force = shard.key
+        event = {
+            "seq": next(self._sequence),
+            "time": time.time(),
+            "status": status,
+            "exchange": exchange,
+            "pair": pair,
+            "timeframe": timeframe,
+            "timerange": timerange,
+            "message": message,
+            **extra,
+        }
+        with self._lock:
+            self._events.append(event)
+            callbacks = list(shard.callbacks)
+        for callback in callbacks:
+            try:
+                callback(event)
+            except Exception as e:
+                # 进度回调出错（例如 WebSocket 已断开）不影响下载
+                print(f"Warning: 下载进度回调失败: {e}")
+
+    def submit(self, pair: str, timeframe: str, timerange: str, exchange: str = "okx", force: bool = False,
+               progress_callback: Optional[ProgressCallback] = None) -> Future:
+        """
+        提交一个分片下载（相同的分片正在下载时返回同一个 Future）
+
+        Returns:
+            Future: 结果为 {"pair", "success", "skipped", "message", "stdout", "stderr", "missing", "remaining"}
+        """
+        key = (exchange, pair, timeframe, timerange, force)
+        with self._lock:
+            shard = self._inflight.get(key)
+            if shard is not None:
+                shard.waiters += 1
+                if progress_callback:
+                    shard.callbacks.append(progress_callback)
+                self._stats["coalesced"] += 1
+                coalesced = True
+            else:
+                shard = _Shard(key)
+                if progress_callback:
+                    shard.callbacks.append(progress_callback)
+                self._inflight[key] = shard
+                self._stats["submitted"] += 1
+                coalesced = False
+
+        if coalesced:
+            if progress_callback:
+                progress_callback({"status": "coalesced", "exchange": exchange, "pair": pair, "timeframe": timeframe,
+                                   "timerange": timerange, "message": f"{pair} {timeframe} 正在下载，等待同一个下载结果"})
+            return shard.future
+
+        self._emit(shard, "queued", f"{pair} {timeframe} 等待下载")
+        self._executor.submit(self._run, shard)
+        return shard.future
+
+    def _run(self, shard: _Shard):
+        exchange, pair, timeframe, timerange, force = shard.key
+        try:
+            result = self._download_shard(shard)
+        except Exception as e:
+            result = {"pair": pair, "success": False, "skipped": False, "message": f"数据下载异常: {e}",
+                      "stdout": "", "stderr": "", "missing": [], "remaining": []}
+        with self._lock:
+            self._inflight.pop(shard.key, None)
+            self._stats["skipped" if result["skipped"] else "downloaded" if result["success"] else "failed"] += 1
+        status = "skipped" if result["skipped"] else "completed" if result["success"] else "failed"
+        self._emit(shard, status, result["message"], elapsed=result.get("elapsed"))
+        shard.future.set_result(result)
+
+    def _download_shard(self, shard: _Shard) -> Dict[str, Any]:
+        """在数据文件锁内计算缺少的区间并下载（锁内重新计算，前一个请求已经下载的部分不再重复下载）"""
+        from .data_downloader import download_missing_ranges
+
+        exchange, pair, timeframe, timerange, force = shard.key
+        with self.file_lock(exchange, pair, timeframe):
+            start_time = time.monotonic()
+            index = get_coverage_index()
+            if force:
+                missing = []
+                self._emit(shard, "started", f"{pair} {timeframe} 开始强制下载 {timerange}")
+                results = [self.fetcher([pair], timeframe, timerange, exchange)]
+            else:
+                missing = index.missing_ranges(pair, timeframe, exchange, timerange)
+                if not missing:
+                    return {"pair": pair, "success": True, "skipped": True,
+                            "message": f"{pair} {timeframe} 数据已覆盖 {timerange}",
+                            "stdout": "", "stderr": "", "missing": [], "remaining": []}
+                self._emit(shard, "started", f"{pair} {timeframe} 开始下载 {len(missing)} 个缺少的区间",
+                           ranges=len(missing))
+                results = download_missing_ranges({pair: missing}, timeframe, exchange, fetcher=self.fetcher)
+
+            success = all(r["success"] for r in results)
+            self._refresh_quality(pair, timeframe, exchange)
+            remaining = index.missing_ranges(pair, timeframe, exchange, timerange)
+            # 下载成功后仍然缺少的区间记录为空区间（交易所没有这些数据）
+            if success and remaining and not force:
+                index.mark_empty(pair, timeframe, exchange, remaining)
+            return {
+                "pair": pair,
+                "success": success,
+                "skipped": False,
+                "message": "；".join(r["message"] for r in results),
+                "stdout": "".join(r.get("stdout", "") for r in results),
+                "stderr": "".join(r.get("stderr", "") for r in results),
+                "missing": [] if force else missing,
+                "remaining": remaining,
+                "elapsed": round(time.monotonic() - start_time, 2),
+            }
+
+    @staticmethod
+    def _refresh_quality(pair: str, timeframe: str, exchange: str):
+        """下载后重新生成数据文件的质量附属文件（见 data_quality.py），使缓存可以继续使用内容校验和"""
+        from .candle_store import CANDLE_DATA_FORMAT, candle_file_path
+        from .data_quality import scan_file
+
+        path = candle_file_path(pair, timeframe, exchange, CANDLE_DATA_FORMAT)
+        if not os.path.exists(path):
+            return
+        try:
+            scan_file(path, timeframe)
+        except Exception as e:
+            print(f"Warning: 检查K线文件失败 {path}: {e}")
+
+    def download(self, pairs: List[str], timeframe: str, timerange: str, exchange: str = "okx", force: bool = False,
+                 progress_callback: Optional[ProgressCallback] = None) -> Dict[str, Any]:
+        """
+        并发下载多个交易对并等待全部完成
+
+        Returns:
+            Dict: 与 data_downloader.download_data_if_needed 相同的格式，
+                  missing / remaining 为每个交易对下载前后缺少的区间（只包含有缺失的交易对）
+        """
+        total = len(pairs)
+        completed = {"count": 0}
+        counter_lock = threading.Lock()
+
+        def on_progress(event: Dict[str, Any]):
+            if progress_callback is None:
+                return
+            event = dict(event)
+            if event["status"] in ("completed", "skipped", "failed"):
+                with counter_lock:
+                    completed["count"] += 1
+            event.update({"completed": completed["count"], "total": total})
+            progress_callback(event)
+
+        futures = [self.submit(pair, timeframe, timerange, exchange, force, on_progress) for pair in pairs]
+        results = [future.result() for future in futures]
+
+        skipped = all(r["skipped"] for r in results)
+        if skipped:
+            message = f"数据已存在: {', '.join(pairs)} ({timeframe})"
+        else:
+            message = "；".join(r["message"] for r in results if not r["skipped"])
+        return {
+            "success": all(r["success"] for r in results),
+            "message": message,
+            "skipped": skipped,
+            "stdout": "".join(r["stdout"] for r in results),
+            "stderr": "".join(r["stderr"] for r in results),
+            "missing": {r["pair"]: r["missing"] for r in results if r["missing"]},
+            "remaining": {r["pair"]: r["remaining"] for r in results if r["remaining"]},
+        }
+
+    def stats(self) -> Dict[str, Any]:
+        """下载统计、正在下载的分片和最近的进度事件"""
+        with self._lock:
+            return {
+                "max_workers": self.max_workers,
+                "fetcher": f"{self.fetcher.__module__}.{self.fetcher.__name__}",
+                **self._stats,
+                "inflight": [
+                    {"exchange": key[0], "pair": key[1], "timeframe": key[2], "timerange": key[3],
+                     "waiters": shard.waiters}
+                    for key, shard in self._inflight.items()
+                ],
+                "events": list(self._events)[-50:],
+            }
+
+
+_manager: Optional[DownloadManager] = None
+_manager_lock = threading.Lock()
+
+
+def get_download_manager() -> DownloadManager:
+    """获取全局下载管理器"""
+    global _manager
+    with _manager_lock:
+        if _manager is None:
+            _manager = DownloadManager()
+        return _manager
@@ -1,9 +1,22 @@
 import subprocess
 import json
 import os
+import re
+import ast
+import time
+import uuid
 import shutil
+import signal
 import sys
-from typing import Dict, Any, Optional
+import queue
+import threading
+from dataclasses import dataclass
+from typing import Any, Callable, Dict, List, Optional
+
+from .backtest_results import BacktestResult, merge_backtest_results
+from .backtest_timeout import compute_timeout_budget, get_throughput_model
+from .candle_store import CANDLE_DATA_FORMAT
+from .resource_limits import BACKTEST_MAX_CPU_SECONDS, BACKTEST_MAX_RSS_MB, ResourceLimitExceeded, ResourceMonitor
 
 # 定义 Freqtrade 工作目录路径 (相对于项目根目录)
 # 假设当前脚本在 backend/tools/，项目根目录在 ../../
@@ -13,158 +26,512 @@ PROJECT_ROOT = os.path.dirname(os.path.dirname(CURRENT_DIR))
 FREQTRADE_WORKER_DIR = os.path.join(PROJECT_ROOT, "freqtrade_worker")
 STRATEGIES_DIR = os.path.join(FREQTRADE_WORKER_DIR, "user_data", "strategies")
 BACKTEST_RESULTS_DIR = os.path.join(FREQTRADE_WORKER_DIR, "user_data", "backtest_results")
+# 每次回测独立的工作目录（策略文件、结果导出、日志），用于支持并发回测
+BACKTEST_RUNS_DIR = os.path.join(FREQTRADE_WORKER_DIR, "user_data", "backtest_runs")
+CONFIG_PATH = os.path.join(FREQTRADE_WORKER_DIR, "user_data", "config.json")
+
+# 生成的策略代码约定的类名（见 prompts.py），每次回测会被重命名为唯一类名
+STRATEGY_CLASS_NAME = "AI_Strategy"
+# 保留的历史工作目录数量，超出后删除最旧的
+BACKTEST_RUNS_KEEP = int(os.getenv("BACKTEST_RUNS_KEEP", "200"))
 
 def ensure_directories():
     """确保必要的目录存在"""
     os.makedirs(STRATEGIES_DIR, exist_ok=True)
     os.makedirs(BACKTEST_RESULTS_DIR, exist_ok=True)
+    os.makedirs(BACKTEST_RUNS_DIR, exist_ok=True)
+
 
-def parse_backtest_stdout(stdout: str, strategy_name: str) -> Dict[str, Any]:
+@dataclass
+class BacktestWorkspace:
+    """单次回测的独立工作目录"""
+    run_id: str  # 回测运行 ID
+    run_dir: str  # 工作目录根路径
+    strategy_name: str  # 唯一的策略类名
+    strategy_path: str  # 策略文件路径
+    export_dir: str  # 回测结果导出目录
+    log_path: str  # freqtrade 日志文件路径
+
+
+def find_strategy_class_name(strategy_code: str) -> str:
     """
-    从 Freqtrade 回测的 stdout 输出中解析关键指标
-    
+    找出代码中继承 IStrategy 的策略类名
+
+    找不到时返回约定的 AI_Strategy
+    """
+    try:
+        tree = ast.parse(strategy_code)
+    except SyntaxError:
+        return STRATEGY_CLASS_NAME
+
+    for node in tree.body:
+        if not isinstance(node, ast.ClassDef):
+            continue
+        for base in node.bases:
+            base_name = base.id if isinstance(base, ast.Name) else getattr(base, "attr", None)
+            if base_name == "IStrategy":
+                return node.name
+    return STRATEGY_CLASS_NAME
+
+
+def rename_strategy_class(strategy_code: str, new_name: str) -> str:
+    """将策略类（及其在代码中的引用，如 super(AI_Strategy, self)）重命名为 new_name"""
+    old_name = find_strategy_class_name(strategy_code)
+    return re.sub(rf"\b{re.escape(old_name)}\b", new_name, strategy_code)
+
+
+def prune_backtest_workspaces(keep: int = BACKTEST_RUNS_KEEP):
+    """删除最旧的回测工作目录，只保留最近 keep 个（目录名以时间戳开头，可直接排序）"""
+    if keep <= 0 or not os.path.isdir(BACKTEST_RUNS_DIR):
+        return
+    run_dirs = sorted(
+        d for d in os.listdir(BACKTEST_RUNS_DIR)
+        if os.path.isdir(os.path.join(BACKTEST_RUNS_DIR, d))
+    )
+    for d in run_dirs[:-keep]:
+        shutil.rmtree(os.path.join(BACKTEST_RUNS_DIR, d), ignore_errors=True)
+
+
+def create_backtest_workspace(strategy_code: str) -> BacktestWorkspace:
+    """
+    为单次回测创建独立的工作目录
+
+    目录结构:
+        backtest_runs/<run_id>/
+            AI_Strategy_<id>.py   策略文件（类名被重命名为 AI_Strategy_<id>）
+            results/              回测结果导出目录
+            backtest.log          freqtrade 日志
+
     Args:
-        stdout: 回测命令的标准输出
-        strategy_name: 策略名称
-        
+        strategy_code: 策略的 Python 代码字符串
+
     Returns:
-        Dict: 包含解析出的指标
+        BacktestWorkspace: 工作目录信息
     """
-    import re
-    
-    metrics = {
-        "total_trades": 0,
-        "profit_total_abs": 0.0,
-        "profit_total_pct": 0.0,
-        "max_drawdown_pct": 0.0,
-        "sharpe": 0.0,
-        "sortino": 0.0,
-        "win_rate": 0.0
-    }
-    
-    # 解析 BACKTESTING REPORT 表格
-    # 示例行: |    TOTAL |    204 |     -0.25 | -153.672 |    -15.37 |  0:40:00 |        26 |
-    # 或者: | BTC/USDT |     98 |     -0.24 |  -71.127 |     -7.11 |  0:44:00 |        14 |
-    lines = stdout.split('\n')
-    
-    # 用于收集所有交易对的数据（以防TOTAL行缺失）
-    pair_trades = []
-    pair_profits_abs = []
-    pair_profits_pct = []
-    pair_wins = []
-    total_wins = 0
-    
-    for i, line in enumerate(lines):
-        # 查找 TOTAL 行（优先）
-        if '|' in line and 'TOTAL' in line.upper():
-            parts = [p.strip() for p in line.split('|') if p.strip()]
-            if len(parts) >= 4:
-                try:
-                    # parts[0] = 'TOTAL'
-                    # parts[1] = trades count
-                    # parts[2] = avg profit %
-                    # parts[3] = total profit (abs)
-                    # parts[4] = total profit %
-                    
-                    if len(parts) > 1:
-                        metrics["total_trades"] = int(parts[1])
-                    if len(parts) > 3:
-                        metrics["profit_total_abs"] = float(parts[3])
-                    if len(parts) > 4:
-                        metrics["profit_total_pct"] = float(parts[4])
-                    
-                    # 如果找到TOTAL行，尝试从后续行获取胜率
-                    for j in range(i+1, min(i+5, len(lines))):
-                        next_line = lines[j]
-                        # 查找胜率百分比（通常在TOTAL行后的几行）
-                        if '%' in next_line and any(char.isdigit() for char in next_line):
-                            match = re.search(r'(\d+\.?\d*)\s*%', next_line)
-                            if match:
-                                metrics["win_rate"] = float(match.group(1))
-                                break
-                except (ValueError, IndexError) as e:
-                    print(f"Warning: Failed to parse TOTAL line: {e}")
-        
-        # 解析单个交易对行（备选方案）
-        elif '|' in line and '/USDT' in line:
-            parts = [p.strip() for p in line.split('|') if p.strip()]
-            if len(parts) >= 5:
-                try:
-                    # parts[0] = pair name (e.g., BTC/USDT)
-                    # parts[1] = trades
-                    # parts[2] = avg profit %
-                    # parts[3] = total profit abs
-                    # parts[4] = total profit %
-                    
-                    trades = int(parts[1])
-                    profit_abs = float(parts[3])
-                    profit_pct = float(parts[4])
-                    
-                    pair_trades.append(trades)
-                    pair_profits_abs.append(profit_abs)
-                    pair_profits_pct.append(profit_pct)
-                    
-                    # 尝试从后续行获取该交易对的胜场数
-                    if i+2 < len(lines):
-                        # 胜率行通常在两行后
-                        win_line = lines[i+2]
-                        if '%' in win_line:
-                            match = re.search(r'(\d+\.?\d*)\s*%', win_line)
-                            if match:
-                                pair_wins.append(float(match.group(1)))
-                    
-                    # 尝试提取胜场数（在同一行或下一行）
-                    if len(parts) > 6:
-                        try:
-                            wins = int(parts[6])
-                            total_wins += wins
-                        except:
-                            pass
-                    
-                except (ValueError, IndexError) as e:
-                    print(f"Warning: Failed to parse pair line: {e}")
-        
-        # 查找其他指标 (Max Drawdown, Sharpe, Sortino 等)
-        # 示例: | Max Drawdown              |  154.45 USDT  |  15.45 %  | ... |
-        if 'Max Drawdown' in line or 'Max drawdown' in line or 'MAX DRAWDOWN' in line:
+    ensure_directories()
+    prune_backtest_workspaces()
+
+    suffix = uuid.uuid4().hex[:12]
+    run_id = f"{time.strftime('%Y%m%d_%H%M%S')}_{suffix}"
+    strategy_name = f"{STRATEGY_CLASS_NAME}_{suffix}"
+    run_dir = os.path.join(BACKTEST_RUNS_DIR, run_id)
+    export_dir = os.path.join(run_dir, "results")
+    # 导出目录必须预先存在，否则 freqtrade 会把它当作文件名前缀
+    os.makedirs(export_dir, exist_ok=True)
+
+    strategy_path = os.path.join(run_dir, f"{strategy_name}.py")
+    with open(strategy_path, "w", encoding="utf-8") as f:
+        f.write(rename_strategy_class(strategy_code, strategy_name))
+
+    return BacktestWorkspace(
+        run_id=run_id,
+        run_dir=run_dir,
+        strategy_name=strategy_name,
+        strategy_path=strategy_path,
+        export_dir=export_dir,
+        log_path=os.path.join(run_dir, "backtest.log")
+    )
+
+class BacktestCancelled(Exception):
+    """回测在运行过程中被取消"""
+
+
+# freqtrade 日志行格式: "2026-01-01 00:00:00,000 - freqtrade.optimize.backtesting - INFO - Loading data from ..."
+LOG_LINE_PATTERN = re.compile(
+    r"^\d{4}-\d{2}-\d{2} \d{2}:\d{2}:\d{2},\d+ - (?P<logger>\S+) - (?P<level>[A-Z]+) - (?P<message>.*)$"
+)
+
+# 根据 freqtrade 日志内容识别的回测阶段: (日志开头, 阶段, 说明)
+BACKTEST_PHASES = [
+    ("Loading data from", "loading_data", "正在加载K线数据"),
+    ("Dataload complete", "calculating_indicators", "数据加载完成，正在计算指标"),
+    ("Running backtesting for Strategy", "backtesting", "正在执行回测"),
+    ("Backtesting with data from", "reporting", "回测计算完成，正在生成结果"),
+    ("dumping json to", "saving_results", "正在保存回测结果"),
+]
+
+# 出现 Traceback 后等待链式异常输出完整的时间（秒），之后直接终止回测进程
+TRACEBACK_GRACE_SECONDS = 1.0
+
+
+class TracebackCollector:
+    """
+    从逐行输出中收集第一个 Python Traceback（包括紧随其后的链式异常）
+
+    Traceback 以不缩进的异常行（例如 "NameError: ..."）结束；
+    之后若出现 "During handling of the above exception..." 则继续收集下一个 Traceback。
+    """
+
+    START = "Traceback (most recent call last)"
+    CHAIN_MARKERS = ("During handling of the above exception", "The above exception was the direct cause")
+
+    def __init__(self):
+        self.lines: List[str] = []
+        self.in_traceback = False
+        self.finished_at: Optional[float] = None
+
+    @property
+    def text(self) -> str:
+        return "\n".join(self.lines).strip()
+
+    def feed(self, line: str):
+        if line.startswith(self.START):
+            self.in_traceback = True
+            self.finished_at = None
+            self.lines.append(line)
+        elif self.in_traceback:
+            self.lines.append(line)
+            if line and not line[0].isspace():
+                # 异常行，Traceback 结束
+                self.in_traceback = False
+                self.finished_at = time.monotonic()
+        elif self.finished_at is not None and line.startswith(self.CHAIN_MARKERS):
+            self.lines.extend(["", line, ""])
+            self.finished_at = time.monotonic()
+
+    def complete(self) -> bool:
+        """已收集到完整的 Traceback（且等待链式异常的时间已过）"""
+        return (self.finished_at is not None and not self.in_traceback
+                and time.monotonic() - self.finished_at >= TRACEBACK_GRACE_SECONDS)
+
+
+def extract_error_details(output: str) -> str:
+    """
+    从回测输出中提取错误详情
+
+    优先返回第一个 Python Traceback；没有 Traceback 时（例如 freqtrade 的 OperationalException
+    只记录一行日志）返回 ERROR 级别和策略导入失败的日志内容。
+    """
+    collector = TracebackCollector()
+    error_lines = []
+    for line in output.splitlines():
+        collector.feed(line)
+        match = LOG_LINE_PATTERN.match(line)
+        if match and (match.group("level") in ("ERROR", "CRITICAL") or "Could not import" in line):
+            error_lines.append(f"{match.group('level')} - {match.group('message')}")
+    if collector.lines:
+        return collector.text
+    return "\n".join(error_lines)
+
+
+class BacktestProgress:
+    """解析 freqtrade 的日志输出，将阶段变化和警告/错误转换为进度事件"""
+
+    def __init__(self, callback: Optional[Callable[[Dict[str, Any]], None]], run_id: Optional[str] = None):
+        self.callback = callback
+        self.run_id = run_id
+        self.phase: Optional[str] = None
+        self.start_time = time.monotonic()
+        # 各阶段首次出现的时间（相对于 start_time 的秒数），用于拆分数据加载和计算耗时
+        self.phase_times: Dict[str, float] = {}
+
+    def emit(self, phase: str, message: str, level: str = "INFO"):
+        if self.callback is None:
+            return
+        try:
+            self.callback({
+                "phase": phase,
+                "message": message,
+                "level": level,
+                "run_id": self.run_id,
+                "elapsed": round(time.monotonic() - self.start_time, 2)
+            })
+        except Exception as e:
+            # 进度回调出错（例如 WebSocket 已断开）不影响回测
+            print(f"Warning: 回测进度回调失败: {e}")
+
+    def feed(self, line: str):
+        match = LOG_LINE_PATTERN.match(line)
+        if not match:
+            return
+        level, message = match.group("level"), match.group("message")
+        for prefix, phase, description in BACKTEST_PHASES:
+            if message.startswith(prefix) and phase != self.phase:
+                self.phase = phase
+                self.phase_times.setdefault(phase, round(time.monotonic() - self.start_time, 3))
+                self.emit(phase, description)
+                return
+        if level in ("WARNING", "ERROR", "CRITICAL"):
+            self.emit(self.phase or "starting", message, level)
+
+
+def kill_process_group(process: subprocess.Popen):
+    """终止子进程及其创建的所有进程（例如 hyperopt -j 启动的 joblib 工作进程）"""
+    if os.name != 'nt':
+        try:
+            os.killpg(process.pid, signal.SIGKILL)
+            return
+        except OSError:
+            pass
+    process.kill()
+
+
+def run_backtest_process(cmd: list, timeout: float, cancel_event: Optional[threading.Event] = None,
+                         progress: Optional[BacktestProgress] = None, monitor: Optional[ResourceMonitor] = None):
+    """
+    运行回测子进程，逐行读取 stdout/stderr
+
+    等待期间响应取消请求；每行输出交给 progress 转换为进度事件；
+    输出中出现完整的 Python Traceback 时立即终止进程，不再等待其自行退出。
+
+    Args:
+        cmd: 命令行参数
+        timeout: 超时时间（秒）
+        cancel_event: 取消事件，被设置时终止子进程
+        progress: 进度事件解析器
+        monitor: 资源统计（可选），记录峰值内存和 CPU 时间，超过限制时终止子进程
+
+    Returns:
+        tuple: (returncode, stdout, stderr)
+
+    Raises:
+        subprocess.TimeoutExpired: 超时
+        BacktestCancelled: 被取消
+        ResourceLimitExceeded: 超过 monitor 的内存或 CPU 时间限制
+    """
+    process = subprocess.Popen(
+        cmd,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE,
+        text=True,
+        bufsize=1,
+        cwd=FREQTRADE_WORKER_DIR, # 在 worker 目录下运行
+        creationflags=0x00000200 if os.name == 'nt' else 0,  # Windows 下创建新进程组 (CREATE_NEW_PROCESS_GROUP)
+        start_new_session=os.name != 'nt'  # POSIX 下创建新进程组，终止时连同 hyperopt 的并行工作进程一起终止
+    )
+
+    # 每个输出流一个读取线程，按到达顺序放入同一个队列
+    lines: "queue.Queue" = queue.Queue()
+
+    def _read(stream, name):
+        for line in stream:
+            lines.put((name, line))
+        lines.put((name, None))
+
+    readers = [
+        threading.Thread(target=_read, args=(process.stdout, "stdout"), daemon=True),
+        threading.Thread(target=_read, args=(process.stderr, "stderr"), daemon=True)
+    ]
+    for reader in readers:
+        reader.start()
+    if monitor is not None:
+        monitor.attach(process.pid)
+
+    output = {"stdout": [], "stderr": []}
+    collector = TracebackCollector()
+    open_streams = len(readers)
+    deadline = time.monotonic() + timeout
+    while open_streams:
+        try:
+            name, line = lines.get(timeout=0.2)
+            if line is None:
+                open_streams -= 1
+            else:
+                output[name].append(line)
+                collector.feed(line.rstrip("\n"))
+                if progress is not None:
+                    progress.feed(line.rstrip("\n"))
+        except queue.Empty:
+            pass
+
+        if collector.complete():
+            print("检测到 Python 异常，提前终止回测进程")
+            if progress is not None:
+                progress.emit("error", "检测到 Python 异常，提前终止回测", "ERROR")
+            kill_process_group(process)
+            break
+
+        if monitor is not None:
             try:
-                # 提取百分比
-                match = re.search(r'(\d+\.?\d*)\s*%', line)
-                if match:
-                    metrics["max_drawdown_pct"] = float(match.group(1))
-            except Exception as e:
-                print(f"Warning: Failed to parse max drawdown: {e}")
-                
-        if 'Sharpe' in line:
+                monitor.check()
+            except ResourceLimitExceeded as e:
+                print(f"{e}，终止回测进程")
+                if progress is not None:
+                    progress.emit("error", str(e), "ERROR")
+                kill_process_group(process)
+                monitor.reap(process)
+                raise
+
+        cancelled = cancel_event is not None and cancel_event.is_set()
+        if cancelled or time.monotonic() >= deadline:
+            kill_process_group(process)
+            if monitor is not None:
+                monitor.reap(process)
+            else:
+                process.wait()
+            if cancelled:
+                raise BacktestCancelled()
+            raise subprocess.TimeoutExpired(cmd, timeout)
+
+    if monitor is not None:
+        monitor.reap(process)
+    else:
+        process.wait()
+    for reader in readers:
+        reader.join(timeout=1)
+    while True:
+        try:
+            name, line = lines.get_nowait()
+        except queue.Empty:
+            break
+        if line is not None:
+            output[name].append(line)
+    return process.returncode, "".join(output["stdout"]), "".join(output["stderr"])
+
+
+# 常驻 freqtrade 工作进程配置（见 warm_worker.py）
+# 启用后回测在预先导入 freqtrade 并缓存了 K 线数据的常驻进程中执行，不再为每次回测启动新进程
+WARM_WORKER_ENABLED = os.getenv("WARM_WORKER_ENABLED", "false").lower() == "true"
+WARM_WORKER_POOL_SIZE = int(os.getenv("WARM_WORKER_POOL_SIZE", "2"))
+# 工作进程处理多少个任务或常驻内存超过多少 MB 后自动重启
+WARM_WORKER_MAX_JOBS = int(os.getenv("WARM_WORKER_MAX_JOBS", "50"))
+WARM_WORKER_MAX_RSS_MB = float(os.getenv("WARM_WORKER_MAX_RSS_MB", "2048"))
+
+
+def warm_worker_usable() -> bool:
+    """
+    是否使用常驻工作进程执行回测
+
+    常驻工作进程中的回测不是独立进程，无法按回测统计和限制内存/CPU 时间，也不能逐行转发进度和提前终止出错的回测；
+    配置了单个回测的资源限制（BACKTEST_MAX_RSS_MB / BACKTEST_MAX_CPU_SECONDS）时改用独立进程，保证限制生效。
+    """
+    return WARM_WORKER_ENABLED and BACKTEST_MAX_RSS_MB <= 0 and BACKTEST_MAX_CPU_SECONDS <= 0
+
+
+class WarmWorkerError(Exception):
+    """常驻工作进程启动失败或意外退出"""
+
+
+class WarmWorker:
+    """单个常驻 freqtrade 工作进程（同一时间只执行一个回测）"""
+
+    def __init__(self):
+        self.process: Optional[subprocess.Popen] = None
+        self.conn = None
+
+    def is_alive(self) -> bool:
+        return self.process is not None and self.process.poll() is None and self.conn is not None
+
+    def start(self):
+        """启动工作进程并建立连接（等待工作进程导入 freqtrade 完成）"""
+        from multiprocessing.connection import Client
+
+        authkey = os.urandom(16)
+        env = dict(os.environ)
+        env["WARM_WORKER_AUTHKEY"] = authkey.hex()
+        env["PYTHONPATH"] = os.pathsep.join(filter(None, [PROJECT_ROOT, os.environ.get("PYTHONPATH")]))
+        self.process = subprocess.Popen(
+            [sys.executable, "-m", "backend.tools.warm_worker",
+             "--max-jobs", str(WARM_WORKER_MAX_JOBS), "--max-rss-mb", str(WARM_WORKER_MAX_RSS_MB)],
+            stdout=subprocess.PIPE,
+            text=True,
+            cwd=FREQTRADE_WORKER_DIR,
+            env=env,
+            creationflags=0x00000200 if os.name == 'nt' else 0
+        )
+        line = self.process.stdout.readline()
+        if not line.startswith("READY"):
+            self.stop()
+            raise WarmWorkerError(f"常驻工作进程启动失败: {line.strip() or '进程已退出'}")
+        self.conn = Client(("127.0.0.1", int(line.split()[1])), authkey=authkey)
+
+    def stop(self):
+        """关闭连接并终止工作进程"""
+        if self.conn is not None:
             try:
-                match = re.search(r'Sharpe[^\d]*?([-\d]+\.?\d*)', line)
-                if match:
-                    metrics["sharpe"] = float(match.group(1))
-            except Exception as e:
-                print(f"Warning: Failed to parse Sharpe: {e}")
-                
-        if 'Sortino' in line:
+                self.conn.close()
+            except OSError:
+                pass
+            self.conn = None
+        if self.process is not None:
+            if self.process.poll() is None:
+                self.process.kill()
+            self.process.wait()
+            self.process = None
+
+    def run(self, argv: list, timeout: float, cancel_event: Optional[threading.Event] = None):
+        """
+        在工作进程中执行回测
+
+        超时或被取消时直接终止工作进程（下次使用时重新启动）。
+
+        Returns:
+            tuple: (returncode, stdout, stderr)
+        """
+        if not self.is_alive():
+            self.start()
+
+        try:
+            self.conn.send({"argv": argv})
+            deadline = time.monotonic() + timeout
+            while not self.conn.poll(0.5):
+                if self.process.poll() is not None:
+                    raise WarmWorkerError(f"常驻工作进程意外退出 (返回码 {self.process.returncode})")
+                if cancel_event is not None and cancel_event.is_set():
+                    self.stop()
+                    raise BacktestCancelled()
+                if time.monotonic() >= deadline:
+                    self.stop()
+                    raise subprocess.TimeoutExpired(argv, timeout)
+            response = self.conn.recv()
+        except (EOFError, OSError) as e:
+            self.stop()
+            raise WarmWorkerError(f"与常驻工作进程通信失败: {e}")
+
+        if response.get("recycle"):
+            print(f"常驻工作进程已处理 {response['jobs_done']} 个任务（内存 {response['rss_mb']} MB），重启")
+            self.stop()
+        return response["returncode"], response["stdout"], response["stderr"]
+
+
+class WarmWorkerPool:
+    """常驻工作进程池，工作进程在首次使用时启动"""
+
+    def __init__(self, size: int = WARM_WORKER_POOL_SIZE):
+        self.size = size
+        # 后进先出：优先复用刚执行完回测的工作进程（数据缓存最热）
+        self._idle: "queue.LifoQueue[WarmWorker]" = queue.LifoQueue()
+        for _ in range(size):
+            self._idle.put(WarmWorker())
+
+    def run(self, argv: list, timeout: float, cancel_event: Optional[threading.Event] = None):
+        """取一个空闲的工作进程执行回测（全部忙碌时等待，等待期间响应取消请求）"""
+        while True:
             try:
-                match = re.search(r'Sortino[^\d]*?([-\d]+\.?\d*)', line)
-                if match:
-                    metrics["sortino"] = float(match.group(1))
-            except Exception as e:
-                print(f"Warning: Failed to parse Sortino: {e}")
-    
-    # 如果没有找到TOTAL行，从单个交易对数据汇总
-    if metrics["total_trades"] == 0 and pair_trades:
-        metrics["total_trades"] = sum(pair_trades)
-        metrics["profit_total_abs"] = sum(pair_profits_abs)
-        # 总盈利百分比需要根据总本金计算，这里简化为加总（不完全准确）
-        metrics["profit_total_pct"] = sum(pair_profits_pct)
-        
-        # 计算平均胜率
-        if pair_wins:
-            metrics["win_rate"] = sum(pair_wins) / len(pair_wins)
-    
-    return metrics
+                worker = self._idle.get(timeout=0.5)
+                break
+            except queue.Empty:
+                if cancel_event is not None and cancel_event.is_set():
+                    raise BacktestCancelled()
+        try:
+            return worker.run(argv, timeout, cancel_event)
+        finally:
+            self._idle.put(worker)
+
+    def shutdown(self):
+        """终止所有工作进程（等待正在执行的回测完成）"""
+        workers = [self._idle.get() for _ in range(self.size)]
+        for worker in workers:
+            worker.stop()
+            self._idle.put(worker)
+
 
-def run_freqtrade_backtest(strategy_code: str, timerange: str = "20230101-20231231", pair_list: list = None, timeframe: str = "5m") -> Dict[str, Any]:
+_warm_worker_pool: Optional[WarmWorkerPool] = None
+_warm_worker_pool_lock = threading.Lock()
+
+
+def get_warm_worker_pool() -> WarmWorkerPool:
+    """获取全局常驻工作进程池"""
+    global _warm_worker_pool
+    with _warm_worker_pool_lock:
+        if _warm_worker_pool is None:
+            _warm_worker_pool = WarmWorkerPool()
+        return _warm_worker_pool
+
+
+def run_freqtrade_backtest(strategy_code: str, timerange: str = "20230101-20231231", pair_list: list = None, timeframe: str = "5m",
+                           timeout: Optional[float] = None, cancel_event: Optional[threading.Event] = None,
+                           progress_callback: Optional[Callable[[Dict[str, Any]], None]] = None) -> Dict[str, Any]:
     """
     执行 Freqtrade 回测
     
@@ -173,34 +540,28 @@ def run_freqtrade_backtest(strategy_code: str, timerange: str = "20230101-202312
         timerange: 回测时间范围 (YYYYMMDD-YYYYMMDD)
         pair_list: 交易对列表 (可选，如果提供则只回测这些交易对)
         timeframe: 时间周期 (例如 "5m", "1h", "1d")
+        timeout: 超时时间（秒），默认根据K线数量和历史回测吞吐量计算（见 backtest_timeout.py）
+        cancel_event: 取消事件（由回测调度器传入），被设置时终止回测进程
+        progress_callback: 进度回调，回测过程中以 dict 形式接收阶段变化和警告/错误日志
         
     Returns:
-        Dict: 包含回测结果摘要和可能的错误信息
+        Dict: 包含回测结果摘要和可能的错误信息；独立进程回测时 resources 为资源统计
+              （峰值内存、CPU 时间、墙钟时间和数据加载/计算耗时，见 resource_limits.py），
+              超过内存或 CPU 时间限制时 error_type 为 "resource_error"，
+              回测正常结束但没有可读取的导出结果时为 "result_error"
     """
-    ensure_directories()
-    
-    # 1. 将策略代码写入文件
-    # 使用临时文件然后原子性重命名，避免文件监控冲突
-    strategy_filename = "AI_Strategy.py"
-    strategy_class_name = "AI_Strategy" # 假设生成的代码类名固定为 AI_Strategy
-    strategy_path = os.path.join(STRATEGIES_DIR, strategy_filename)
-    temp_path = os.path.join(STRATEGIES_DIR, f".{strategy_filename}.tmp")
+    config_path = CONFIG_PATH
     
+    # 如果没有 config.json，创建一个最小化的 dummy config (在实际生产中应该预先存在)
+    if not os.path.exists(config_path):
+        # 这里只是为了防止报错，实际上用户应该提供 config
+        return {"error": f"Config file not found at {config_path}"}
+
+    # 1. 为本次回测创建独立的工作目录，写入重命名后的策略文件
+    # 每次回测使用唯一的策略文件/类名/结果目录，多个会话可以并发回测而互不覆盖
     try:
-        # 先写入临时文件
-        with open(temp_path, "w", encoding="utf-8") as f:
-            f.write(strategy_code)
-        # 原子性重命名（Windows 上需要先删除目标文件）
-        if os.path.exists(strategy_path):
-            os.remove(strategy_path)
-        os.rename(temp_path, strategy_path)
+        workspace = create_backtest_workspace(strategy_code)
     except Exception as e:
-        # 清理临时文件
-        if os.path.exists(temp_path):
-            try:
-                os.remove(temp_path)
-            except:
-                pass
         return {"error": f"Failed to write strategy file: {str(e)}"}
 
     # 2. 构建 Freqtrade 命令
@@ -208,48 +569,67 @@ def run_freqtrade_backtest(strategy_code: str, timerange: str = "20230101-202312
     # 为了简化，这里假设是在同一环境下运行 'freqtrade' 命令
     # 如果是 Docker，命令需要调整
     
-    config_path = os.path.join(FREQTRADE_WORKER_DIR, "user_data", "config.json")
-    
-    # 如果没有 config.json，创建一个最小化的 dummy config (在实际生产中应该预先存在)
-    if not os.path.exists(config_path):
-        # 这里只是为了防止报错，实际上用户应该提供 config
-        return {"error": f"Config file not found at {config_path}"}
-
     cmd = [
         "freqtrade", "backtesting",
-        "--strategy", strategy_class_name,
+        "--strategy", workspace.strategy_name,
+        "--strategy-path", workspace.run_dir,
         "--config", config_path,
         "--timerange", timerange,
         "--timeframe", timeframe,
-        "--userdir", os.path.join(FREQTRADE_WORKER_DIR, "user_data")
+        "--userdir", os.path.join(FREQTRADE_WORKER_DIR, "user_data"),
+        "--backtest-directory", workspace.export_dir,
+        "--logfile", workspace.log_path,
+        "--data-format-ohlcv", CANDLE_DATA_FORMAT
         # 注意：移除了 --quiet 参数，因为某些版本的 freqtrade 不支持此参数
     ]
     
     # 如果指定了交易对列表，添加到命令中
+    # --pairs 接受多个值，重复传递该参数时只有最后一个生效
     if pair_list:
-        for pair in pair_list:
-            cmd.extend(["--pairs", pair])
+        cmd.extend(["--pairs", *pair_list])
+
+    progress = BacktestProgress(progress_callback, workspace.run_id)
+
+    # 超时预算：按交易对数 × K线根数和学习到的吞吐量计算，显式指定 timeout 时使用指定值
+    timeout_budget = compute_timeout_budget(pair_list, timeframe, timerange)
+    if timeout is not None:
+        timeout_budget.update({"timeout": timeout, "source": "fixed"})
+    timeout = timeout_budget["timeout"]
+    # 常驻工作进程中的回测不是独立进程，不统计和限制资源（工作进程按 WARM_WORKER_MAX_RSS_MB 自动重启），
+    # 因此只在没有配置单个回测的资源限制时使用（见 warm_worker_usable）
+    monitor = ResourceMonitor()
+    start_time = time.monotonic()
 
     try:
-        # 3. 执行命令
+        # 3. 执行命令（逐行读取输出并转发进度）
         print(f"Executing backtest command: {' '.join(cmd)}")
-        result = subprocess.run(
-            cmd, 
-            capture_output=True, 
-            text=True, 
-            cwd=FREQTRADE_WORKER_DIR, # 在 worker 目录下运行
-            timeout=120,  # 设置超时时间为2分钟
-            creationflags=0x00000200 if os.name == 'nt' else 0  # Windows 下创建新进程组 (CREATE_NEW_PROCESS_GROUP)
-        )
+        progress.emit("starting", "正在启动 freqtrade 回测")
+        warm_run = False
+        if warm_worker_usable():
+            try:
+                returncode, stdout, stderr = get_warm_worker_pool().run(cmd[1:], timeout, cancel_event)
+                warm_run = True
+            except WarmWorkerError as e:
+                print(f"Warning: {e}，改为启动独立的 freqtrade 进程")
+                returncode, stdout, stderr = run_backtest_process(cmd, timeout, cancel_event, progress, monitor)
+        else:
+            returncode, stdout, stderr = run_backtest_process(cmd, timeout, cancel_event, progress, monitor)
 
-        if result.returncode != 0:
-            error_msg = f"Backtest execution failed with return code {result.returncode}"
+        timeout_budget["elapsed"] = round(time.monotonic() - start_time, 2)
+        resources = monitor.to_dict(progress.phase_times) if monitor.pid is not None else None
+
+        if monitor.exceeded:
+            # 被内核的 CPU 时间限制（RLIMIT_CPU）终止
+            raise ResourceLimitExceeded(monitor.exceeded_message())
+
+        if returncode != 0:
+            error_msg = f"Backtest execution failed with return code {returncode}"
             print(f"ERROR: {error_msg}")
-            print(f"STDOUT: {result.stdout}")
-            print(f"STDERR: {result.stderr}")
+            print(f"STDOUT: {stdout}")
+            print(f"STDERR: {stderr}")
             
             # 判断是否为代码错误（通过检查 stderr 中是否包含 Python 异常）
-            stderr_lower = result.stderr.lower()
+            stderr_lower = stderr.lower()
             is_code_error = any(keyword in stderr_lower for keyword in [
                 'attributeerror', 'syntaxerror', 'importerror', 'nameerror',
                 'typeerror', 'valueerror', 'indentationerror', 'keyerror',
@@ -259,32 +639,80 @@ def run_freqtrade_backtest(strategy_code: str, timerange: str = "20230101-202312
             return {
                 "error": error_msg,
                 "error_type": "code_error" if is_code_error else "execution_error",
-                "stdout": result.stdout,
-                "stderr": result.stderr
+                "traceback": extract_error_details(stderr),
+                "stdout": stdout,
+                "stderr": stderr,
+                "run_id": workspace.run_id,
+                "log_path": workspace.log_path,
+                "resources": resources
             }
 
-        # 4. 解析结果
-        # 新版 Freqtrade 将结果保存在 .meta.json 和 .zip 文件中
-        # 我们直接从 stdout 解析表格数据，这样更可靠
-        
-        metrics = parse_backtest_stdout(result.stdout, strategy_class_name)
-        
-        # 查找结果文件路径（用于记录）
-        meta_files = [f for f in os.listdir(BACKTEST_RESULTS_DIR) if f.endswith(".meta.json")]
-        result_path = ""
-        if meta_files:
-            latest_meta = max([os.path.join(BACKTEST_RESULTS_DIR, f) for f in meta_files], key=os.path.getmtime)
-            result_path = latest_meta.replace(".meta.json", ".zip")
-        
-        metrics["full_result_path"] = result_path
+        # 4. 读取结果
+        # 直接读取本次回测导出目录中的 .meta.json / .zip 结果文件
+        # 没有导出结果（或结果文件无法读取）时返回 result_error: 不缓存、不记录吞吐量、不参与分片合并，
+        # 也不回退到模拟回测（freqtrade 已经真实运行，不能用随机指标代替）
+        backtest_result = None
+        load_error = f"{workspace.export_dir} 中没有导出的回测结果"
+        try:
+            backtest_result = BacktestResult.from_export_dir(workspace.export_dir, workspace.strategy_name)
+        except Exception as e:
+            load_error = str(e)
+
+        if backtest_result is None:
+            error_msg = f"回测结束但没有可读取的结果文件: {load_error}"
+            print(f"ERROR: {error_msg}")
+            return {
+                "error": error_msg,
+                "error_type": "result_error",
+                "stdout": stdout,
+                "stderr": stderr,
+                "run_id": workspace.run_id,
+                "log_path": workspace.log_path,
+                "resources": resources
+            }
+        metrics = backtest_result.detailed_metrics
+
+        # 用本次耗时更新每根K线的耗时估计
+        # 常驻工作进程省去了启动和导入 freqtrade 的开销，耗时与独立进程不可比，不计入吞吐量模型
+        # （超时预算按独立进程估计，对常驻工作进程偏宽松）
+        if not warm_run:
+            get_throughput_model().record(timeout_budget["candles"], timeout_budget["elapsed"])
         
-        return {"success": True, "metrics": metrics, "raw_output": result.stdout[:2000]}
+        return {
+            "success": True,
+            "metrics": metrics,
+            "raw_output": stdout[:2000],
+            "run_id": workspace.run_id,
+            "log_path": workspace.log_path,
+            "timeout_budget": timeout_budget,
+            "resources": resources
+        }
 
+    except BacktestCancelled:
+        return {
+            "error": "回测已取消",
+            "error_type": "cancelled",
+            "run_id": workspace.run_id,
+            "log_path": workspace.log_path
+        }
     except subprocess.TimeoutExpired:
         # 超时错误
         return {
-            "error": "回测执行超时（超过2分钟）",
-            "error_type": "timeout"
+            "error": f"回测执行超时（超过{timeout:.0f}秒，预计 {timeout_budget.get('expected_seconds', '?')} 秒）",
+            "error_type": "timeout",
+            "timeout_budget": timeout_budget,
+            "run_id": workspace.run_id,
+            "log_path": workspace.log_path,
+            "resources": monitor.to_dict(progress.phase_times) if monitor.pid is not None else None
+        }
+    except ResourceLimitExceeded as e:
+        # 超过内存或 CPU 时间限制（通常是策略构建了过大的 DataFrame 或内存泄漏）
+        return {
+            "error": str(e),
+            "error_type": "resource_error",
+            "run_id": workspace.run_id,
+            "log_path": workspace.log_path,
+            "resources": monitor.to_dict(progress.phase_times)
         }
     except Exception as e:
         # 其他异常
@@ -297,3 +725,114 @@ def run_freqtrade_backtest(strategy_code: str, timerange: str = "20230101-202312
             "error": f"Exception during backtest execution: {error_str}",
             "error_type": "code_error" if is_code_error else "execution_error"
         }
+
+
+# 交易对分片回测配置
+# 启用后交易对数量达到 BACKTEST_SHARD_MIN_PAIRS 时拆分为多个分片并行回测，再合并为组合指标。
+# 每个分片是独立的子账户（起始资金相加，max_open_trades 在每个分片内单独生效），
+# 合并结果与按配置的组合整体回测不同，因此默认关闭
+BACKTEST_SHARDING_ENABLED = os.getenv("BACKTEST_SHARDING_ENABLED", "false").lower() == "true"
+BACKTEST_SHARD_MIN_PAIRS = int(os.getenv("BACKTEST_SHARD_MIN_PAIRS", "4"))
+# 分片数量（留空则使用回测调度器的并发数量）
+BACKTEST_SHARDS = os.getenv("BACKTEST_SHARDS", "")
+
+
+def should_shard(pair_list: Optional[list]) -> bool:
+    """交易对数量是否达到分片回测的阈值"""
+    return BACKTEST_SHARDING_ENABLED and bool(pair_list) and len(pair_list) >= BACKTEST_SHARD_MIN_PAIRS
+
+
+def resolve_shards(shards: Optional[int] = None) -> int:
+    """分片数量: 指定值，其次 BACKTEST_SHARDS，都没有时为回测调度器的并发数量"""
+    if shards is not None:
+        return shards
+    if BACKTEST_SHARDS:
+        return int(BACKTEST_SHARDS)
+    from .backtest_scheduler import get_scheduler
+    return get_scheduler().max_workers
+
+
+def execution_mode(pair_list: Optional[list]) -> Dict[str, Any]:
+    """
+    真实回测的执行方式（是否按交易对分片及实际分片数量）
+
+    分片回测合并后的组合指标与单进程回测不同（见 merge_backtest_results），回测缓存键包含执行方式。
+    """
+    if not should_shard(pair_list):
+        return {"sharded": False, "shards": 1}
+    return {"sharded": True, "shards": len(split_pairs(pair_list, resolve_shards()))}
+
+
+def split_pairs(pair_list: list, shards: int) -> List[list]:
+    """将交易对轮流分配到各个分片，各分片的交易对数量最多相差 1"""
+    shards = max(1, min(shards, len(pair_list)))
+    return [pair_list[i::shards] for i in range(shards)]
+
+
+def run_sharded_backtest(strategy_code: str, timerange: str, pair_list: list, timeframe: str = "5m",
+                         shards: Optional[int] = None, priority: int = 0,
+                         progress_callback: Optional[Callable[[Dict[str, Any]], None]] = None,
+                         cancel_event: Optional[threading.Event] = None) -> Dict[str, Any]:
+    """
+    按交易对分片并行回测，并合并为组合级别的指标
+
+    每个分片作为独立任务提交到回测调度器（并发数量受调度器限制），每个分片是一个单独的 freqtrade 进程。
+    任一分片失败时取消其余分片并返回该分片的错误。
+    不能在调度器的任务函数中调用，否则会占用工作线程等待其他任务。
+
+    Args:
+        shards: 分片数量，默认使用 BACKTEST_SHARDS 或调度器的并发数量
+        priority: 分片任务在调度器中的优先级
+        progress_callback: 进度回调（每个分片的事件以各自的 run_id 区分）
+        cancel_event: 调用方的取消事件，被设置时取消所有分片
+
+    Returns:
+        Dict: 与 run_freqtrade_backtest 格式相同，metrics 为 merge_backtest_results 的合并指标，
+              shards 为每个分片的交易对、run_id 和调度信息
+    """
+    from .backtest_scheduler import get_scheduler
+
+    scheduler = get_scheduler()
+    shard_pairs = split_pairs(pair_list, resolve_shards(shards))
+    print(f"分片回测: {len(pair_list)} 个交易对拆分为 {len(shard_pairs)} 个分片")
+
+    start_time = time.time()
+    jobs = [
+        scheduler.submit(run_freqtrade_backtest, strategy_code, timerange, pairs, timeframe, priority=priority,
+                         progress_callback=progress_callback)
+        for pairs in shard_pairs
+    ]
+
+    shard_infos = []
+    shard_results = []
+    for job, pairs in zip(jobs, shard_pairs):
+        result = (scheduler.wait(job, cancel_event=cancel_event)
+                  or {"error": "分片回测没有返回结果", "error_type": "execution_error"})
+        shard_infos.append({"pairs": pairs, "run_id": result.get("run_id"), "scheduler": job.to_dict()})
+        if "error" in result:
+            for other in jobs:
+                scheduler.cancel(other.job_id)
+            result["shards"] = shard_infos
+            return result
+        shard_results.append(result)
+
+    try:
+        metrics = merge_backtest_results([
+            BacktestResult.from_file(result["metrics"]["full_result_path"]) for result in shard_results
+        ])
+    except Exception as e:
+        return {
+            "error": f"合并分片回测结果失败: {str(e)}",
+            "error_type": "result_error",
+            "shards": shard_infos
+        }
+
+    return {
+        "success": True,
+        "metrics": metrics,
+        "raw_output": "\n".join(result["raw_output"] for result in shard_results)[:2000],
+        "run_id": shard_results[0]["run_id"],
+        "log_path": shard_results[0]["log_path"],
+        "shards": shard_infos,
+        "elapsed": round(time.time() - start_time, 3)
+    }
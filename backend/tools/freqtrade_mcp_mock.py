@@ -1,50 +1,155 @@
 """
 Freqtrade 回测工具的模拟版本
-用于在没有安装 Freqtrade 或没有历史数据时进行开发和测试
+用于在没有安装 Freqtrade 或没有历史数据时进行开发和测试，以及不依赖 freqtrade 对 Agent 流程和 API 做压力测试
+
+模拟结果是确定性的：随机数种子由策略代码哈希（规范化 AST）、回测参数和 MOCK_SEED 计算，
+相同的策略和参数总是得到相同的指标、延迟和注入的错误。
 """
+import hashlib
+import os
 import random
+import threading
 import time
-from typing import Dict, Any
+from typing import Any, Callable, Dict, List, Optional
+
+# 是否强制使用模拟回测（用于压力测试，同时跳过预检和预筛选）
+MOCK_BACKTEST_ENABLED = os.getenv("MOCK_BACKTEST_ENABLED", "false").lower() == "true"
+# 随机数种子的基数，修改后所有策略得到另一组确定性的结果
+MOCK_SEED = os.getenv("MOCK_SEED", "0")
+# 模拟延迟: uniform（0.5~1.5 倍 MOCK_LATENCY_SECONDS）/ zero / fixed / replay（从回测历史中的真实耗时抽样）
+MOCK_LATENCY_MODE = os.getenv("MOCK_LATENCY_MODE", "uniform")
+MOCK_LATENCY_SECONDS = float(os.getenv("MOCK_LATENCY_SECONDS", "2"))
+# 注入代码错误和超时的比例（0-1）
+MOCK_CODE_ERROR_RATE = float(os.getenv("MOCK_CODE_ERROR_RATE", "0"))
+MOCK_TIMEOUT_RATE = float(os.getenv("MOCK_TIMEOUT_RATE", "0"))
+
+LATENCY_MODES = ("uniform", "zero", "fixed", "replay")
+# replay 模式从回测历史中读取的最近耗时样本数量
+REPLAY_SAMPLES = 500
+
+_replay_timings: Dict[str, List[float]] = {}
+_replay_lock = threading.Lock()
+
 
+def mock_seed(strategy_code: str, timerange: str, pair_list: Optional[list], timeframe: str) -> int:
+    """由策略代码哈希和回测参数计算模拟回测的随机数种子"""
+    from .backtest_history import hash_strategy_code, normalize_pairs
+    payload = "|".join([MOCK_SEED, hash_strategy_code(strategy_code), timerange or "",
+                        ",".join(normalize_pairs(pair_list)), timeframe])
+    return int(hashlib.sha256(payload.encode("utf-8")).hexdigest()[:16], 16)
+
+
+def _replay_samples(timeframe: str) -> List[float]:
+    """回测历史中真实回测的耗时（优先使用相同时间周期的记录），进程内只读取一次"""
+    with _replay_lock:
+        if timeframe in _replay_timings:
+            return _replay_timings[timeframe]
+        samples: List[float] = []
+        try:
+            from .backtest_history import get_backtest_history
+            history = get_backtest_history()
+            for filter_timeframe in (timeframe, None):
+                records = history.query(timeframe=filter_timeframe, status=None, limit=REPLAY_SAMPLES)
+                samples = [record["elapsed"] for record in records if record.get("elapsed")]
+                if samples:
+                    break
+        except Exception as e:
+            print(f"[MOCK MODE] 读取回测历史耗时失败: {e}")
+        _replay_timings[timeframe] = samples
+        return samples
+
+
+def mock_latency(rng: random.Random, timeframe: str = "5m", mode: str = MOCK_LATENCY_MODE,
+                 seconds: float = MOCK_LATENCY_SECONDS) -> float:
+    """
+    按延迟模式计算模拟回测的耗时（秒）
 
-def run_freqtrade_backtest_mock(strategy_code: str, timerange: str = "20230101-20231231", pair_list: list = None) -> Dict[str, Any]:
+    replay 模式没有历史记录时退化为 fixed。
     """
-    模拟 Freqtrade 回测（不实际执行，返回随机的回测结果）
+    if mode not in LATENCY_MODES:
+        raise ValueError(f"不支持的模拟延迟模式: {mode}，可选: {', '.join(LATENCY_MODES)}")
+    if mode == "zero":
+        return 0.0
+    if mode == "replay":
+        samples = _replay_samples(timeframe)
+        if samples:
+            return rng.choice(samples)
+        return seconds
+    if mode == "fixed":
+        return seconds
+    return rng.uniform(0.5 * seconds, 1.5 * seconds)
+
+
+def run_freqtrade_backtest_mock(strategy_code: str, timerange: str = "20230101-20231231", pair_list: list = None,
+                                timeframe: str = "5m") -> Dict[str, Any]:
+    """
+    模拟 Freqtrade 回测（不实际执行，返回由策略哈希确定的随机回测结果）
     
     用于：
     1. 测试系统整体流程
     2. 在没有安装 Freqtrade 时进行开发
     3. 快速验证 LLM 生成的代码语法
+    4. 可复现的基准测试和 API 压力测试（MOCK_LATENCY_MODE=zero 时不等待）
     
     Args:
         strategy_code: 策略的 Python 代码字符串
         timerange: 回测时间范围 (YYYYMMDD-YYYYMMDD)
         pair_list: 交易对列表 (可选)
+        timeframe: 时间周期
         
     Returns:
-        Dict: 包含模拟的回测结果
+        Dict: 包含模拟的回测结果；按 MOCK_CODE_ERROR_RATE / MOCK_TIMEOUT_RATE 注入 code_error 或 timeout 错误
     """
-    print(f"[MOCK MODE] 模拟回测: timerange={timerange}")
+    seed = mock_seed(strategy_code, timerange, pair_list, timeframe)
+    rng = random.Random(seed)
+    print(f"[MOCK MODE] 模拟回测: timerange={timerange}, seed={seed:016x}")
     print(f"[MOCK MODE] 策略代码长度: {len(strategy_code)} 字符")
     
-    # 模拟执行时间（1-3秒）
-    time.sleep(random.uniform(1, 3))
+    # 模拟执行时间
+    latency = mock_latency(rng, timeframe, MOCK_LATENCY_MODE, MOCK_LATENCY_SECONDS)
+    if latency > 0:
+        time.sleep(latency)
+    
+    # 按比例注入错误（与真实回测返回的错误结构一致）
+    fault = rng.random()
+    if fault < MOCK_CODE_ERROR_RATE:
+        print("[MOCK MODE] 注入代码错误")
+        return {
+            "error": "Backtest execution failed: NameError: name 'undefined_indicator' is not defined",
+            "error_type": "code_error",
+            "traceback": ('Traceback (most recent call last):\n'
+                          '  File "AI_Strategy.py", line 42, in populate_indicators\n'
+                          '    dataframe["signal"] = undefined_indicator(dataframe)\n'
+                          "NameError: name 'undefined_indicator' is not defined"),
+            "mock_mode": True,
+            "mock_seed": f"{seed:016x}",
+            "elapsed": round(latency, 3)
+        }
+    if fault < MOCK_CODE_ERROR_RATE + MOCK_TIMEOUT_RATE:
+        print("[MOCK MODE] 注入回测超时")
+        return {
+            "error": f"回测执行超时（模拟，耗时 {latency:.1f} 秒）",
+            "error_type": "timeout",
+            "mock_mode": True,
+            "mock_seed": f"{seed:016x}",
+            "elapsed": round(latency, 3)
+        }
     
     # 生成随机但合理的回测结果
-    total_trades = random.randint(10, 100)
-    win_trades = int(total_trades * random.uniform(0.3, 0.7))
+    total_trades = rng.randint(10, 100)
+    win_trades = int(total_trades * rng.uniform(0.3, 0.7))
     win_rate = win_trades / total_trades if total_trades > 0 else 0
     
     # 根据胜率生成合理的盈利
-    profit_pct = random.uniform(-20, 40) if win_rate < 0.5 else random.uniform(5, 60)
+    profit_pct = rng.uniform(-20, 40) if win_rate < 0.5 else rng.uniform(5, 60)
     
     summary = {
         "total_trades": total_trades,
         "profit_total_abs": round(profit_pct * 10, 2),  # 假设 1000 USD 本金
         "profit_total_pct": round(profit_pct, 2),
-        "max_drawdown_pct": round(random.uniform(5, 25), 2),
-        "sharpe": round(random.uniform(-0.5, 2.5), 2),
-        "sortino": round(random.uniform(-0.5, 3.0), 2),
+        "max_drawdown_pct": round(rng.uniform(5, 25), 2),
+        "sharpe": round(rng.uniform(-0.5, 2.5), 2),
+        "sortino": round(rng.uniform(-0.5, 3.0), 2),
         "win_rate": round(win_rate * 100, 2),
         "full_result_path": "[模拟模式 - 无实际结果文件]"
     }
@@ -55,37 +160,44 @@ def run_freqtrade_backtest_mock(strategy_code: str, timerange: str = "20230101-2
         "success": True,
         "metrics": summary,
         "raw_output": f"[MOCK MODE] 这是模拟的回测结果\n时间范围: {timerange}\n交易次数: {total_trades}\n盈利率: {profit_pct:.2f}%",
-        "mock_mode": True
+        "mock_mode": True,
+        "mock_seed": f"{seed:016x}",
+        "elapsed": round(latency, 3)
     }
 
 
 def check_freqtrade_available() -> bool:
     """
-    检查 Freqtrade 是否可用
+    检查 Freqtrade 是否可用（读取缓存的运行环境能力，过期后才重新运行 freqtrade --version）
     
     Returns:
         bool: True 如果 freqtrade 命令可用
     """
-    import subprocess
+    from .capabilities import get_capabilities
+    return get_capabilities().freqtrade_available()
+
+
+def _record_history(strategy_code: str, result: Dict[str, Any], pair_list: Optional[list], timeframe: str,
+                    timerange: str, elapsed: float):
+    """将真实回测（包括失败的回测）写入回测历史记录"""
+    from .backtest_history import BACKTEST_HISTORY_ENABLED, get_backtest_history
+    if not BACKTEST_HISTORY_ENABLED:
+        return
     try:
-        result = subprocess.run(
-            ["freqtrade", "--version"],
-            capture_output=True,
-            text=True,
-            timeout=5
+        result["history_id"] = get_backtest_history().record(
+            strategy_code, result, pair_list, timeframe, timerange, elapsed
         )
-        return result.returncode == 0
-    except (FileNotFoundError, subprocess.TimeoutExpired):
-        return False
-    except Exception:
-        return False
+    except Exception as e:
+        print(f"[WARNING] 写入回测历史失败: {e}")
 
 
-def run_freqtrade_backtest_auto(strategy_code: str, timerange: str = "20230101-20231231", pair_list: list = None, timeframe: str = "5m", force_mock: bool = False) -> Dict[str, Any]:
+def run_freqtrade_backtest_auto(strategy_code: str, timerange: str = "20230101-20231231", pair_list: list = None, timeframe: str = "5m", force_mock: bool = False,
+                                progress_callback: Optional[Callable[[Dict[str, Any]], None]] = None,
+                                cancel_event: Optional[threading.Event] = None) -> Dict[str, Any]:
     """
     自动选择真实回测或模拟回测
     
-    如果 Freqtrade 未安装或 force_mock=True，则使用模拟模式
+    如果 Freqtrade 未安装、force_mock=True 或 MOCK_BACKTEST_ENABLED=true，则使用模拟模式
     
     Args:
         strategy_code: 策略代码
@@ -93,40 +205,79 @@ def run_freqtrade_backtest_auto(strategy_code: str, timerange: str = "20230101-2
         pair_list: 交易对列表
         timeframe: 时间周期
         force_mock: 强制使用模拟模式
+        progress_callback: 真实回测的进度回调
+        cancel_event: 取消事件，被设置时取消排队中或运行中的真实回测（返回 error_type 为 cancelled 的错误）
         
     Returns:
         Dict: 回测结果
     """
-    if force_mock:
+    if force_mock or MOCK_BACKTEST_ENABLED:
         print("[INFO] 强制使用模拟模式")
-        return run_freqtrade_backtest_mock(strategy_code, timerange, pair_list)
+        return run_freqtrade_backtest_mock(strategy_code, timerange, pair_list, timeframe)
+    
+    # 先查询回测结果缓存，相同的策略、参数和执行方式直接返回缓存结果，不启动任何子进程
+    from .backtest_cache import BACKTEST_CACHE_ENABLED, get_backtest_cache
+    from .freqtrade_mcp import execution_mode, run_freqtrade_backtest, run_sharded_backtest, should_shard
+    cache_key = None
+    if BACKTEST_CACHE_ENABLED:
+        try:
+            cache = get_backtest_cache()
+            # 只有真实回测会写入缓存（模拟模式在上面已经返回）
+            execution = {"mock": False, **execution_mode(pair_list)}
+            cache_key = cache.make_key(strategy_code, pair_list, timeframe, timerange, execution=execution)
+            cached = cache.get(cache_key)
+            if cached is not None:
+                print(f"[INFO] 命中回测缓存: {cache_key[:12]}")
+                return cached
+        except Exception as e:
+            print(f"[WARNING] 回测缓存不可用: {e}")
+            cache_key = None
     
     if not check_freqtrade_available():
         print("[WARNING] Freqtrade 未安装或不可用，使用模拟模式")
         print("[INFO] 如需真实回测，请运行: setup_freqtrade.bat")
-        return run_freqtrade_backtest_mock(strategy_code, timerange, pair_list)
+        return run_freqtrade_backtest_mock(strategy_code, timerange, pair_list, timeframe)
     
-    # 尝试真实回测
-    from .freqtrade_mcp import run_freqtrade_backtest
-    result = run_freqtrade_backtest(strategy_code, timerange, pair_list, timeframe)
+    # 尝试真实回测（提交到回测调度器排队执行，限制同时运行的 freqtrade 进程数量）
+    # 交易对较多时按交易对分片并行回测，再合并为组合指标
+    from .backtest_scheduler import get_scheduler
+    start_time = time.time()
+    if should_shard(pair_list):
+        result = run_sharded_backtest(strategy_code, timerange, pair_list, timeframe,
+                                      progress_callback=progress_callback, cancel_event=cancel_event)
+    else:
+        result = get_scheduler().run(run_freqtrade_backtest, strategy_code, timerange, pair_list, timeframe,
+                                     cancel_event=cancel_event, progress_callback=progress_callback)
+    _record_history(strategy_code, result, pair_list, timeframe, timerange, time.time() - start_time)
     
     # 如果真实回测失败，根据错误类型决定处理方式
     if "error" in result:
         error_type = result.get("error_type", "execution_error")
         
-        # 如果是代码错误或超时，不返回模拟结果，直接返回错误信息
-        if error_type in ["code_error", "timeout"]:
+        # 如果是代码错误、超时、超出资源限制、被取消或回测已运行但结果无法读取，不返回模拟结果，直接返回错误信息
+        if error_type in ["code_error", "timeout", "resource_error", "cancelled", "result_error"]:
             print(f"[ERROR] 回测失败（{error_type}）: {result.get('error')}")
             if error_type == "code_error":
                 print("[INFO] 这是代码问题，错误信息将反馈给代码生成模型")
             elif error_type == "timeout":
                 print("[INFO] 回测超时，不返回模拟结果")
+            elif error_type == "resource_error":
+                print("[INFO] 回测超出内存或 CPU 时间限制，不返回模拟结果")
+            elif error_type == "result_error":
+                print("[INFO] 回测已运行但没有可读取的结果，不返回模拟结果")
             return result
         
         # 其他执行错误（如数据缺失等），回退到模拟模式
         print(f"[WARNING] 真实回测失败: {result.get('error')}")
         print("[INFO] 回退到模拟模式")
-        return run_freqtrade_backtest_mock(strategy_code, timerange, pair_list)
+        return run_freqtrade_backtest_mock(strategy_code, timerange, pair_list, timeframe)
+    
+    # 只缓存成功的真实回测结果
+    if cache_key is not None:
+        try:
+            get_backtest_cache().put(cache_key, result)
+        except Exception as e:
+            print(f"[WARNING] 写入回测缓存失败: {e}")
     
     return result
 
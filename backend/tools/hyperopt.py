@@ -0,0 +1,282 @@
+"""
+策略参数的超参数优化（freqtrade hyperopt）
+检测策略代码中声明的 IntParameter / DecimalParameter 等可优化参数，
+用 freqtrade hyperopt 并行（-j）搜索最优取值，再把最优值写回策略代码的 default 参数，
+用本地数值搜索代替一轮 LLM 调用 + 回测来调整阈值类参数。
+"""
+import ast
+import glob
+import json
+import os
+import subprocess
+import threading
+import time
+from typing import Any, Callable, Dict, List, Optional
+
+from .candle_store import CANDLE_DATA_FORMAT
+from .freqtrade_mcp import (CONFIG_PATH, FREQTRADE_WORKER_DIR, BacktestCancelled, BacktestProgress,
+                            create_backtest_workspace, extract_error_details, run_backtest_process)
+
+# 是否在评估不通过时先对策略参数进行超参数优化
+HYPEROPT_ENABLED = os.getenv("HYPEROPT_ENABLED", "false").lower() == "true"
+# 最大 epoch 数
+HYPEROPT_EPOCHS = int(os.getenv("HYPEROPT_EPOCHS", "100"))
+# 并行进程数（freqtrade 的 -j 参数，留空则使用 CPU 核心数）
+HYPEROPT_JOBS = os.getenv("HYPEROPT_JOBS", "")
+# 时间预算（秒），超时后使用已完成 epoch 中的最优结果
+HYPEROPT_TIMEOUT = float(os.getenv("HYPEROPT_TIMEOUT", "600"))
+# 损失函数和结果有效所需的最少交易次数
+HYPEROPT_LOSS = os.getenv("HYPEROPT_LOSS", "SharpeHyperOptLossDaily")
+HYPEROPT_MIN_TRADES = int(os.getenv("HYPEROPT_MIN_TRADES", "10"))
+
+HYPEROPT_RESULTS_DIR = os.path.join(FREQTRADE_WORKER_DIR, "user_data", "hyperopt_results")
+
+# freqtrade 的可优化参数类型
+PARAMETER_TYPES = {"IntParameter", "DecimalParameter", "RealParameter", "CategoricalParameter", "BooleanParameter"}
+# 未指定 space 时 freqtrade 根据参数名前缀推断所属空间
+PREFIX_SPACES = ("buy", "sell", "protection")
+
+# freqtrade 使用 user_data/hyperopt.lock 禁止同时运行多个 hyperopt（每个 hyperopt 已经占满所有核心），
+# 在进程内排队，避免后到的请求直接失败
+_hyperopt_lock = threading.Lock()
+
+
+def _call_name(node: ast.expr) -> Optional[str]:
+    if isinstance(node, ast.Name):
+        return node.id
+    if isinstance(node, ast.Attribute):
+        return node.attr
+    return None
+
+
+def _find_parameter_calls(strategy_code: str) -> List[tuple]:
+    """策略类中声明可优化参数的赋值语句: [(参数名, ast.Call)]"""
+    try:
+        tree = ast.parse(strategy_code)
+    except SyntaxError:
+        return []
+    calls = []
+    for node in tree.body:
+        if not isinstance(node, ast.ClassDef):
+            continue
+        for statement in node.body:
+            if not (isinstance(statement, ast.Assign) and len(statement.targets) == 1
+                    and isinstance(statement.targets[0], ast.Name) and isinstance(statement.value, ast.Call)):
+                continue
+            if _call_name(statement.value.func) in PARAMETER_TYPES:
+                calls.append((statement.targets[0].id, statement.value))
+    return calls
+
+
+def detect_hyperopt_parameters(strategy_code: str) -> List[Dict[str, Any]]:
+    """
+    检测策略代码中的可优化参数
+
+    Returns:
+        List[Dict]: 每个参数的 name、type、space、default（optimize=False 或无法确定空间的参数不包含在内）
+    """
+    parameters = []
+    for name, call in _find_parameter_calls(strategy_code):
+        keywords = {kw.arg: kw.value for kw in call.keywords if kw.arg}
+        optimize = keywords.get("optimize")
+        if isinstance(optimize, ast.Constant) and optimize.value is False:
+            continue
+
+        space = keywords.get("space")
+        if isinstance(space, ast.Constant) and isinstance(space.value, str):
+            space = space.value
+        else:
+            space = next((prefix for prefix in PREFIX_SPACES if name.startswith(f"{prefix}_")), None)
+        if space is None:
+            continue
+
+        try:
+            default = ast.literal_eval(keywords["default"]) if "default" in keywords else None
+        except (ValueError, TypeError, SyntaxError):
+            default = None
+        parameters.append({"name": name, "type": _call_name(call.func), "space": space, "default": default})
+    return parameters
+
+
+def apply_hyperopt_params(strategy_code: str, params: Dict[str, Any]) -> str:
+    """
+    把优化得到的参数值写回策略代码中对应参数声明的 default
+
+    只替换 default=... 的值，其余代码（包括格式和注释）保持不变；没有 default 关键字参数的声明会追加一个。
+    """
+    lines = strategy_code.splitlines(keepends=True)
+    # 行号、列号转换为字符偏移（ast 的 col_offset 按 UTF-8 字节计算）
+    line_starts = [0]
+    for line in lines:
+        line_starts.append(line_starts[-1] + len(line))
+
+    def offset(lineno: int, col_offset: int) -> int:
+        line = lines[lineno - 1]
+        return line_starts[lineno - 1] + len(line.encode("utf-8")[:col_offset].decode("utf-8"))
+
+    replacements = []
+    for name, call in _find_parameter_calls(strategy_code):
+        if name not in params:
+            continue
+        value = repr(params[name])
+        default = next((kw.value for kw in call.keywords if kw.arg == "default"), None)
+        if default is not None:
+            replacements.append((offset(default.lineno, default.col_offset),
+                                 offset(default.end_lineno, default.end_col_offset), value))
+        else:
+            # 在右括号前插入
+            end = offset(call.end_lineno, call.end_col_offset) - 1
+            replacements.append((end, end, f", default={value}"))
+
+    for start, end, value in sorted(replacements, reverse=True):
+        strategy_code = strategy_code[:start] + value + strategy_code[end:]
+    return strategy_code
+
+
+def _job_workers() -> int:
+    if HYPEROPT_JOBS:
+        return int(HYPEROPT_JOBS)
+    return os.cpu_count() or 1
+
+
+def _load_best_epoch(results_file: str, min_trades: int) -> tuple:
+    """
+    从 .fthypt 结果文件（每行一个 epoch）中找出损失最小且交易次数足够的 epoch
+
+    Returns:
+        tuple: (最优 epoch 或 None, 已完成的 epoch 数)
+    """
+    best = None
+    evaluated = 0
+    try:
+        with open(results_file, "r", encoding="utf-8") as f:
+            for line in f:
+                try:
+                    epoch = json.loads(line)
+                except ValueError:
+                    # 超时被终止时最后一行可能不完整
+                    continue
+                evaluated += 1
+                if epoch.get("results_metrics", {}).get("total_trades", 0) < min_trades:
+                    continue
+                if best is None or epoch["loss"] < best["loss"]:
+                    best = epoch
+    except OSError:
+        pass
+    return best, evaluated
+
+
+def _summarize_epoch(epoch: Dict[str, Any]) -> Dict[str, Any]:
+    metrics = epoch.get("results_metrics", {})
+    return {
+        "total_trades": metrics.get("total_trades", 0),
+        "profit_total_pct": round(metrics.get("profit_total", 0) * 100, 2),
+        "max_drawdown_pct": round(metrics.get("max_drawdown_account", 0) * 100, 2),
+        "sharpe": round(metrics.get("sharpe", 0), 2),
+        "win_rate": round(metrics.get("wins", 0) / metrics["total_trades"] * 100, 2) if metrics.get("total_trades") else 0.0,
+    }
+
+
+def run_hyperopt(strategy_code: str, timerange: str = "20230101-20231231", pair_list: Optional[list] = None,
+                 timeframe: str = "5m", epochs: int = HYPEROPT_EPOCHS, timeout: float = HYPEROPT_TIMEOUT,
+                 loss: str = HYPEROPT_LOSS, min_trades: int = HYPEROPT_MIN_TRADES,
+                 cancel_event: Optional[threading.Event] = None,
+                 progress_callback: Optional[Callable[[Dict[str, Any]], None]] = None) -> Dict[str, Any]:
+    """
+    对策略中的可优化参数执行 freqtrade hyperopt，并把最优参数写回代码
+
+    只优化策略中声明了参数的空间（buy/sell/protection 等），不优化 ROI、止损和追踪止损。
+    达到时间预算时终止 hyperopt，使用已完成 epoch 中的最优结果。
+
+    Returns:
+        Dict: 成功时 {"success": True, "params", "default_params", "code", "metrics", "epochs"（已完成的 epoch 数）, "best_epoch",
+              "loss", "timed_out", "elapsed", "run_id"}；失败时 {"error", "error_type", ...}
+    """
+    parameters = detect_hyperopt_parameters(strategy_code)
+    if not parameters:
+        return {"error": "策略代码中没有可优化的参数（IntParameter / DecimalParameter 等）", "error_type": "no_parameters"}
+    if not os.path.exists(CONFIG_PATH):
+        return {"error": f"Config file not found at {CONFIG_PATH}", "error_type": "execution_error"}
+
+    spaces = sorted({p["space"] for p in parameters})
+    workspace = create_backtest_workspace(strategy_code)
+    cmd = [
+        "freqtrade", "hyperopt",
+        "--strategy", workspace.strategy_name,
+        "--strategy-path", workspace.run_dir,
+        "--config", CONFIG_PATH,
+        "--timerange", timerange,
+        "--timeframe", timeframe,
+        "--userdir", os.path.join(FREQTRADE_WORKER_DIR, "user_data"),
+        "--logfile", workspace.log_path,
+        "--data-format-ohlcv", CANDLE_DATA_FORMAT,
+        "--hyperopt-loss", loss,
+        "--spaces", *spaces,
+        "--epochs", str(epochs),
+        "--job-workers", str(_job_workers()),
+        "--min-trades", str(min_trades),
+        # 最优参数写回策略代码，不导出到策略旁的 JSON 文件
+        "--disable-param-export",
+        "--no-color",
+    ]
+    if pair_list:
+        cmd.extend(["--pairs", *pair_list])
+
+    progress = BacktestProgress(progress_callback, workspace.run_id)
+    start_time = time.monotonic()
+    timed_out = False
+    with _hyperopt_lock:
+        print(f"Executing hyperopt command: {' '.join(cmd)}")
+        progress.emit("hyperopt", f"正在优化参数: {', '.join(p['name'] for p in parameters)}")
+        try:
+            returncode, stdout, stderr = run_backtest_process(cmd, timeout, cancel_event, progress)
+        except BacktestCancelled:
+            return {"error": "参数优化已取消", "error_type": "cancelled", "run_id": workspace.run_id}
+        except subprocess.TimeoutExpired:
+            timed_out = True
+            returncode, stderr = 0, ""
+
+        # 结果文件以唯一的策略类名命名，移动到本次运行的工作目录中
+        results_file = None
+        for path in glob.glob(os.path.join(HYPEROPT_RESULTS_DIR, f"strategy_{workspace.strategy_name}_*.fthypt")):
+            results_file = os.path.join(workspace.run_dir, os.path.basename(path))
+            os.replace(path, results_file)
+
+    elapsed = round(time.monotonic() - start_time, 2)
+    if returncode != 0:
+        return {
+            "error": f"Hyperopt execution failed with return code {returncode}",
+            "error_type": "execution_error",
+            "traceback": extract_error_details(stderr),
+            "run_id": workspace.run_id,
+            "log_path": workspace.log_path,
+            "elapsed": elapsed
+        }
+
+    best, evaluated = _load_best_epoch(results_file, min_trades) if results_file else (None, 0)
+    if best is None:
+        return {
+            "error": f"参数优化的 {evaluated} 个 epoch 中没有交易次数不少于 {min_trades} 的结果"
+                     + ("（已超时）" if timed_out else ""),
+            "error_type": "no_result",
+            "run_id": workspace.run_id,
+            "log_path": workspace.log_path,
+            "elapsed": elapsed
+        }
+
+    params = best["params_dict"]
+    return {
+        "success": True,
+        "params": params,
+        "default_params": {p["name"]: p["default"] for p in parameters},
+        "code": apply_hyperopt_params(strategy_code, params),
+        "metrics": _summarize_epoch(best),
+        "loss": best["loss"],
+        "best_epoch": best.get("current_epoch"),
+        "epochs": evaluated,
+        "timed_out": timed_out,
+        "elapsed": elapsed,
+        "run_id": workspace.run_id,
+        "log_path": workspace.log_path,
+        "results_path": results_file
+    }
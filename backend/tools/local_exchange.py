@@ -0,0 +1,122 @@
+"""
+本地替身交易所
+不访问网络、按与 freqtrade download-data 相同的方式写入 K 线文件，用于离线开发和测试下载管理器（见 download_manager.py）。
+通过 DOWNLOAD_FETCHER=local 启用。
+
+K 线由交易对、时间周期和 K 线开盘时间确定性地生成，与下载的时间范围无关：
+分多次下载、向前补齐（--prepend）或补齐内部缺口得到的数据与一次下载整个范围完全相同。
+LOCAL_EXCHANGE_START 之前没有数据（模拟交易对上线之前），用于验证空区间的记录。
+"""
+import hashlib
+import os
+import time
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+import pandas as pd
+
+from .candle_store import (CANDLE_DATA_FORMAT, DATA_DIR, candle_file_path, parse_timerange, read_candle_file,
+                           timeframe_to_seconds, write_candle_file)
+
+# 最早有数据的日期（YYYYMMDD）
+LOCAL_EXCHANGE_START = os.getenv("LOCAL_EXCHANGE_START", "20200101")
+# 每次下载模拟的网络延迟（秒）
+LOCAL_EXCHANGE_LATENCY = float(os.getenv("LOCAL_EXCHANGE_LATENCY", "0"))
+
+
+def _pair_seed(pair: str) -> int:
+    return int(hashlib.sha256(pair.encode("utf-8")).hexdigest()[:8], 16)
+
+
+def _noise(index: np.ndarray, seed: int) -> np.ndarray:
+    """由 K 线序号和种子确定的 [-0.5, 0.5) 伪随机数（整数哈希，不依赖生成顺序）"""
+    x = (index.astype(np.uint64) + np.uint64(seed)) * np.uint64(0x9E3779B97F4A7C15)
+    x ^= x >> np.uint64(29)
+    x *= np.uint64(0xBF58476D1CE4E5B9)
+    x ^= x >> np.uint64(32)
+    return (x >> np.uint64(11)).astype(np.float64) / float(1 << 53) - 0.5
+
+
+def generate_candles(pair: str, timeframe: str, start: int, end: int) -> pd.DataFrame:
+    """
+    生成 [start, end) 之间（Unix 秒）的 K 线
+
+    价格由几个不同周期的正弦波叠加确定性噪声构成，开盘价等于上一根 K 线的收盘价。
+    """
+    step = timeframe_to_seconds(timeframe)
+    listed = int(pd.Timestamp(LOCAL_EXCHANGE_START, tz="UTC").timestamp())
+    first = -(-max(start, listed) // step) * step
+    timestamps = np.arange(first, max(first, end), step, dtype=np.int64)
+
+    seed = _pair_seed(pair)
+    base = 10 + seed % 1000
+
+    def price(seconds: np.ndarray) -> np.ndarray:
+        days = seconds / 86400
+        wave = 0.3 * np.sin(days / 90 * 2 * np.pi + seed % 7) + 0.1 * np.sin(days / 7 * 2 * np.pi)
+        return base * np.exp(wave + 0.002 * _noise(seconds // 60, seed))
+
+    open_ = price(timestamps)
+    close = price(timestamps + step)
+    spread = np.abs(_noise(timestamps // 60, seed + 1)) * 0.004 + 0.0005
+    return pd.DataFrame({
+        "date": pd.to_datetime(timestamps, unit="s", utc=True),
+        "open": open_,
+        "high": np.maximum(open_, close) * (1 + spread),
+        "low": np.minimum(open_, close) * (1 - spread),
+        "close": close,
+        "volume": 1000 * (1.5 + _noise(timestamps // 60, seed + 2)),
+    })
+
+
+def fetch_candles(
+    pairs: List[str],
+    timeframe: str,
+    timerange: str = "20230101-20231231",
+    exchange: str = "okx",
+    prepend: bool = False,
+    datadir: Optional[str] = None
+) -> Dict[str, Any]:
+    """
+    与 data_downloader.download_market_data 参数和返回值相同的离线下载
+
+    与 freqtrade download-data 一致：已有数据文件时从最后一根 K 线开始追加到结束时间，
+    prepend 时从开始时间补充到第一根 K 线，没有数据文件时下载整个范围；结束时间不晚于当前时间。
+    """
+    if LOCAL_EXCHANGE_LATENCY > 0:
+        time.sleep(LOCAL_EXCHANGE_LATENCY)
+
+    step = timeframe_to_seconds(timeframe)
+    start_dt, end_dt = parse_timerange(timerange)
+    now = int(time.time()) // step * step
+    start = int(start_dt.timestamp()) if start_dt is not None else now - 30 * 86400
+    end = min(int(end_dt.timestamp()), now) if end_dt is not None else now
+
+    lines = []
+    for pair in pairs:
+        path = candle_file_path(pair, timeframe, exchange, CANDLE_DATA_FORMAT)
+        if datadir:
+            path = path.replace(os.path.join(DATA_DIR, exchange), datadir, 1)
+        existing = read_candle_file(path) if os.path.exists(path) else None
+
+        if existing is None or existing.empty:
+            df = generate_candles(pair, timeframe, start, end)
+        elif prepend:
+            first = int(existing["date"].iloc[0].timestamp())
+            new = generate_candles(pair, timeframe, start, first)
+            df = pd.concat([new, existing], ignore_index=True)
+        else:
+            last = int(existing["date"].iloc[-1].timestamp())
+            new = generate_candles(pair, timeframe, last, end)
+            df = pd.concat([existing.iloc[:-1], new], ignore_index=True) if not new.empty else existing
+
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        write_candle_file(df, path)
+        lines.append(f"{pair} {timeframe}: {len(df)} candles -> {path}")
+
+    return {
+        "success": True,
+        "message": f"数据下载成功（本地替身交易所）: {', '.join(pairs)} ({timeframe})",
+        "stdout": "\n".join(lines),
+        "stderr": ""
+    }
@@ -0,0 +1,271 @@
+"""
+策略预检（冒烟测试）
+在隔离的子进程中导入生成的策略，对少量缓存的 K 线运行 populate_* 方法并检查结果：
+- 存在 AI_Strategy 类（继承 IStrategy）且可以实例化
+- populate_* 不抛出异常，返回的 DataFrame 行数不变
+- 存在 enter_long / exit_long 列（use_exit_signal = False 时不要求 exit_long）
+- enter_long 信号不全为 NaN
+- 样本内没有任何开仓信号时给出警告（样本较短，不作为错误）
+
+LLM 生成代码的常见错误（AttributeError、缺少 talib 导入、列名错误等）在这里就能发现，
+不需要启动完整的 freqtrade 回测再从 stderr 中提取 Traceback。
+
+子进程用法（由 run_preflight 调用，从 stdin 读取 JSON 请求，向 stdout 输出 JSON 结果）:
+    python -m backend.tools.preflight
+"""
+import contextlib
+import json
+import linecache
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import traceback
+from io import StringIO
+from typing import Any, Dict, List, Optional
+
+CURRENT_DIR = os.path.dirname(os.path.abspath(__file__))
+PROJECT_ROOT = os.path.dirname(os.path.dirname(CURRENT_DIR))
+
+# 是否在完整回测前进行预检
+PREFLIGHT_ENABLED = os.getenv("PREFLIGHT_ENABLED", "true").lower() == "true"
+# 每个交易对用于预检的 K 线数量
+PREFLIGHT_CANDLES = int(os.getenv("PREFLIGHT_CANDLES", "300"))
+# 预检子进程的超时时间（秒）和常驻内存上限（MB，0 表示不限制）
+PREFLIGHT_TIMEOUT = float(os.getenv("PREFLIGHT_TIMEOUT", "30"))
+PREFLIGHT_MEMORY_MB = int(os.getenv("PREFLIGHT_MEMORY_MB", "2048"))
+
+STRATEGY_CLASS_NAME = "AI_Strategy"
+# 子进程结果行的前缀（策略代码中的 print 会被重定向到 stderr，这里只作为保险）
+RESULT_PREFIX = "PREFLIGHT_RESULT "
+
+
+def _failure(check: str, error: str, with_traceback: bool = False) -> Dict[str, Any]:
+    result = {"error": error, "error_type": "code_error", "check": check}
+    if with_traceback:
+        result["traceback"] = traceback.format_exc(limit=-5).strip()
+    return result
+
+
+def check_strategy(strategy_code: str, timeframe: str, candles: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    在当前进程中执行预检（只应在预检子进程中调用）
+
+    Args:
+        strategy_code: 策略代码
+        timeframe: 时间周期
+        candles: {交易对: OHLCV DataFrame}
+
+    Returns:
+        Dict: 通过时 {"success": True, "entries": {...}, "warnings": [...]}；
+              失败时 {"error": ..., "error_type": "code_error", "check": 失败的检查项, "traceback": ...}
+    """
+    import pandas as pd
+    from freqtrade.strategy import IStrategy
+
+    from .prescreen import compute_signals
+
+    # 注册源码，使 Traceback 中显示策略代码的具体行
+    linecache.cache["<strategy>"] = (len(strategy_code), None, strategy_code.splitlines(True), "<strategy>")
+    namespace: Dict[str, Any] = {"__name__": "preflight_strategy"}
+    try:
+        exec(compile(strategy_code, "<strategy>", "exec"), namespace)
+    except Exception as e:
+        return _failure("import", f"策略代码执行失败: {type(e).__name__}: {e}", with_traceback=True)
+
+    strategy_class = namespace.get(STRATEGY_CLASS_NAME)
+    if not (isinstance(strategy_class, type) and issubclass(strategy_class, IStrategy)):
+        found = [name for name, value in namespace.items()
+                 if isinstance(value, type) and issubclass(value, IStrategy) and value is not IStrategy]
+        hint = f"，找到的策略类: {', '.join(found)}" if found else ""
+        return _failure("strategy_class", f"没有找到继承 IStrategy 的 {STRATEGY_CLASS_NAME} 类{hint}")
+
+    try:
+        strategy = strategy_class({"timeframe": timeframe, "stake_currency": "USDT"})
+    except Exception as e:
+        return _failure("instantiate", f"策略类实例化失败: {type(e).__name__}: {e}", with_traceback=True)
+
+    use_exit_signal = getattr(strategy, "use_exit_signal", True)
+    entries = {}
+    enter_values = []
+    for pair, dataframe in candles.items():
+        rows = len(dataframe)
+        try:
+            dataframe = compute_signals(strategy, dataframe, pair)
+        except Exception as e:
+            return _failure("populate", f"{pair} 运行 populate 方法失败: {type(e).__name__}: {e}", with_traceback=True)
+
+        if not isinstance(dataframe, pd.DataFrame):
+            return _failure("populate", f"populate 方法应返回 DataFrame，实际返回 {type(dataframe).__name__}")
+        if len(dataframe) != rows:
+            return _failure("dataframe_length", f"populate 方法改变了 DataFrame 的行数（{rows} -> {len(dataframe)}），"
+                                                f"不要删除或追加行")
+
+        missing = [col for col in ("enter_long", "exit_long") if col not in dataframe.columns]
+        if not use_exit_signal and "exit_long" in missing:
+            missing.remove("exit_long")
+        if missing:
+            legacy = [col for col in ("buy", "sell") if col in dataframe.columns]
+            hint = f"（发现旧版列名 {legacy}，请改为 enter_long/exit_long）" if legacy else ""
+            return _failure("missing_columns", f"populate 方法没有生成信号列: {', '.join(missing)}{hint}")
+
+        enter_values.append(dataframe["enter_long"])
+        entries[pair] = int((dataframe["enter_long"] == 1).sum())
+
+    if all(values.isna().all() for values in enter_values):
+        return _failure("nan_signals", "enter_long 列全部为 NaN，开仓条件没有对任何一行赋值")
+
+    warnings = []
+    if not any(entries.values()):
+        warnings.append(f"预检的 {PREFLIGHT_CANDLES} 根K线中没有任何开仓信号，请确认开仓条件不会过于严格")
+    return {"success": True, "entries": entries, "warnings": warnings}
+
+
+def _limit_cpu():
+    """预检子进程的 CPU 时间限制（仅 POSIX）；内存由父进程采样常驻内存限制（见 resource_limits.py）"""
+    import resource
+    cpu = int(PREFLIGHT_TIMEOUT) + 1
+    resource.setrlimit(resource.RLIMIT_CPU, (cpu, cpu))
+
+
+def _write_request(stdin, request: str):
+    try:
+        stdin.write(request)
+        stdin.close()
+    except (BrokenPipeError, OSError, ValueError):
+        # 子进程已经退出，按返回码和输出处理
+        pass
+
+
+def _sandbox_env() -> Dict[str, str]:
+    """子进程只继承运行 Python 所需的环境变量（不传递 API 密钥等）"""
+    env = {key: os.environ[key] for key in ("PATH", "SYSTEMROOT", "LANG", "TZ") if key in os.environ}
+    env["PYTHONPATH"] = PROJECT_ROOT
+    env["PYTHONIOENCODING"] = "utf-8"
+    return env
+
+
+def run_preflight(strategy_code: str, pairs: List[str], timeframe: str = "5m",
+                  timerange: Optional[str] = None, exchange: str = "okx",
+                  candle_count: int = PREFLIGHT_CANDLES) -> Dict[str, Any]:
+    """
+    在隔离的子进程中对策略进行预检
+
+    Args:
+        strategy_code: 策略代码
+        pairs: 交易对列表
+        timeframe: 时间周期
+        timerange: 回测时间范围，取其开头的 candle_count 根 K 线
+        exchange: 交易所名称
+        candle_count: 每个交易对的 K 线数量
+
+    Returns:
+        Dict: 通过时 {"success": True, "entries": {...}, "warnings": [...], "elapsed": 秒}；
+              失败时 {"error": ..., "error_type": "code_error" | "preflight_unavailable", "check": ..., "traceback": ...}
+    """
+    from .candle_store import load_candles
+    from .capabilities import get_capabilities
+    from .resource_limits import ResourceLimitExceeded, ResourceMonitor
+
+    # 没有安装 freqtrade 时子进程必然无法导入策略，不再启动子进程
+    if not get_capabilities().freqtrade_available():
+        return {"error": "freqtrade 不可用，跳过预检", "error_type": "preflight_unavailable"}
+
+    start_time = time.perf_counter()
+    candles = {}
+    for pair in pairs:
+        df = load_candles(pair, timeframe, exchange, timerange)
+        if df is not None and not df.empty:
+            candles[pair] = df.head(candle_count).to_json(orient="split", date_format="iso")
+    if not candles:
+        return {"error": f"没有可用的K线数据: {pairs} ({timeframe})", "error_type": "preflight_unavailable"}
+
+    request = json.dumps({"code": strategy_code, "timeframe": timeframe, "candles": candles})
+    # 与回测进程相同，按常驻内存采样限制（RLIMIT_AS 限制虚拟地址空间，导入 NumPy/TA-Lib 后很容易超过）
+    monitor = ResourceMonitor(max_rss_mb=PREFLIGHT_MEMORY_MB, max_cpu_seconds=0)
+    sandbox_dir = tempfile.mkdtemp(prefix="preflight_")
+    try:
+        # 输出写入文件，等待期间不需要读取管道
+        with open(os.path.join(sandbox_dir, "stdout.log"), "w+", encoding="utf-8") as stdout, \
+                open(os.path.join(sandbox_dir, "stderr.log"), "w+", encoding="utf-8") as stderr:
+            process = subprocess.Popen(
+                [sys.executable, "-m", "backend.tools.preflight"],
+                stdin=subprocess.PIPE,
+                stdout=stdout,
+                stderr=stderr,
+                text=True,
+                encoding="utf-8",
+                cwd=sandbox_dir,
+                env=_sandbox_env(),
+                preexec_fn=_limit_cpu if os.name == "posix" else None
+            )
+            monitor.attach(process.pid)
+            threading.Thread(target=_write_request, args=(process.stdin, request), daemon=True).start()
+
+            deadline = time.monotonic() + PREFLIGHT_TIMEOUT
+            try:
+                while process.poll() is None:
+                    monitor.check()
+                    if time.monotonic() >= deadline:
+                        process.kill()
+                        monitor.reap(process)
+                        return {
+                            "error": f"预检超时（超过{PREFLIGHT_TIMEOUT:.0f}秒），populate 方法可能存在死循环或计算量过大",
+                            "error_type": "code_error",
+                            "check": "timeout"
+                        }
+                    time.sleep(0.05)
+            except ResourceLimitExceeded:
+                process.kill()
+                monitor.reap(process)
+                return {
+                    "error": f"预检进程内存占用 {monitor.peak_rss_mb:.0f} MB 超过限制 {PREFLIGHT_MEMORY_MB} MB，"
+                             f"populate 方法可能创建了过大的中间数据",
+                    "error_type": "code_error",
+                    "check": "memory"
+                }
+            monitor.reap(process)
+            stdout.seek(0)
+            stderr.seek(0)
+            output, errors = stdout.read(), stderr.read()
+    finally:
+        shutil.rmtree(sandbox_dir, ignore_errors=True)
+
+    result_lines = [line for line in output.splitlines() if line.startswith(RESULT_PREFIX)]
+    if not result_lines:
+        # 子进程异常退出（例如被 CPU 时间限制终止）
+        return {
+            "error": f"预检进程异常退出 (返回码 {process.returncode}): {errors.strip()[-500:]}",
+            "error_type": "preflight_unavailable"
+        }
+    result = json.loads(result_lines[-1][len(RESULT_PREFIX):])
+    result["elapsed"] = round(time.perf_counter() - start_time, 3)
+    return result
+
+
+def main():
+    request = json.loads(sys.stdin.read())
+
+    # 策略代码中的 print 输出到 stderr，stdout 只输出结果
+    with contextlib.redirect_stdout(sys.stderr):
+        try:
+            import pandas as pd
+            import freqtrade.strategy  # noqa: F401
+        except ImportError as e:
+            result = {"error": f"预检环境缺少依赖: {e}", "error_type": "preflight_unavailable"}
+        else:
+            candles = {}
+            for pair, data in request["candles"].items():
+                df = pd.read_json(StringIO(data), orient="split")
+                df["date"] = pd.to_datetime(df["date"], utc=True)
+                candles[pair] = df
+            result = check_strategy(request["code"], request["timeframe"], candles)
+
+    print(RESULT_PREFIX + json.dumps(result, ensure_ascii=False), flush=True)
+
+
+if __name__ == "__main__":
+    main()
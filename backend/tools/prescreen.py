@@ -0,0 +1,230 @@
+"""
+进程内向量化预筛选回测
+在当前进程中加载生成的 IStrategy 子类，对缓存的 K 线运行 populate_* 方法，
+再用 NumPy 对 enter_long/exit_long 信号做向量化的成交模拟。
+
+只用于快速淘汰明显无效的策略（例如一次都不开仓），有希望的策略再交给 freqtrade 完整回测。
+模拟做了以下简化：
+- 信号在下一根 K 线开盘价成交（与 freqtrade 一致）
+- 时间范围开始前的 startup_candle_count 根预热 K 线只用于计算指标，不开仓（与 freqtrade 一致）
+- 每个交易对同一时间最多一笔持仓，不限制 max_open_trades
+- 止损和 minimal_roi 中 "0" 对应的止盈按 K 线最高/最低价判断，在第一根触发的 K 线平仓，同一根 K 线两者都触发时按止损处理
+- 止损/止盈触发后到下一次出场信号之间不会重新开仓
+"""
+import os
+import time
+import types
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+import pandas as pd
+
+from .candle_store import load_pairs_candles, parse_timerange
+from .trade_metrics import compute_trade_metrics
+
+# 预筛选的最少交易次数，低于此值不再进行完整回测
+PRESCREEN_MIN_TRADES = int(os.getenv("PRESCREEN_MIN_TRADES", "1"))
+# 手续费比例（开仓和平仓各收取一次）
+PRESCREEN_FEE = float(os.getenv("PRESCREEN_FEE", "0.001"))
+# 默认本金与最大同时持仓数（与 freqtrade_worker/user_data/config.json 保持一致）
+STARTING_BALANCE = 1000.0
+MAX_OPEN_TRADES = 3
+
+
+class PrescreenUnavailable(Exception):
+    """当前环境无法进行预筛选（例如未安装 freqtrade 或没有 K 线数据）"""
+
+
+def load_strategy_class(strategy_code: str):
+    """
+    在当前进程中执行策略代码，返回其中继承 IStrategy 的策略类
+
+    Raises:
+        PrescreenUnavailable: 未安装 freqtrade
+        ValueError: 代码中没有 IStrategy 子类
+    """
+    try:
+        from freqtrade.strategy import IStrategy
+    except ImportError as e:
+        raise PrescreenUnavailable(f"freqtrade 未安装: {e}")
+
+    module = types.ModuleType("prescreen_strategy")
+    exec(compile(strategy_code, "<strategy>", "exec"), module.__dict__)
+    for value in module.__dict__.values():
+        if isinstance(value, type) and issubclass(value, IStrategy) and value is not IStrategy:
+            return value
+    raise ValueError("策略代码中没有找到继承 IStrategy 的类")
+
+
+def compute_signals(strategy, dataframe: pd.DataFrame, pair: str) -> pd.DataFrame:
+    """依次运行 populate_indicators / populate_entry_trend / populate_exit_trend"""
+    metadata = {"pair": pair}
+    dataframe = strategy.populate_indicators(dataframe, metadata)
+    dataframe = strategy.populate_entry_trend(dataframe, metadata)
+    dataframe = strategy.populate_exit_trend(dataframe, metadata)
+    return dataframe
+
+
+def simulate_trades(dataframe: pd.DataFrame, stoploss: float, take_profit: Optional[float],
+                    fee: float = PRESCREEN_FEE) -> pd.DataFrame:
+    """
+    根据 enter_long / exit_long 信号向量化模拟成交
+
+    Returns:
+        DataFrame: 每笔交易一行，包含 open_date, close_date, open_rate, close_rate, profit_ratio
+    """
+    n = len(dataframe)
+    empty = pd.DataFrame(columns=["open_date", "close_date", "open_rate", "close_rate", "profit_ratio"])
+    if n < 2:
+        return empty
+
+    enter = dataframe.get("enter_long", pd.Series(0, index=dataframe.index)).fillna(0).to_numpy() == 1
+    exit_ = dataframe.get("exit_long", pd.Series(0, index=dataframe.index)).fillna(0).to_numpy() == 1
+
+    # 信号状态：开仓信号 -> 1，出场信号 -> 0，其余沿用上一个状态
+    state = np.where(exit_, 0.0, np.where(enter, 1.0, np.nan))
+    state = pd.Series(state).ffill().fillna(0.0).to_numpy()
+    # 信号在下一根 K 线成交，所以第 i 根 K 线的持仓由第 i-1 根的信号决定
+    position = np.concatenate(([0.0], state[:-1]))
+
+    change = np.diff(np.concatenate(([0.0], position, [0.0])))
+    entry_idx = np.flatnonzero(change == 1)
+    exit_idx = np.flatnonzero(change == -1)  # 出场发生在该 K 线开盘（或数据末尾）
+    if len(entry_idx) == 0:
+        return empty
+
+    opens = dataframe["open"].to_numpy()
+    highs = dataframe["high"].to_numpy()
+    lows = dataframe["low"].to_numpy()
+    closes = dataframe["close"].to_numpy()
+    dates = dataframe["date"].to_numpy()
+
+    open_rate = opens[entry_idx]
+    at_end = exit_idx >= n
+    close_rate = np.where(at_end, closes[-1], opens[np.minimum(exit_idx, n - 1)])
+
+    close_idx = np.minimum(exit_idx, n - 1)
+
+    # 每根持仓 K 线所属的交易，以及每笔交易持仓区间 [entry, exit) 内第一根触发止损/止盈的 K 线
+    # 空仓的 K 线不算触发（用 n 屏蔽），这样以相邻 entry 为边界的 reduceat 只统计持仓区间
+    held = position == 1
+    trade_of_bar = np.maximum(np.cumsum(change[:-1] == 1) - 1, 0)
+    bars = np.arange(n)
+
+    def first_hit(hit: np.ndarray) -> np.ndarray:
+        return np.minimum.reduceat(np.where(held & hit, bars, n), entry_idx)
+
+    tp_bar = np.full(len(entry_idx), n)
+    sl_bar = np.full(len(entry_idx), n)
+    if take_profit is not None:
+        tp_price = open_rate * (1 + take_profit)
+        tp_bar = first_hit(highs >= tp_price[trade_of_bar])
+    if stoploss is not None:
+        sl_price = open_rate * (1 + stoploss)
+        sl_bar = first_hit(lows <= sl_price[trade_of_bar])
+
+    # 先触发的生效，同一根 K 线两者都触发时按止损处理
+    tp_hit = tp_bar < np.minimum(sl_bar, n)
+    sl_hit = (sl_bar < n) & (sl_bar <= tp_bar)
+    if take_profit is not None:
+        close_rate = np.where(tp_hit, tp_price, close_rate)
+    if stoploss is not None:
+        close_rate = np.where(sl_hit, sl_price, close_rate)
+    close_idx = np.where(tp_hit, tp_bar, np.where(sl_hit, sl_bar, close_idx))
+
+    profit_ratio = close_rate * (1 - fee) / (open_rate * (1 + fee)) - 1
+    return pd.DataFrame({
+        "open_date": dates[entry_idx],
+        "close_date": dates[close_idx],
+        "open_rate": open_rate,
+        "close_rate": close_rate,
+        "profit_ratio": profit_ratio,
+    })
+
+
+def compute_prescreen_metrics(trades: pd.DataFrame, starting_balance: float = STARTING_BALANCE,
+                              max_open_trades: int = MAX_OPEN_TRADES, backtest_start: Optional[Any] = None,
+                              backtest_end: Optional[Any] = None) -> Dict[str, Any]:
+    """
+    由模拟交易计算与完整回测相同字段的指标
+
+    每笔交易的下注金额为 starting_balance / max_open_trades，指标由 trade_metrics 按 freqtrade 的方法计算，
+    因此预筛选结果与完整回测的夏普比率、回撤等可以直接比较。
+    """
+    metrics = compute_trade_metrics(trades, starting_balance, backtest_start, backtest_end,
+                                    stake_amount=starting_balance / max_open_trades)
+    metrics["full_result_path"] = ""
+    return metrics
+
+
+def run_prescreen(strategy_code: str, pairs: List[str], timeframe: str = "5m",
+                  timerange: str = "20230101-20231231", exchange: str = "okx") -> Dict[str, Any]:
+    """
+    进程内预筛选回测
+
+    Args:
+        strategy_code: 策略的 Python 代码字符串
+        pairs: 交易对列表
+        timeframe: 时间周期
+        timerange: 回测时间范围
+        exchange: 交易所名称
+
+    Returns:
+        Dict: 成功时 {"success": True, "metrics": {...}, "prescreen": True, "trades_per_pair": {...}, "elapsed": 秒}；
+              失败时 {"error": ..., "error_type": "prescreen_unavailable" | "code_error"}
+    """
+    start_time = time.perf_counter()
+    try:
+        strategy_class = load_strategy_class(strategy_code)
+        strategy = strategy_class({"timeframe": timeframe, "stake_currency": "USDT"})
+    except PrescreenUnavailable as e:
+        return {"error": str(e), "error_type": "prescreen_unavailable"}
+    except Exception as e:
+        return {"error": f"{type(e).__name__}: {e}", "error_type": "code_error"}
+
+    candles = load_pairs_candles(pairs, timeframe, exchange, timerange,
+                                 startup_candles=getattr(strategy, "startup_candle_count", 0) or 0)
+    if not candles:
+        return {"error": f"没有可用的K线数据: {pairs} ({timeframe})", "error_type": "prescreen_unavailable"}
+
+    roi = getattr(strategy, "minimal_roi", None) or {}
+    take_profit = roi.get("0", roi.get(0))
+    stoploss = getattr(strategy, "stoploss", None)
+
+    # 与预检一致: use_exit_signal = False 时不要求 exit_long
+    required = ["enter_long", "exit_long"] if getattr(strategy, "use_exit_signal", True) else ["enter_long"]
+
+    all_trades = []
+    trades_per_pair = {}
+    try:
+        backtest_start, backtest_end = parse_timerange(timerange)
+        for pair, dataframe in candles.items():
+            dataframe = compute_signals(strategy, dataframe, pair)
+            missing = [col for col in required if col not in dataframe.columns]
+            if missing:
+                return {"error": f"{pair} populate 方法没有生成信号列: {', '.join(missing)}", "error_type": "code_error"}
+            # 与 freqtrade 一致: 时间范围开始前的预热 K 线只用于计算指标，不参与成交模拟
+            if backtest_start is not None:
+                dataframe = dataframe[dataframe["date"] >= backtest_start].reset_index(drop=True)
+            trades = simulate_trades(dataframe, stoploss, take_profit)
+            trades["pair"] = pair
+            trades_per_pair[pair] = int(len(trades))
+            all_trades.append(trades)
+
+        metrics = compute_prescreen_metrics(pd.concat(all_trades, ignore_index=True),
+                                            backtest_start=backtest_start, backtest_end=backtest_end)
+    except Exception as e:
+        return {"error": f"{type(e).__name__}: {e}", "error_type": "code_error"}
+    return {
+        "success": True,
+        "metrics": metrics,
+        "prescreen": True,
+        "trades_per_pair": trades_per_pair,
+        "elapsed": round(time.perf_counter() - start_time, 4)
+    }
+
+
+def is_promising(prescreen_result: Dict[str, Any]) -> bool:
+    """预筛选结果是否值得进行完整的 freqtrade 回测"""
+    metrics = prescreen_result.get("metrics", {})
+    return metrics.get("total_trades", 0) >= PRESCREEN_MIN_TRADES
@@ -0,0 +1,205 @@
+"""
+回测子进程的资源统计和限制
+回测期间在父进程中定期采样子进程（及其创建的所有进程）的常驻内存和 CPU 时间，
+超过 BACKTEST_MAX_RSS_MB / BACKTEST_MAX_CPU_SECONDS 时终止进程组，避免单个失控的策略耗尽整台机器的内存；
+进程退出后用 wait4 的 rusage 得到准确的峰值内存和 CPU 时间。
+
+Linux 下 CPU 时间还通过 prlimit 设置 RLIMIT_CPU 作为内核层面的兜底（采样间隔内的超限由内核终止）。
+内存只能靠采样限制：RLIMIT_AS 限制的是虚拟地址空间，NumPy/pandas 进程的虚拟内存远大于实际占用，无法作为 RSS 上限。
+"""
+import os
+import time
+from typing import Any, Dict, Optional
+
+# 单个回测进程树的常驻内存上限（MB，0 表示不限制）
+BACKTEST_MAX_RSS_MB = float(os.getenv("BACKTEST_MAX_RSS_MB", "2048"))
+# 单个回测进程树的 CPU 时间上限（秒，0 表示不限制；墙钟时间由回测超时限制）
+BACKTEST_MAX_CPU_SECONDS = float(os.getenv("BACKTEST_MAX_CPU_SECONDS", "0"))
+# 内存和 CPU 时间的采样间隔（秒）
+RESOURCE_SAMPLE_INTERVAL = float(os.getenv("RESOURCE_SAMPLE_INTERVAL", "0.5"))
+
+# 超过 RLIMIT_CPU 软限制后内核先发送 SIGXCPU，再过这么多秒到达硬限制时发送 SIGKILL
+CPU_HARD_LIMIT_GRACE = 5
+
+_PAGE_SIZE = os.sysconf("SC_PAGE_SIZE") if hasattr(os, "sysconf") else 4096
+_CLOCK_TICKS = os.sysconf("SC_CLK_TCK") if hasattr(os, "sysconf") else 100
+
+
+class ResourceLimitExceeded(Exception):
+    """回测进程超过了内存或 CPU 时间限制（进程已被终止）"""
+
+
+def _sample_psutil(pid: int) -> Optional[tuple]:
+    """用 psutil 采样进程树的 (常驻内存字节数, CPU 秒数)"""
+    import psutil
+
+    try:
+        root = psutil.Process(pid)
+        processes = [root, *root.children(recursive=True)]
+    except psutil.Error:
+        return None
+    rss = cpu = 0.0
+    for process in processes:
+        try:
+            rss += process.memory_info().rss
+            times = process.cpu_times()
+            # children_* 为已退出并被回收的子进程的 CPU 时间
+            cpu += times.user + times.system + times.children_user + times.children_system
+        except psutil.Error:
+            continue
+    return rss, cpu
+
+
+def _sample_proc(pid: int) -> Optional[tuple]:
+    """没有 psutil 时从 /proc/<pid>/stat 读取主进程的 (常驻内存字节数, CPU 秒数)（不含仍在运行的子进程）"""
+    try:
+        with open(f"/proc/{pid}/stat", "rb") as f:
+            stat = f.read().decode()
+    except OSError:
+        return None
+    # 进程名可能包含空格，从最后一个 ")" 之后开始按空格切分（第 3 个字段起）
+    fields = stat[stat.rindex(")") + 2:].split()
+    utime, stime, cutime, cstime = (int(value) for value in fields[11:15])
+    rss_pages = int(fields[21])
+    return rss_pages * _PAGE_SIZE, (utime + stime + cutime + cstime) / _CLOCK_TICKS
+
+
+def _sample(pid: int) -> Optional[tuple]:
+    try:
+        return _sample_psutil(pid)
+    except ImportError:
+        return _sample_proc(pid) if os.path.exists("/proc") else None
+
+
+class ResourceMonitor:
+    """
+    单个回测子进程的资源统计
+
+    用法: 启动进程后调用 attach()，等待期间定期调用 check()（超限时抛出 ResourceLimitExceeded），
+    进程退出时用 reap() 代替 process.wait()，最后 to_dict() 得到统计结果。
+    """
+
+    def __init__(self, max_rss_mb: float = BACKTEST_MAX_RSS_MB, max_cpu_seconds: float = BACKTEST_MAX_CPU_SECONDS,
+                 sample_interval: float = RESOURCE_SAMPLE_INTERVAL):
+        self.max_rss_mb = max_rss_mb
+        self.max_cpu_seconds = max_cpu_seconds
+        self.sample_interval = sample_interval
+        self.pid: Optional[int] = None
+        self.peak_rss_mb = 0.0
+        self.cpu_seconds = 0.0
+        self.samples = 0
+        self.exceeded: Optional[str] = None
+        self._start_time = time.monotonic()
+        self._end_time: Optional[float] = None
+        self._last_sample = 0.0
+
+    def attach(self, pid: int):
+        """开始统计指定进程，并设置内核层面的 CPU 时间限制"""
+        self.pid = pid
+        self._start_time = time.monotonic()
+        if self.max_cpu_seconds > 0:
+            try:
+                import resource
+
+                soft = max(1, int(self.max_cpu_seconds))
+                resource.prlimit(pid, resource.RLIMIT_CPU, (soft, soft + CPU_HARD_LIMIT_GRACE))
+            except (ImportError, AttributeError, OSError, ValueError):
+                # 非 Linux 平台没有 prlimit，只依靠采样限制
+                pass
+
+    def check(self):
+        """
+        按采样间隔采样一次资源占用，超过限制时抛出异常（由调用方终止进程）
+
+        Raises:
+            ResourceLimitExceeded: 常驻内存或 CPU 时间超过限制
+        """
+        now = time.monotonic()
+        if self.pid is None or now - self._last_sample < self.sample_interval:
+            return
+        self._last_sample = now
+        sample = _sample(self.pid)
+        if sample is None:
+            return
+        rss_bytes, cpu_seconds = sample
+        self.samples += 1
+        self.peak_rss_mb = max(self.peak_rss_mb, rss_bytes / (1024 * 1024))
+        self.cpu_seconds = max(self.cpu_seconds, cpu_seconds)
+
+        if self.max_rss_mb > 0 and self.peak_rss_mb > self.max_rss_mb:
+            self.exceeded = "rss"
+        elif self.max_cpu_seconds > 0 and self.cpu_seconds > self.max_cpu_seconds:
+            self.exceeded = "cpu"
+        if self.exceeded:
+            raise ResourceLimitExceeded(self.exceeded_message())
+
+    def reap(self, process) -> int:
+        """
+        等待进程退出并回收，记录 rusage 中的峰值内存和 CPU 时间（代替 process.wait()）
+
+        Returns:
+            int: 进程返回码
+        """
+        if process.returncode is None and hasattr(os, "wait4"):
+            try:
+                _, status, rusage = os.wait4(process.pid, 0)
+            except ChildProcessError:
+                # 已被其他地方回收
+                process.wait()
+            else:
+                process.returncode = os.waitstatus_to_exitcode(status)
+                # Linux 下 ru_maxrss 单位为 KB，是进程树中单个进程的峰值
+                self.peak_rss_mb = max(self.peak_rss_mb, rusage.ru_maxrss / 1024)
+                self.cpu_seconds = max(self.cpu_seconds, rusage.ru_utime + rusage.ru_stime)
+        else:
+            process.wait()
+        self._end_time = time.monotonic()
+
+        # 被内核 CPU 时间限制终止（SIGXCPU，或到达硬限制时的 SIGKILL）
+        if self.exceeded is None and self.max_cpu_seconds > 0 and self.cpu_seconds >= self.max_cpu_seconds:
+            self.exceeded = "cpu"
+        return process.returncode
+
+    def exceeded_message(self) -> Optional[str]:
+        """超限原因的说明（未超限时为 None）"""
+        if self.exceeded == "rss":
+            return f"回测进程内存占用 {self.peak_rss_mb:.0f} MB 超过限制 {self.max_rss_mb:.0f} MB"
+        if self.exceeded == "cpu":
+            return f"回测进程 CPU 时间 {self.cpu_seconds:.0f} 秒超过限制 {self.max_cpu_seconds:.0f} 秒"
+        return None
+
+    def to_dict(self, phase_times: Optional[Dict[str, float]] = None) -> Dict[str, Any]:
+        """
+        资源统计结果
+
+        Args:
+            phase_times: BacktestProgress 记录的各阶段开始时间（相对于回测开始的秒数），
+                         用于拆分启动、数据加载、计算（指标 + 回测循环）和导出结果的耗时
+        """
+        wall_seconds = (self._end_time or time.monotonic()) - self._start_time
+        usage: Dict[str, Any] = {
+            "peak_rss_mb": round(self.peak_rss_mb, 1),
+            "cpu_seconds": round(self.cpu_seconds, 2),
+            "wall_seconds": round(wall_seconds, 2),
+            "cpu_utilization": round(self.cpu_seconds / wall_seconds, 2) if wall_seconds > 0 else 0.0,
+            "startup_seconds": None,
+            "data_load_seconds": None,
+            "compute_seconds": None,
+            "report_seconds": None,
+            "limits": {"max_rss_mb": self.max_rss_mb, "max_cpu_seconds": self.max_cpu_seconds},
+            "exceeded": self.exceeded,
+        }
+        phase_times = phase_times or {}
+        loading = phase_times.get("loading_data")
+        calculating = phase_times.get("calculating_indicators")
+        saving = phase_times.get("saving_results")
+        if loading is not None:
+            usage["startup_seconds"] = round(loading, 2)
+        if loading is not None and calculating is not None:
+            usage["data_load_seconds"] = round(calculating - loading, 2)
+        if calculating is not None:
+            # 指标计算和回测循环，到开始导出结果为止
+            usage["compute_seconds"] = round((saving if saving is not None else wall_seconds) - calculating, 2)
+        if saving is not None:
+            usage["report_seconds"] = round(max(0.0, wall_seconds - saving), 2)
+        return usage
@@ -0,0 +1,302 @@
+"""
+基于交易明细的向量化指标计算
+输入为交易表（freqtrade 导出结果的 trades 或预筛选引擎模拟的交易），用 NumPy/pandas 一次性计算：
+资金曲线、最大回撤及持续时间、夏普/索提诺/卡玛比率、盈利因子、期望收益、持仓暴露度和按交易对的统计。
+
+夏普、索提诺、卡玛比率和最大回撤的计算方法与 freqtrade（freqtrade.data.metrics）一致，
+因此由交易明细计算的结果可以与 freqtrade 自身报告的指标直接比较。
+"""
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+import pandas as pd
+
+# 交易表需要的列（profit_abs 缺失时可由 profit_ratio 和每笔下注金额计算）
+REQUIRED_COLUMNS = ("close_date", "profit_ratio")
+
+
+def _pct(value: float) -> float:
+    """比例转换为百分比"""
+    return round(float(value) * 100, 2)
+
+
+def _annualized_ratio(expected_returns_mean: float, denominator: float) -> float:
+    # 与 freqtrade 一致：分母为 0 或 NaN 时返回 -100 表示不可取
+    if denominator and denominator == denominator:
+        return float(expected_returns_mean / denominator * np.sqrt(365))
+    return -100.0
+
+
+def prepare_trades(trades: pd.DataFrame, stake_amount: Optional[float] = None) -> pd.DataFrame:
+    """
+    规范化交易表：按平仓时间排序，时间列转换为 UTC，缺少 profit_abs 时按 profit_ratio × stake_amount 计算
+
+    Raises:
+        ValueError: 缺少必要的列
+    """
+    missing = [col for col in REQUIRED_COLUMNS if col not in trades.columns]
+    if missing:
+        raise ValueError(f"交易表缺少列: {', '.join(missing)}")
+    trades = trades.copy()
+    for col in ("open_date", "close_date"):
+        if col in trades.columns and not isinstance(trades[col].dtype, pd.DatetimeTZDtype):
+            trades[col] = pd.to_datetime(trades[col], utc=True)
+    if "profit_abs" not in trades.columns:
+        if stake_amount is None:
+            raise ValueError("交易表没有 profit_abs 列时需要指定 stake_amount")
+        trades["profit_abs"] = trades["profit_ratio"].astype(float) * stake_amount
+    return trades.sort_values("close_date", kind="stable").reset_index(drop=True)
+
+
+def equity_curve(trades: pd.DataFrame, starting_balance: float) -> pd.DataFrame:
+    """
+    按平仓时间累计的资金曲线
+
+    Args:
+        trades: prepare_trades 规范化后的交易表
+
+    Returns:
+        DataFrame: date, profit_abs, balance, high_value（此前的最高资金）, drawdown_abs, drawdown_pct（相对于最高资金）
+    """
+    profit_abs = trades["profit_abs"].to_numpy(dtype=float)
+    cumulative = np.cumsum(profit_abs)
+    # 与 freqtrade 一致：最高点至少为起始资金
+    high_value = np.maximum(0.0, np.maximum.accumulate(cumulative)) if len(cumulative) else cumulative
+    drawdown_abs = high_value - cumulative
+    denominator = starting_balance + high_value
+    drawdown_pct = np.divide(drawdown_abs, denominator, out=np.zeros_like(drawdown_abs), where=denominator > 0)
+    return pd.DataFrame({
+        "date": trades["close_date"].array,
+        "profit_abs": profit_abs,
+        "balance": starting_balance + cumulative,
+        "high_value": starting_balance + high_value,
+        "drawdown_abs": drawdown_abs,
+        "drawdown_pct": drawdown_pct * 100,
+    })
+
+
+def _datetime64(value: Any) -> np.datetime64:
+    """时间（字符串、Timestamp 或 datetime64）转换为 UTC 的 datetime64[ns]"""
+    timestamp = pd.Timestamp(value)
+    if timestamp.tzinfo is not None:
+        timestamp = timestamp.tz_convert("UTC").tz_localize(None)
+    return timestamp.to_datetime64().astype("datetime64[ns]")
+
+
+def _isoformat(value: np.datetime64) -> str:
+    return pd.Timestamp(value, tz="UTC").isoformat()
+
+
+def _max_streak(mask: np.ndarray) -> int:
+    """布尔数组中最长连续 True 的长度"""
+    if not mask.any():
+        return 0
+    padded = np.concatenate(([0], mask.astype(np.int8), [0]))
+    edges = np.flatnonzero(np.diff(padded))
+    return int((edges[1::2] - edges[::2]).max())
+
+
+def _drawdown_durations(dates: np.ndarray, drawdown_abs: np.ndarray, start: np.datetime64,
+                        end: np.datetime64) -> float:
+    """最长的水下持续时间（天）：从资金创新高到恢复该高点（或回测结束）的时间"""
+    # 在开头补一个资金为起始资金的点，时间为回测开始
+    dates = np.concatenate(([start], dates))
+    underwater = np.concatenate(([False], drawdown_abs > 0))
+    index = np.arange(len(dates))
+    # 每个点之前最近一次处于高点的位置
+    peak_index = np.maximum.accumulate(np.where(underwater, 0, index))
+    # 水下区间在下一个点（恢复或继续水下）或回测结束时计算持续时间
+    spans = [(dates[1:] - dates[peak_index[:-1]])[underwater[:-1]]]
+    if underwater[-1]:
+        spans.append(np.array([end - dates[peak_index[-1]]]))
+    spans = np.concatenate(spans)
+    if not len(spans):
+        return 0.0
+    return round(float(spans.max() / np.timedelta64(1, "s")) / 86400, 2)
+
+
+def _exposure(open_dates: np.ndarray, close_dates: np.ndarray, period_seconds: float) -> Dict[str, Any]:
+    """持仓暴露度：至少持有一笔仓位的时间占比、平均和最大同时持仓数"""
+    times = np.concatenate((open_dates, close_dates))
+    deltas = np.concatenate((np.ones(len(open_dates), dtype=np.int64), -np.ones(len(close_dates), dtype=np.int64)))
+    # 同一时刻先平仓再开仓
+    order = np.lexsort((deltas, times))
+    times, counts = times[order], np.cumsum(deltas[order])
+    durations = np.diff(times) / np.timedelta64(1, "s")
+    open_counts = counts[:-1]
+    exposed = float(durations[open_counts > 0].sum())
+    return {
+        "exposure_pct": _pct(exposed / period_seconds) if period_seconds > 0 else 0.0,
+        "avg_open_trades": round(float((durations * open_counts).sum() / period_seconds), 2) if period_seconds > 0 else 0.0,
+        "max_open_trades": int(counts.max()) if len(counts) else 0,
+    }
+
+
+def per_pair_breakdown(trades: pd.DataFrame, starting_balance: float) -> List[Dict[str, Any]]:
+    """
+    按交易对统计（按盈利从高到低排序）
+
+    Args:
+        trades: prepare_trades 规范化后的交易表（需要 pair 列）
+    """
+    if "pair" not in trades.columns or trades.empty:
+        return []
+    profit_abs = trades["profit_abs"].astype(float)
+    frame = pd.DataFrame({
+        "pair": trades["pair"],
+        "profit_abs": profit_abs,
+        "profit_ratio": trades["profit_ratio"].astype(float),
+        "win": profit_abs > 0,
+        "loss": profit_abs < 0,
+        "gross_profit": profit_abs.clip(lower=0),
+        "gross_loss": -profit_abs.clip(upper=0),
+    })
+    grouped = frame.groupby("pair", sort=False).agg(
+        trades=("profit_abs", "size"),
+        profit_total_abs=("profit_abs", "sum"),
+        profit_mean=("profit_ratio", "mean"),
+        wins=("win", "sum"),
+        losses=("loss", "sum"),
+        gross_profit=("gross_profit", "sum"),
+        gross_loss=("gross_loss", "sum"),
+    ).sort_values("profit_total_abs", ascending=False)
+
+    rows = []
+    for pair, row in zip(grouped.index, grouped.itertuples(index=False)):
+        rows.append({
+            "pair": pair,
+            "trades": int(row.trades),
+            "profit_total_abs": round(float(row.profit_total_abs), 3),
+            "profit_total_pct": _pct(row.profit_total_abs / starting_balance) if starting_balance else 0.0,
+            "profit_mean_pct": _pct(row.profit_mean),
+            "wins": int(row.wins),
+            "draws": int(row.trades - row.wins - row.losses),
+            "losses": int(row.losses),
+            "win_rate": _pct(row.wins / row.trades),
+            "profit_factor": round(float(row.gross_profit / row.gross_loss), 3) if row.gross_loss else 0.0,
+        })
+    return rows
+
+
+def compute_trade_metrics(trades: pd.DataFrame, starting_balance: float,
+                          backtest_start: Optional[Any] = None, backtest_end: Optional[Any] = None,
+                          stake_amount: Optional[float] = None) -> Dict[str, Any]:
+    """
+    由交易明细计算汇总指标
+
+    Args:
+        trades: 交易表，需要 close_date、profit_ratio 列，可选 profit_abs、open_date、pair
+        starting_balance: 起始资金
+        backtest_start: 回测开始时间（默认第一笔交易的开仓时间）
+        backtest_end: 回测结束时间（默认最后一笔交易的平仓时间）
+        stake_amount: 每笔交易的下注金额（交易表没有 profit_abs 列时使用）
+
+    Returns:
+        Dict: 与 BacktestResult.metrics 字段兼容的指标（百分比字段以 % 为单位），
+              另外包含 max_drawdown_duration_days、exposure_pct、avg_open_trades、max_open_trades 等
+    """
+    trades = prepare_trades(trades, stake_amount)
+    total_trades = len(trades)
+    profit_abs = trades["profit_abs"].to_numpy(dtype=float)
+    profit_ratio = trades["profit_ratio"].to_numpy(dtype=float)
+    close_dates = trades["close_date"].to_numpy(dtype="datetime64[ns]")
+    open_dates = (trades["open_date"].to_numpy(dtype="datetime64[ns]")
+                  if "open_date" in trades.columns else close_dates)
+
+    start = _datetime64(backtest_start) if backtest_start is not None else (open_dates.min() if total_trades else None)
+    end = _datetime64(backtest_end) if backtest_end is not None else (close_dates.max() if total_trades else None)
+    period_seconds = float((end - start) / np.timedelta64(1, "s")) if start is not None else 0.0
+    days = max(1, int(period_seconds // 86400))
+
+    profit_total_abs = float(profit_abs.sum())
+    wins_mask, losses_mask = profit_abs > 0, profit_abs < 0
+    wins, losses = int(wins_mask.sum()), int(losses_mask.sum())
+    gross_profit = float(profit_abs[wins_mask].sum())
+    gross_loss = float(-profit_abs[losses_mask].sum())
+    final_balance = starting_balance + profit_total_abs
+
+    metrics: Dict[str, Any] = {
+        "total_trades": total_trades,
+        "profit_total_abs": round(profit_total_abs, 3),
+        "profit_total_pct": _pct(profit_total_abs / starting_balance) if starting_balance else 0.0,
+        "max_drawdown_pct": 0.0,
+        "sharpe": 0.0,
+        "sortino": 0.0,
+        "win_rate": _pct(wins / total_trades) if total_trades else 0.0,
+        "calmar": 0.0,
+        "cagr_pct": 0.0,
+        "profit_factor": round(gross_profit / gross_loss, 3) if gross_loss else 0.0,
+        "expectancy": 0.0,
+        "expectancy_ratio": 0.0,
+        "profit_mean_pct": _pct(profit_ratio.mean()) if total_trades else 0.0,
+        "profit_median_pct": _pct(np.median(profit_ratio)) if total_trades else 0.0,
+        "wins": wins,
+        "losses": losses,
+        "draws": total_trades - wins - losses,
+        "trades_per_day": round(total_trades / days, 2),
+        "holding_avg_hours": round(float((close_dates - open_dates).mean() / np.timedelta64(1, "h")), 2)
+        if total_trades else 0.0,
+        "starting_balance": starting_balance,
+        "final_balance": round(final_balance, 3),
+        "max_drawdown_abs": 0.0,
+        "max_drawdown_duration_days": 0.0,
+        "max_drawdown_start": None,
+        "max_drawdown_end": None,
+        "exposure_pct": 0.0,
+        "avg_open_trades": 0.0,
+        "max_open_trades": 0,
+        "max_consecutive_wins": _max_streak(wins_mask),
+        "max_consecutive_losses": _max_streak(losses_mask),
+        "best_pair": None,
+        "worst_pair": None,
+        "backtest_start": _isoformat(start) if start is not None else None,
+        "backtest_end": _isoformat(end) if end is not None else None,
+        "results_per_pair": [],
+    }
+    if not total_trades:
+        return metrics
+
+    # 期望收益（与 freqtrade 的 calculate_expectancy 相同）
+    average_win = gross_profit / wins if wins else 0.0
+    average_loss = gross_loss / losses if losses else 0.0
+    metrics["expectancy"] = round((wins * average_win - losses * average_loss) / total_trades, 3)
+    metrics["expectancy_ratio"] = round((1 + average_win / average_loss) * wins / total_trades - 1, 3) \
+        if average_loss else 100.0
+
+    # 资金曲线和最大回撤（按绝对回撤最大的位置，相对回撤相对于当时的最高资金）
+    curve = equity_curve(trades, starting_balance)
+    drawdown_abs = curve["drawdown_abs"].to_numpy()
+    low_index = int(np.argmax(drawdown_abs))
+    max_drawdown_abs = float(drawdown_abs[low_index])
+    if max_drawdown_abs > 0:
+        balance = curve["balance"].to_numpy()
+        high_index = int(np.argmax(balance[:low_index + 1]))
+        # 此前从未超过起始资金时，回撤从回测开始计算
+        high_date = close_dates[high_index] if balance[high_index] > starting_balance else start
+        metrics.update({
+            "max_drawdown_abs": round(max_drawdown_abs, 3),
+            "max_drawdown_pct": round(float(curve["drawdown_pct"].iat[low_index]), 2),
+            "max_drawdown_start": _isoformat(high_date),
+            "max_drawdown_end": _isoformat(close_dates[low_index]),
+        })
+    metrics["max_drawdown_duration_days"] = _drawdown_durations(close_dates, drawdown_abs, start, end)
+    metrics.update(_exposure(open_dates, close_dates, period_seconds))
+
+    # 夏普 / 索提诺 / 卡玛比率和年化收益率（与 freqtrade 的计算方法相同）
+    if starting_balance:
+        returns = profit_abs / starting_balance
+        expected_returns_mean = returns.sum() / days
+        metrics["sharpe"] = round(_annualized_ratio(expected_returns_mean, float(np.std(returns))), 2)
+        metrics["sortino"] = round(_annualized_ratio(
+            expected_returns_mean, float(np.std(returns[losses_mask])) if losses else 0.0), 2)
+        relative_drawdown = metrics["max_drawdown_pct"] / 100
+        metrics["calmar"] = round(_annualized_ratio(expected_returns_mean * 100, relative_drawdown), 2)
+        if final_balance > 0:
+            metrics["cagr_pct"] = _pct((final_balance / starting_balance) ** (1 / (days / 365)) - 1)
+
+    per_pair = per_pair_breakdown(trades, starting_balance)
+    metrics["results_per_pair"] = per_pair
+    if per_pair:
+        metrics["best_pair"] = per_pair[0]["pair"]
+        metrics["worst_pair"] = per_pair[-1]["pair"]
+    return metrics
@@ -0,0 +1,198 @@
+"""
+滚动窗口（walk-forward）样本外评估
+将回测时间范围切分为若干个不重叠的窗口，每个窗口再分为样本内（train）和样本外（test）两段，
+所有窗口的样本外回测并发提交到回测调度器执行，汇总每个窗口的指标并计算稳定性评分。
+样本内部分默认不回测（策略没有按窗口重新优化参数，样本内结果不参与评分），
+WALK_FORWARD_TRAIN_BACKTEST=true 时同时回测样本内部分并计算 walk-forward efficiency。
+"""
+import math
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import datetime, timedelta
+from typing import Any, Callable, Dict, List, Optional
+
+from .candle_store import parse_timerange
+from .freqtrade_mcp_mock import run_freqtrade_backtest_auto
+
+# 是否以滚动窗口评估代替单次全区间回测
+WALK_FORWARD_ENABLED = os.getenv("WALK_FORWARD_ENABLED", "false").lower() == "true"
+# 窗口数量
+WALK_FORWARD_WINDOWS = int(os.getenv("WALK_FORWARD_WINDOWS", "4"))
+# 每个窗口中样本内部分所占比例
+WALK_FORWARD_TRAIN_RATIO = float(os.getenv("WALK_FORWARD_TRAIN_RATIO", "0.75"))
+# 是否同时回测每个窗口的样本内部分（用于计算样本外与样本内收益之比）
+WALK_FORWARD_TRAIN_BACKTEST = os.getenv("WALK_FORWARD_TRAIN_BACKTEST", "false").lower() == "true"
+# 评估通过所需的最低稳定性评分（0-1）
+WALK_FORWARD_MIN_STABILITY = float(os.getenv("WALK_FORWARD_MIN_STABILITY", "0.5"))
+
+# 每个窗口保留的指标
+WINDOW_FIELDS = ["total_trades", "profit_total_pct", "max_drawdown_pct", "win_rate", "sharpe", "profit_factor"]
+
+
+def _format_day(value: datetime) -> str:
+    return value.strftime("%Y%m%d")
+
+
+def split_walk_forward_windows(timerange: str, windows: int = WALK_FORWARD_WINDOWS,
+                               train_ratio: float = WALK_FORWARD_TRAIN_RATIO) -> List[Dict[str, str]]:
+    """
+    将时间范围切分为不重叠的滚动窗口（按天对齐）
+
+    Args:
+        timerange: "YYYYMMDD-YYYYMMDD"，两端都必须指定
+        windows: 窗口数量，时间范围太短时自动减少（每段至少 1 天）
+        train_ratio: 每个窗口中样本内部分所占比例
+
+    Returns:
+        List[Dict]: 每个窗口的 train_timerange 和 test_timerange
+    """
+    start, end = parse_timerange(timerange)
+    if start is None or end is None:
+        raise ValueError(f"滚动窗口评估需要完整的时间范围: {timerange}")
+
+    total_days = (end - start).days
+    if total_days < 2:
+        raise ValueError(f"时间范围太短，无法切分样本内和样本外窗口: {timerange}")
+    windows = max(1, min(windows, total_days // 2))
+    window_days = total_days // windows
+    train_days = min(max(1, round(window_days * train_ratio)), window_days - 1)
+
+    result = []
+    for i in range(windows):
+        window_start = start + timedelta(days=i * window_days)
+        # 最后一个窗口延伸到时间范围的结尾
+        window_end = end if i == windows - 1 else window_start + timedelta(days=window_days)
+        split = window_start + timedelta(days=train_days)
+        result.append({
+            "train_timerange": f"{_format_day(window_start)}-{_format_day(split)}",
+            "test_timerange": f"{_format_day(split)}-{_format_day(window_end)}",
+        })
+    return result
+
+
+def stability_score(test_profits: List[float]) -> float:
+    """
+    稳定性评分（0-1）：样本外盈利窗口的比例 × 1 / (1 + 样本外收益的变异系数)
+
+    所有窗口都盈利且收益接近时趋近 1；盈利窗口少或收益波动大时趋近 0。
+    """
+    if not test_profits:
+        return 0.0
+    profitable_ratio = sum(1 for p in test_profits if p > 0) / len(test_profits)
+    mean = sum(test_profits) / len(test_profits)
+    std = math.sqrt(sum((p - mean) ** 2 for p in test_profits) / len(test_profits))
+    cv = std / abs(mean) if mean else float("inf")
+    return round(profitable_ratio / (1 + cv), 4)
+
+
+def _summarize(metrics: Dict[str, Any]) -> Dict[str, Any]:
+    return {k: metrics.get(k, 0) for k in WINDOW_FIELDS}
+
+
+def aggregate_walk_forward(windows: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """
+    汇总各窗口的样本外指标
+
+    收益按窗口顺序复利累计，最大回撤取各窗口的最大值，胜率和盈利因子按交易次数加权，夏普比率取平均值。
+    窗口包含样本内指标（train）时另外计算 walk-forward efficiency，否则为 None。
+    """
+    tests = [w["test"] for w in windows]
+    total_trades = sum(t["total_trades"] for t in tests)
+
+    compounded = 1.0
+    for t in tests:
+        compounded *= 1 + t["profit_total_pct"] / 100
+    win_rate = sum(t["win_rate"] * t["total_trades"] for t in tests) / total_trades if total_trades else 0.0
+    profit_factor = (sum(t["profit_factor"] * t["total_trades"] for t in tests) / total_trades
+                     if total_trades else 0.0)
+
+    # 样本外与样本内平均收益之比（walk-forward efficiency），样本内亏损时没有意义
+    efficiency = None
+    if all("train" in w for w in windows):
+        train_mean = sum(w["train"]["profit_total_pct"] for w in windows) / len(windows)
+        test_mean = sum(t["profit_total_pct"] for t in tests) / len(tests)
+        efficiency = round(test_mean / train_mean, 3) if train_mean > 0 else None
+
+    return {
+        "total_trades": total_trades,
+        "profit_total_pct": round((compounded - 1) * 100, 2),
+        "max_drawdown_pct": max(t["max_drawdown_pct"] for t in tests),
+        "win_rate": round(win_rate, 2),
+        "sharpe": round(sum(t["sharpe"] for t in tests) / len(tests), 2),
+        "profit_factor": round(profit_factor, 3),
+        "profitable_windows": sum(1 for t in tests if t["profit_total_pct"] > 0),
+        "walk_forward_efficiency": efficiency,
+        "stability_score": stability_score([t["profit_total_pct"] for t in tests]),
+    }
+
+
+def run_walk_forward(strategy_code: str, timerange: str, pair_list: Optional[list] = None, timeframe: str = "5m",
+                     windows: int = WALK_FORWARD_WINDOWS,
+                     train_ratio: float = WALK_FORWARD_TRAIN_RATIO,
+                     train_backtest: bool = WALK_FORWARD_TRAIN_BACKTEST,
+                     progress_callback: Optional[Callable[[Dict[str, Any]], None]] = None) -> Dict[str, Any]:
+    """
+    滚动窗口评估
+
+    所有窗口的样本外回测（train_backtest 时还有样本内回测）同时提交（经过回测缓存和回测调度器，实际并发数量受调度器限制）。
+    任一窗口失败时取消其余窗口的回测，并返回失败窗口的错误（与 run_freqtrade_backtest_auto 的错误格式相同）；
+    回退到模拟模式的窗口也按失败处理（随机的模拟结果不能用于评估稳定性）。
+
+    Returns:
+        Dict: metrics 为样本外汇总指标，walk_forward 包含每个窗口的指标和稳定性评分
+    """
+    try:
+        splits = split_walk_forward_windows(timerange, windows, train_ratio)
+    except ValueError as e:
+        return {"error": str(e), "error_type": "execution_error"}
+
+    parts = ("train", "test") if train_backtest else ("test",)
+    segments = [(i, part, split[f"{part}_timerange"]) for i, split in enumerate(splits) for part in parts]
+    print(f"滚动窗口评估: {len(splits)} 个窗口，{len(segments)} 次回测")
+
+    # 任一窗口失败后其余窗口的结果已经没有用处，通过 cancel_event 取消排队中和运行中的回测
+    cancel_event = threading.Event()
+    with ThreadPoolExecutor(max_workers=len(segments), thread_name_prefix="walk-forward") as executor:
+        futures = [
+            executor.submit(run_freqtrade_backtest_auto, strategy_code, segment_timerange, pair_list, timeframe,
+                            progress_callback=progress_callback, cancel_event=cancel_event)
+            for _, _, segment_timerange in segments
+        ]
+        for future in as_completed(futures):
+            result = future.result()
+            if "error" in result or result.get("mock_mode"):
+                cancel_event.set()
+        results = [future.result() for future in futures]
+
+    failures = [(segment, result) for segment, result in zip(segments, results)
+                if "error" in result or result.get("mock_mode")]
+    if failures:
+        # 按窗口顺序报告第一个失败的窗口，被取消的窗口只是受其影响
+        (i, part, segment_timerange), result = next(
+            (f for f in failures if f[1].get("error_type") != "cancelled"), failures[0])
+        if "error" in result:
+            result["error"] = f"窗口 {i + 1} ({part} {segment_timerange}) 回测失败: {result['error']}"
+            return result
+        return {"error": f"窗口 {i + 1} ({part} {segment_timerange}) 回退到了模拟回测，无法进行滚动窗口评估",
+                "error_type": "execution_error"}
+
+    window_results = [dict(split, window=i) for i, split in enumerate(splits)]
+    for (i, part, segment_timerange), result in zip(segments, results):
+        window_results[i][part] = _summarize(result["metrics"])
+
+    summary = aggregate_walk_forward(window_results)
+    return {
+        "success": True,
+        "metrics": {
+            **{k: summary[k] for k in WINDOW_FIELDS},
+            "wins": round(summary["win_rate"] * summary["total_trades"] / 100),
+            "stability_score": summary["stability_score"],
+        },
+        "walk_forward": {
+            **summary,
+            "timerange": timerange,
+            "train_ratio": train_ratio,
+            "windows": window_results,
+        },
+    }
@@ -0,0 +1,174 @@
+"""
+常驻的 freqtrade 回测工作进程
+进程启动时导入一次 freqtrade/pandas/talib，之后通过本地 socket 接收回测任务并在进程内执行，
+同时在内存中缓存交易所对象（市场信息）和最近使用的交易对/时间周期的 K 线数据，
+省去每次回测启动 Python、导入依赖、解析配置和加载数据的开销。
+
+由 freqtrade_mcp.WarmWorkerPool 启动和管理，不直接使用:
+    python -m backend.tools.warm_worker --max-jobs 50 --max-rss-mb 2048
+
+通信协议（multiprocessing.connection，认证密钥通过环境变量 WARM_WORKER_AUTHKEY 传入）:
+    请求: {"argv": ["backtesting", "--strategy", ...]}
+    响应: {"returncode": int, "stdout": str, "stderr": str, "recycle": bool, "jobs_done": int, "rss_mb": float}
+"""
+import argparse
+import contextlib
+import io
+import os
+import sys
+import time
+import traceback
+from collections import OrderedDict
+from multiprocessing.connection import Listener
+
+# 每个工作进程缓存的 K 线数据集数量
+DATA_CACHE_SIZE = int(os.getenv("WARM_WORKER_DATA_CACHE_SIZE", "8"))
+
+
+def current_rss_mb() -> float:
+    """当前进程的常驻内存（MB）"""
+    try:
+        import psutil
+        return psutil.Process().memory_info().rss / (1024 * 1024)
+    except ImportError:
+        import resource
+        # Linux 下 ru_maxrss 单位为 KB（峰值，作为近似值）
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def _data_version(datadir: str, pairs: list, timeframe: str) -> tuple:
+    """指定交易对和时间周期的 K 线文件的 (文件名, 修改时间)"""
+    if not os.path.isdir(datadir):
+        return ()
+    prefixes = tuple(f"{pair.replace('/', '_').replace(':', '_')}-{timeframe}" for pair in pairs)
+    return tuple(
+        (entry.name, entry.stat().st_mtime_ns)
+        for entry in sorted(os.scandir(datadir), key=lambda e: e.name)
+        if entry.name.startswith(prefixes)
+    )
+
+
+class WarmBacktester:
+    """在当前进程中执行 freqtrade 回测，并缓存交易所对象和 K 线数据"""
+
+    def __init__(self):
+        # 启动时导入 freqtrade，之后的回测不再支付导入开销
+        from freqtrade.commands import Arguments
+        from freqtrade.commands.optimize_commands import setup_optimize_configuration
+        from freqtrade.data import history
+        from freqtrade.enums import RunMode
+        from freqtrade.optimize.backtesting import Backtesting
+        from freqtrade.resolvers import ExchangeResolver
+
+        self._Arguments = Arguments
+        self._setup_configuration = setup_optimize_configuration
+        self._RunMode = RunMode
+        self._Backtesting = Backtesting
+        self._ExchangeResolver = ExchangeResolver
+
+        self._exchanges = {}
+        self._data_cache: "OrderedDict[tuple, dict]" = OrderedDict()
+        self.data_cache_hits = 0
+
+        # 替换 history.load_data，使 Backtesting.load_bt_data 优先使用内存中的 K 线数据
+        self._original_load_data = history.load_data
+        history.load_data = self._cached_load_data
+
+    def _cached_load_data(self, datadir, timeframe, pairs, **kwargs):
+        timerange = kwargs.get("timerange")
+        key = (
+            str(datadir), timeframe, tuple(pairs),
+            (timerange.startts, timerange.stopts) if timerange else None,
+            kwargs.get("startup_candles", 0), kwargs.get("data_format"), str(kwargs.get("candle_type", ""))
+        )
+        # 以数据文件的修改时间作为版本，数据更新后缓存自动失效
+        version = _data_version(str(datadir), pairs, timeframe)
+
+        cached = self._data_cache.get(key)
+        if cached is not None and cached["version"] == version:
+            self._data_cache.move_to_end(key)
+            self.data_cache_hits += 1
+            data = cached["data"]
+        else:
+            data = self._original_load_data(datadir, timeframe, pairs, **kwargs)
+            self._data_cache[key] = {"version": version, "data": data}
+            while len(self._data_cache) > DATA_CACHE_SIZE:
+                self._data_cache.popitem(last=False)
+        # 回测过程中可能修改 DataFrame，返回副本
+        return {pair: df.copy() for pair, df in data.items()}
+
+    def _get_exchange(self, config):
+        """交易所对象（含市场信息）按交易所名称和配置文件缓存，避免每次回测重新加载市场"""
+        key = (config["exchange"]["name"], tuple(str(c) for c in config.get("config_files", [])))
+        if key not in self._exchanges:
+            self._exchanges[key] = self._ExchangeResolver.load_exchange(config, load_leverage_tiers=True)
+        return self._exchanges[key]
+
+    def run(self, argv: list) -> dict:
+        """执行一次回测，argv 与 freqtrade 命令行参数相同（不含开头的 "freqtrade"）"""
+        stdout = io.StringIO()
+        stderr = io.StringIO()
+        returncode = 0
+        with contextlib.redirect_stdout(stdout), contextlib.redirect_stderr(stderr):
+            try:
+                args = self._Arguments(argv).get_parsed_arg()
+                config = self._setup_configuration(args, self._RunMode.BACKTEST)
+                backtesting = self._Backtesting(config, exchange=self._get_exchange(config))
+                try:
+                    backtesting.start()
+                finally:
+                    self._Backtesting.cleanup()
+            except SystemExit as e:
+                returncode = e.code if isinstance(e.code, int) else 1
+            except Exception:
+                traceback.print_exc()
+                returncode = 1
+        return {"returncode": returncode, "stdout": stdout.getvalue(), "stderr": stderr.getvalue()}
+
+
+def serve(max_jobs: int, max_rss_mb: float):
+    authkey = bytes.fromhex(os.environ["WARM_WORKER_AUTHKEY"])
+    backtester = WarmBacktester()
+
+    with Listener(("127.0.0.1", 0), authkey=authkey) as listener:
+        # 通知管理进程监听端口，之后 stdout 不再使用
+        print(f"READY {listener.address[1]}", flush=True)
+        jobs_done = 0
+        while True:
+            with listener.accept() as conn:
+                while True:
+                    try:
+                        request = conn.recv()
+                    except EOFError:
+                        break
+                    if request.get("command") == "shutdown":
+                        return
+
+                    start_time = time.perf_counter()
+                    response = backtester.run(request["argv"])
+                    jobs_done += 1
+                    rss_mb = current_rss_mb()
+                    response.update({
+                        "jobs_done": jobs_done,
+                        "rss_mb": round(rss_mb, 1),
+                        "elapsed": round(time.perf_counter() - start_time, 3),
+                        "data_cache_hits": backtester.data_cache_hits,
+                        # 达到任务数或内存上限后退出，由管理进程重新启动新的工作进程
+                        "recycle": jobs_done >= max_jobs or rss_mb >= max_rss_mb,
+                    })
+                    conn.send(response)
+                    if response["recycle"]:
+                        return
+
+
+def main():
+    parser = argparse.ArgumentParser(description="常驻的 freqtrade 回测工作进程")
+    parser.add_argument("--max-jobs", type=int, default=50, help="处理多少个任务后退出重启")
+    parser.add_argument("--max-rss-mb", type=float, default=2048, help="常驻内存超过该值后退出重启")
+    args = parser.parse_args()
+    serve(args.max_jobs, args.max_rss_mb)
+    sys.exit(0)
+
+
+if __name__ == "__main__":
+    main()
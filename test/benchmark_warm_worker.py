@@ -0,0 +1,106 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+基准测试 - 对比每次启动独立 freqtrade 进程与常驻工作进程的回测耗时
+
+用法:
+    python test/benchmark_warm_worker.py --runs 5 --pairs BTC/USDT ETH/USDT --timerange 20230101-20230301
+
+需要本地已下载对应交易对和时间周期的 K 线数据。回测结果缓存在此脚本中关闭。
+"""
+
+import argparse
+import os
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from backend.tools import freqtrade_mcp  # noqa: E402
+
+# 设置 UTF-8 输出（Windows 兼容性）
+if sys.platform == 'win32':
+    try:
+        sys.stdout.reconfigure(encoding='utf-8')
+    except Exception:
+        pass
+
+STRATEGY_CODE = '''
+from freqtrade.strategy import IStrategy
+from pandas import DataFrame
+import talib.abstract as ta
+
+
+class AI_Strategy(IStrategy):
+    timeframe = '5m'
+    minimal_roi = {"0": 0.02}
+    stoploss = -0.03
+
+    def populate_indicators(self, dataframe: DataFrame, metadata: dict) -> DataFrame:
+        dataframe['rsi'] = ta.RSI(dataframe, timeperiod=14)
+        return dataframe
+
+    def populate_entry_trend(self, dataframe: DataFrame, metadata: dict) -> DataFrame:
+        dataframe.loc[dataframe['rsi'] < 30, 'enter_long'] = 1
+        return dataframe
+
+    def populate_exit_trend(self, dataframe: DataFrame, metadata: dict) -> DataFrame:
+        dataframe.loc[dataframe['rsi'] > 70, 'exit_long'] = 1
+        return dataframe
+'''
+
+
+def run_series(label: str, warm: bool, args) -> list:
+    """连续执行 runs 次回测，返回每次的耗时"""
+    freqtrade_mcp.WARM_WORKER_ENABLED = warm
+    # 常驻工作进程只在没有配置单个回测的资源限制时使用（见 freqtrade_mcp.warm_worker_usable）
+    freqtrade_mcp.BACKTEST_MAX_RSS_MB = freqtrade_mcp.BACKTEST_MAX_CPU_SECONDS = 0
+    timings = []
+    for i in range(args.runs):
+        start = time.perf_counter()
+        result = freqtrade_mcp.run_freqtrade_backtest(
+            STRATEGY_CODE, args.timerange, args.pairs, args.timeframe, timeout=args.timeout
+        )
+        elapsed = time.perf_counter() - start
+        if not result.get("success"):
+            print(f"[!!] {label} 第 {i + 1} 次回测失败: {result.get('error')}")
+            print(result.get("stderr", "")[-2000:])
+            sys.exit(1)
+        timings.append(elapsed)
+        print(f"[--] {label} #{i + 1}: {elapsed:.2f}s  trades={result['metrics'].get('total_trades')}")
+    return timings
+
+
+def summarize(label: str, timings: list):
+    print(f"{label:<8} 首次 {timings[0]:.2f}s  "
+          f"中位数 {statistics.median(timings):.2f}s  "
+          f"之后平均 {statistics.mean(timings[1:] or timings):.2f}s")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="常驻工作进程回测耗时基准测试")
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--pairs", nargs="+", default=["BTC/USDT"])
+    parser.add_argument("--timeframe", default="5m")
+    parser.add_argument("--timerange", default="20230101-20230201")
+    parser.add_argument("--timeout", type=int, default=300)
+    args = parser.parse_args()
+
+    print("=" * 60)
+    print(f"回测 {args.runs} 次: {' '.join(args.pairs)} {args.timeframe} {args.timerange}")
+    print("=" * 60)
+
+    cold = run_series("cold", False, args)
+    warm = run_series("warm", True, args)
+    freqtrade_mcp.get_warm_worker_pool().shutdown()
+
+    print("\n" + "=" * 60)
+    summarize("cold", cold)
+    summarize("warm", warm)
+    speedup = statistics.median(cold) / statistics.median(warm)
+    print(f"常驻工作进程中位数加速: {speedup:.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,37 @@
+"""
+pytest 公共配置: 把项目根目录加入 sys.path，并提供隔离的 K 线数据目录
+"""
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# 本地替身交易所最早有数据的日期（之前的区间用于验证空区间的记录）
+LOCAL_EXCHANGE_START = "20230110"
+
+
+@pytest.fixture
+def local_data_dir(tmp_path, monkeypatch):
+    """
+    临时的 K 线数据目录: 覆盖范围索引、合成记录和质量附属文件都写在其中，
+    下载管理器使用本地替身交易所（见 backend/tools/local_exchange.py），不访问网络
+    """
+    from backend.tools import (candle_resample, candle_store, data_coverage, data_downloader, data_quality,
+                               download_manager, local_exchange)
+
+    data_dir = str(tmp_path)
+    for module in (candle_store, data_downloader, data_quality, local_exchange):
+        monkeypatch.setattr(module, "DATA_DIR", data_dir)
+    monkeypatch.setattr(data_quality, "QUALITY_DIR", os.path.join(data_dir, "quality"))
+    monkeypatch.setattr(candle_resample, "RESAMPLE_INDEX_PATH", os.path.join(data_dir, "resample_index.json"))
+    monkeypatch.setattr(candle_resample, "_records", None)
+    monkeypatch.setattr(local_exchange, "LOCAL_EXCHANGE_START", LOCAL_EXCHANGE_START)
+    monkeypatch.setattr(local_exchange, "LOCAL_EXCHANGE_LATENCY", 0)
+    monkeypatch.setattr(data_coverage, "_index",
+                        data_coverage.CoverageIndex(os.path.join(data_dir, "coverage_index.json")))
+    manager = download_manager.DownloadManager(max_workers=4, fetcher=local_exchange.fetch_candles)
+    monkeypatch.setattr(download_manager, "_manager", manager)
+    yield tmp_path
+    manager._executor.shutdown(wait=True)
@@ -0,0 +1,39 @@
+"""
+回测结果缓存测试: 未指定交易对时按 pair_whitelist 计算数据指纹，结果文件被清理后不再命中
+"""
+import json
+
+from backend.tools import data_downloader
+from backend.tools.backtest_cache import BacktestCache
+from backend.tools.candle_store import CANDLE_DATA_FORMAT, candle_file_path, read_candle_file, write_candle_file
+
+PAIR = "BTC/USDT"
+TIMERANGE = "20230201-20230210"
+
+
+def test_key_without_pairs_covers_whitelist_data(local_data_dir, tmp_path):
+    config_path = tmp_path / "config.json"
+    config_path.write_text(json.dumps({"exchange": {"pair_whitelist": [PAIR]}}))
+    cache = BacktestCache(str(tmp_path / "cache"))
+    data_downloader.download_data_if_needed([PAIR], "5m", TIMERANGE)
+    key = cache.make_key("code", None, "5m", TIMERANGE, config_path=str(config_path))
+
+    path = candle_file_path(PAIR, "5m", "okx", CANDLE_DATA_FORMAT)
+    write_candle_file(read_candle_file(path).iloc[:-10], path)
+    assert cache.make_key("code", None, "5m", TIMERANGE, config_path=str(config_path)) != key
+
+
+def test_pruned_result_file_is_a_miss(tmp_path):
+    cache = BacktestCache(str(tmp_path / "cache"))
+    result_path = tmp_path / "result.zip"
+    result_path.write_bytes(b"zip")
+    cache.put("a" * 64, {"success": True, "metrics": {"full_result_path": str(result_path)}})
+    cache.put("b" * 64, {"success": True, "metrics": {"full_result_path": "",
+                                                      "shard_result_paths": [str(result_path)]}})
+    assert cache.get("a" * 64)["cache_hit"]
+    assert cache.get("b" * 64)["cache_hit"]
+
+    result_path.unlink()
+    assert cache.get("a" * 64) is None
+    assert cache.get("b" * 64) is None
+    assert cache.stats()["entries"] == 0
@@ -0,0 +1,135 @@
+"""
+回测结果读取与分片合并测试（构造 freqtrade 导出格式的统计，不运行 freqtrade）
+"""
+import json
+import zipfile
+
+import pandas as pd
+import pytest
+
+from backend.tools.backtest_results import BacktestResult, merge_backtest_results
+from backend.tools.trade_metrics import compute_trade_metrics
+
+START, END = "2023-01-01 00:00:00", "2023-01-11 00:00:00"
+
+
+def _trade(pair, open_date, close_date, profit_abs, exit_reason):
+    return {"pair": pair, "open_date": f"{open_date}+00:00", "close_date": f"{close_date}+00:00",
+            "profit_ratio": profit_abs / 1000, "profit_abs": profit_abs, "exit_reason": exit_reason}
+
+
+def _stats(pair, trades, starting_balance=1000.0):
+    profit = sum(t["profit_abs"] for t in trades)
+    reasons = {}
+    for t in trades:
+        reasons[t["exit_reason"]] = reasons.get(t["exit_reason"], 0) + 1
+    return {
+        "trades": trades,
+        "total_trades": len(trades),
+        "wins": sum(t["profit_abs"] > 0 for t in trades),
+        "losses": sum(t["profit_abs"] < 0 for t in trades),
+        "profit_total_abs": profit,
+        "profit_total": profit / starting_balance,
+        "starting_balance": starting_balance,
+        "final_balance": starting_balance + profit,
+        "backtest_start": START,
+        "backtest_end": END,
+        "timeframe": "5m",
+        "results_per_pair": [{"key": pair, "trades": len(trades), "profit_total_abs": profit},
+                             {"key": "TOTAL", "trades": len(trades), "profit_total_abs": profit}],
+        "exit_reason_summary": [{"key": reason, "trades": count} for reason, count in reasons.items()]
+                               + [{"key": "TOTAL", "trades": len(trades)}],
+    }
+
+
+def _btc():
+    return BacktestResult("btc.zip", "TestStrategy", _stats("BTC/USDT", [
+        _trade("BTC/USDT", "2023-01-01 00:00", "2023-01-02 00:00", 100.0, "roi"),
+        _trade("BTC/USDT", "2023-01-04 00:00", "2023-01-05 00:00", 30.0, "roi"),
+    ]))
+
+
+def _eth():
+    return BacktestResult("eth.zip", "TestStrategy", _stats("ETH/USDT", [
+        _trade("ETH/USDT", "2023-01-01 12:00", "2023-01-03 00:00", -50.0, "stop_loss"),
+        _trade("ETH/USDT", "2023-01-06 00:00", "2023-01-08 00:00", -80.0, "exit_signal"),
+    ]))
+
+
+def _btc_stats():
+    return _stats("BTC/USDT", _btc()._raw_trades)
+
+
+def test_metrics_do_not_build_trades():
+    result = _btc()
+    metrics = result.metrics
+    assert result._trades is None
+    assert metrics["total_trades"] == 2
+    assert metrics["profit_total_pct"] == 13.0
+    assert metrics["results_per_pair"] == [{"pair": "BTC/USDT", "trades": 2, "profit_total_abs": 130.0}]
+    assert metrics["exit_reasons"] == {"roi": 2}
+    json.dumps(metrics)
+
+
+def test_detailed_metrics_include_trade_fields():
+    result = _btc()
+    detailed = result.detailed_metrics
+    assert result._trades is not None
+    assert detailed["holding_avg_hours"] == 24.0
+    assert detailed["max_open_trades"] == 1
+    assert detailed["exposure_pct"] == 20.0
+    assert {k: v for k, v in detailed.items() if k in result.metrics} == result.metrics
+
+
+def test_detailed_metrics_without_trades():
+    result = BacktestResult("empty.zip", "TestStrategy", _stats("BTC/USDT", []))
+    detailed = result.detailed_metrics
+    assert detailed["total_trades"] == 0
+    assert detailed["max_drawdown_duration_days"] == 0.0
+    assert detailed["max_open_trades"] == 0
+
+
+def test_merge_recomputes_portfolio_metrics():
+    merged = merge_backtest_results([_btc(), _eth()])
+    trades = [t for r in (_btc(), _eth()) for t in r._raw_trades]
+
+    expected = compute_trade_metrics(pd.DataFrame(trades), 2000.0, START, END)
+    for field in ("total_trades", "profit_total_abs", "max_drawdown_abs", "max_drawdown_pct", "sharpe",
+                  "profit_factor", "exposure_pct", "max_open_trades"):
+        assert merged[field] == expected[field], field
+    assert merged["total_trades"] == 4
+    assert merged["starting_balance"] == 2000.0
+    assert merged["max_open_trades"] == 2
+    assert merged["exit_reasons"] == {"roi": 2, "stop_loss": 1, "exit_signal": 1}
+    assert [row["pair"] for row in merged["results_per_pair"]] == ["BTC/USDT", "ETH/USDT"]
+    assert merged["shard_result_paths"] == ["btc.zip", "eth.zip"]
+    assert merged["timeframe"] == "5m"
+
+
+def test_merge_without_trades():
+    empty = BacktestResult("empty.zip", "TestStrategy", _stats("BTC/USDT", []))
+    merged = merge_backtest_results([empty])
+    assert merged["total_trades"] == 0
+    assert merged["exit_reasons"] == {}
+
+
+def test_from_export_dir(tmp_path):
+    assert BacktestResult.from_export_dir(str(tmp_path)) is None
+
+    stem = "backtest-result-2023-01-11_00-00-00"
+    with zipfile.ZipFile(tmp_path / f"{stem}.zip", "w") as zf:
+        zf.writestr(f"{stem}.json", json.dumps({"strategy": {"TestStrategy": _btc_stats()}}))
+    (tmp_path / f"{stem}.meta.json").write_text(json.dumps({"TestStrategy": {"run_id": "abc"}}))
+    (tmp_path / ".last_result.json").write_text(json.dumps({"latest_backtest": f"{stem}.zip"}))
+
+    result = BacktestResult.from_export_dir(str(tmp_path), "OtherStrategy")
+    assert result.strategy_name == "TestStrategy"
+    assert result.meta == {"run_id": "abc"}
+    assert result.metrics["total_trades"] == 2
+
+
+def test_from_file_without_strategy(tmp_path):
+    path = tmp_path / "result.json"
+    path.write_text(json.dumps({"strategy": {}}))
+    with pytest.raises(ValueError):
+        BacktestResult.from_file(str(path))
@@ -0,0 +1,75 @@
+"""
+K 线合成测试: 聚合结果与 pandas resample 一致，只在来源周期覆盖请求范围时合成
+"""
+import numpy as np
+import pandas as pd
+
+from backend.tools import candle_resample, data_coverage, data_downloader
+from backend.tools.candle_store import CANDLE_DATA_FORMAT, candle_file_path, read_candle_file
+
+PAIR = "BTC/USDT"
+
+
+def _candles(start: str, periods: int, freq: str = "5min") -> pd.DataFrame:
+    rng = np.random.default_rng(0)
+    close = 100 + rng.standard_normal(periods).cumsum()
+    return pd.DataFrame({
+        "date": pd.date_range(start, periods=periods, freq=freq, tz="UTC"),
+        "open": close + rng.standard_normal(periods) * 0.1,
+        "high": close + 1,
+        "low": close - 1,
+        "close": close,
+        "volume": rng.random(periods) * 10,
+    })
+
+
+def test_resample_matches_pandas():
+    df = _candles("2023-02-01", 12 * 24 * 3)
+    result = candle_resample.resample_ohlcv(df, "5m", "1h")
+    expected = (df.set_index("date")
+                .resample("1h")
+                .agg({"open": "first", "high": "max", "low": "min", "close": "last", "volume": "sum"})
+                .reset_index())
+    assert len(result) == 24 * 3
+    pd.testing.assert_frame_equal(result, expected, check_dtype=False, check_index_type=False)
+
+
+def test_resample_drops_incomplete_edge_buckets():
+    # 从 00:10 开始、在 02:50 结束: 第一个和最后一个小时都不完整
+    df = _candles("2023-02-01 00:10", 12 * 3 - 3)
+    result = candle_resample.resample_ohlcv(df, "5m", "1h")
+    assert list(result["date"]) == [pd.Timestamp("2023-02-01 01:00", tz="UTC")]
+
+
+def test_can_resample():
+    assert candle_resample.can_resample("5m", "1h")
+    assert candle_resample.can_resample("1h", "1d")
+    assert not candle_resample.can_resample("1h", "5m")
+    assert not candle_resample.can_resample("1h", "1w")
+    assert not candle_resample.can_resample("2h", "3h")
+
+
+def test_resample_when_source_covers_range(local_data_dir):
+    data_downloader.download_data_if_needed([PAIR], "5m", "20230201-20230301")
+
+    result = data_downloader.download_data_if_needed([PAIR], "1h", "20230201-20230301")
+    assert result["success"]
+    assert result["resampled"] == {PAIR: "5m"}
+    assert candle_resample.is_derived(PAIR, "1h", "okx")
+
+    source = read_candle_file(candle_file_path(PAIR, "5m", "okx", CANDLE_DATA_FORMAT))
+    derived = read_candle_file(candle_file_path(PAIR, "1h", "okx", CANDLE_DATA_FORMAT))
+    expected = candle_resample.resample_ohlcv(source, "5m", "1h")
+    pd.testing.assert_frame_equal(derived.reset_index(drop=True), expected, check_dtype=False)
+
+
+def test_download_directly_when_source_does_not_cover_range(local_data_dir):
+    data_downloader.download_data_if_needed([PAIR], "5m", "20230201-20230210")
+
+    # 5m 只覆盖请求范围的一部分: 不为合成去下载更多 5m 数据，直接下载 1h
+    assert candle_resample.resample_source(PAIR, "1h", "okx", "20230201-20230301") is None
+    result = data_downloader.download_data_if_needed([PAIR], "1h", "20230201-20230301")
+    assert result["success"] and result["resampled"] == {}
+    assert not candle_resample.is_derived(PAIR, "1h", "okx")
+    assert data_coverage.get_coverage_index().missing_ranges(PAIR, "5m", "okx", "20230201-20230301")
+    assert data_coverage.get_coverage_index().missing_ranges(PAIR, "1h", "okx", "20230201-20230301") == []
@@ -0,0 +1,42 @@
+"""
+K 线数据完整性检查测试: 下载后乱序和重复的行就地修复，无法修复的错误使下载结果失败
+"""
+import pandas as pd
+
+from backend.tools import data_downloader, data_quality
+from backend.tools.candle_store import CANDLE_DATA_FORMAT, candle_file_path, read_candle_file, write_candle_file
+
+PAIR = "BTC/USDT"
+TIMERANGE = "20230201-20230210"
+
+
+def _candle_file():
+    return candle_file_path(PAIR, "5m", "okx", CANDLE_DATA_FORMAT)
+
+
+def test_unsorted_and_duplicate_rows_are_repaired(local_data_dir):
+    data_downloader.download_data_if_needed([PAIR], "5m", TIMERANGE)
+    df = read_candle_file(_candle_file())
+    broken = pd.concat([df.iloc[100:], df.iloc[:100], df.iloc[:5]], ignore_index=True)
+    write_candle_file(broken, _candle_file())
+    assert data_downloader.check_data_exists([PAIR], "5m") == {PAIR: True}
+    assert data_quality.scan_file(_candle_file(), "5m")["status"] == "error"
+    assert data_downloader.check_data_exists([PAIR], "5m") == {PAIR: False}
+
+    result = data_downloader.download_data_if_needed([PAIR], "5m", TIMERANGE)
+    assert result["success"] and result["quality_errors"] == {}
+    assert data_quality.read_quality(PAIR, "5m", "okx")["status"] == "ok"
+    repaired = read_candle_file(_candle_file(), sort=False)
+    pd.testing.assert_frame_equal(repaired.reset_index(drop=True), df.reset_index(drop=True), check_dtype=False)
+
+
+def test_invalid_ohlc_fails_the_download(local_data_dir):
+    data_downloader.download_data_if_needed([PAIR], "5m", TIMERANGE)
+    df = read_candle_file(_candle_file()).copy()
+    df.loc[10, "high"] = df.loc[10, "low"] / 2
+    write_candle_file(df, _candle_file())
+
+    result = data_downloader.download_data_if_needed([PAIR], "5m", TIMERANGE)
+    assert not result["success"] and not result["skipped"]
+    assert list(result["quality_errors"]) == [PAIR]
+    assert data_downloader.check_data_exists([PAIR], "5m") == {PAIR: False}
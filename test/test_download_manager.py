@@ -0,0 +1,96 @@
+"""
+下载管理器与覆盖范围索引测试（使用本地替身交易所，见 conftest.local_data_dir）
+"""
+import threading
+from datetime import datetime, timezone
+
+import pandas as pd
+
+from backend.tools import data_coverage, data_downloader, download_manager, local_exchange
+from backend.tools.candle_store import CANDLE_DATA_FORMAT, candle_file_path, read_candle_file, write_candle_file
+
+PAIR = "BTC/USDT"
+
+
+def _ts(day: str) -> int:
+    return int(datetime.strptime(day, "%Y%m%d").replace(tzinfo=timezone.utc).timestamp())
+
+
+def _ranges(ranges):
+    return [(r["kind"], r["start"], r["end"]) for r in ranges]
+
+
+def test_single_flight_coalesces_identical_shards(local_data_dir):
+    calls = []
+    release = threading.Event()
+
+    def slow_fetcher(*args, **kwargs):
+        calls.append(args)
+        release.wait(5)
+        return local_exchange.fetch_candles(*args, **kwargs)
+
+    manager = download_manager.DownloadManager(max_workers=4, fetcher=slow_fetcher)
+    try:
+        futures = [manager.submit(PAIR, "5m", "20230201-20230210", "okx") for _ in range(3)]
+        assert futures[0] is futures[1] is futures[2]
+        assert manager.stats()["coalesced"] == 2
+        release.set()
+        result = futures[0].result(timeout=10)
+    finally:
+        release.set()
+        manager._executor.shutdown(wait=True)
+
+    assert result["success"] and not result["skipped"]
+    assert len(calls) == 1
+    assert manager.stats()["inflight"] == []
+
+
+def test_shard_is_skipped_once_covered(local_data_dir):
+    manager = download_manager.get_download_manager()
+    first = manager.download([PAIR, "ETH/USDT"], "5m", "20230201-20230210")
+    second = manager.download([PAIR, "ETH/USDT"], "5m", "20230201-20230210")
+    assert first["success"] and not first["skipped"]
+    assert second["success"] and second["skipped"]
+
+
+def test_missing_ranges_head_tail_and_gap(local_data_dir):
+    index = data_coverage.get_coverage_index()
+    assert _ranges(index.missing_ranges(PAIR, "5m", "okx", "20230201-20230301")) == [
+        ("full", _ts("20230201"), _ts("20230301"))]
+
+    result = data_downloader.download_data_if_needed([PAIR], "5m", "20230201-20230301")
+    assert result["success"]
+    assert index.missing_ranges(PAIR, "5m", "okx", "20230201-20230301") == []
+
+    # 请求范围比已有数据更长: 开头和结尾各缺一段（数据文件最后一根 K 线的开盘时间是 2 月 28 日 23:55）
+    ranges = _ranges(index.missing_ranges(PAIR, "5m", "okx", "20230115-20230315"))
+    assert ranges == [("head", _ts("20230115"), _ts("20230201")),
+                      ("tail", _ts("20230301"), _ts("20230315"))]
+
+    # 删除中间一天的 K 线后出现内部缺口（数据文件变化后重新扫描）
+    path = candle_file_path(PAIR, "5m", "okx", CANDLE_DATA_FORMAT)
+    df = read_candle_file(path)
+    hole = (df["date"] >= pd.Timestamp("2023-02-10", tz="UTC")) & (df["date"] < pd.Timestamp("2023-02-11", tz="UTC"))
+    write_candle_file(df[~hole], path)
+    assert _ranges(index.missing_ranges(PAIR, "5m", "okx", "20230201-20230301")) == [
+        ("gap", _ts("20230210"), _ts("20230211"))]
+
+    # 补齐缺口后与一次下载整个范围的数据完全相同
+    result = data_downloader.download_data_if_needed([PAIR], "5m", "20230201-20230301")
+    assert result["success"] and result["missing"][PAIR][0]["kind"] == "gap"
+    assert index.missing_ranges(PAIR, "5m", "okx", "20230201-20230301") == []
+    filled = read_candle_file(path)
+    pd.testing.assert_frame_equal(filled.reset_index(drop=True), df.reset_index(drop=True), check_dtype=False)
+
+
+def test_empty_range_is_marked_and_not_downloaded_again(local_data_dir):
+    index = data_coverage.get_coverage_index()
+    # 替身交易所 1 月 10 日之前没有数据
+    result = data_downloader.download_data_if_needed([PAIR], "5m", "20230101-20230201")
+    assert result["success"]
+    assert _ranges(result["remaining"][PAIR]) == [("head", _ts("20230101"), _ts(local_exchange.LOCAL_EXCHANGE_START))]
+
+    assert index.missing_ranges(PAIR, "5m", "okx", "20230101-20230201") == []
+    again = data_downloader.download_data_if_needed([PAIR], "5m", "20230101-20230201")
+    assert again["skipped"]
+    assert data_downloader.check_data_exists([PAIR], "5m", timerange="20230101-20230201") == {PAIR: True}
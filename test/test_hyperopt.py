@@ -0,0 +1,81 @@
+"""
+超参数优化辅助函数测试: 参数检测、最优值写回策略代码、读取 .fthypt 结果
+"""
+import ast
+import json
+
+from backend.tools.hyperopt import _load_best_epoch, apply_hyperopt_params, detect_hyperopt_parameters
+
+STRATEGY = '''from freqtrade.strategy import IStrategy, IntParameter, DecimalParameter, CategoricalParameter
+import freqtrade.strategy as fs
+
+
+class TestStrategy(IStrategy):
+    # 入场阈值（中文注释）
+    buy_rsi = IntParameter(10, 40, default=30, space="buy")
+    buy_factor = fs.DecimalParameter(
+        0.5, 2.0,
+        default=1.0,
+        decimals=2,
+    )
+    sell_rsi = IntParameter(60, 90)
+    exit_mode = CategoricalParameter(["fast", "slow"], default="fast", space="sell")
+    fixed_value = IntParameter(1, 5, default=3, space="buy", optimize=False)
+    unrelated = IntParameter(1, 5, default=2)
+    timeframe = "5m"
+'''
+
+
+def test_detect_parameters():
+    parameters = detect_hyperopt_parameters(STRATEGY)
+    assert parameters == [
+        {"name": "buy_rsi", "type": "IntParameter", "space": "buy", "default": 30},
+        {"name": "buy_factor", "type": "DecimalParameter", "space": "buy", "default": 1.0},
+        {"name": "sell_rsi", "type": "IntParameter", "space": "sell", "default": None},
+        {"name": "exit_mode", "type": "CategoricalParameter", "space": "sell", "default": "fast"},
+    ]
+
+
+def test_detect_parameters_invalid_code():
+    assert detect_hyperopt_parameters("class Broken(:\n") == []
+
+
+def test_apply_params_replaces_defaults_only():
+    code = apply_hyperopt_params(STRATEGY, {"buy_rsi": 25, "buy_factor": 1.35, "exit_mode": "slow", "missing": 1})
+    assert 'buy_rsi = IntParameter(10, 40, default=25, space="buy")' in code
+    assert "        default=1.35,\n        decimals=2," in code
+    assert 'CategoricalParameter(["fast", "slow"], default=\'slow\', space="sell")' in code
+    # 其余代码（注释、未优化的参数）保持不变
+    assert "# 入场阈值（中文注释）" in code
+    assert "sell_rsi = IntParameter(60, 90)\n" in code
+    assert len(code.splitlines()) == len(STRATEGY.splitlines())
+    ast.parse(code)
+
+
+def test_apply_params_appends_missing_default():
+    code = apply_hyperopt_params(STRATEGY, {"sell_rsi": 75})
+    assert "sell_rsi = IntParameter(60, 90, default=75)\n" in code
+    assert {p["name"]: p["default"] for p in detect_hyperopt_parameters(code)}["sell_rsi"] == 75
+
+
+def test_apply_params_roundtrip():
+    params = {"buy_rsi": 12, "buy_factor": 0.75, "sell_rsi": 88, "exit_mode": "slow"}
+    code = apply_hyperopt_params(STRATEGY, params)
+    assert {p["name"]: p["default"] for p in detect_hyperopt_parameters(code)} == params
+
+
+def test_load_best_epoch(tmp_path):
+    results_file = tmp_path / "strategy.fthypt"
+    epochs = [
+        {"loss": -1.0, "results_metrics": {"total_trades": 20}},
+        # 损失最小但交易次数不足
+        {"loss": -5.0, "results_metrics": {"total_trades": 3}},
+        {"loss": -2.0, "results_metrics": {"total_trades": 15}},
+    ]
+    # 超时被终止时最后一行不完整
+    results_file.write_text("\n".join(json.dumps(e) for e in epochs) + '\n{"loss": -9', encoding="utf-8")
+
+    best, evaluated = _load_best_epoch(str(results_file), min_trades=10)
+    assert best["loss"] == -2.0
+    assert evaluated == 3
+    assert _load_best_epoch(str(tmp_path / "missing.fthypt"), 10) == (None, 0)
@@ -0,0 +1,85 @@
+"""
+由交易明细计算指标的测试（手工构造的交易，期望值可以直接核对）
+"""
+import pandas as pd
+import pytest
+
+from backend.tools.trade_metrics import compute_trade_metrics, equity_curve, prepare_trades
+
+START, END = "2023-01-01T00:00:00+00:00", "2023-01-11T00:00:00+00:00"
+
+
+def _trades() -> pd.DataFrame:
+    return pd.DataFrame({
+        "pair": ["BTC/USDT", "ETH/USDT", "BTC/USDT", "ETH/USDT"],
+        "open_date": ["2023-01-01 00:00", "2023-01-01 12:00", "2023-01-04 00:00", "2023-01-06 00:00"],
+        "close_date": ["2023-01-02 00:00", "2023-01-03 00:00", "2023-01-05 00:00", "2023-01-08 00:00"],
+        "profit_ratio": [0.1, -0.05, 0.03, -0.08],
+        "profit_abs": [100.0, -50.0, 30.0, -80.0],
+    })
+
+
+def test_summary_metrics():
+    metrics = compute_trade_metrics(_trades(), 1000.0, START, END)
+    assert metrics["total_trades"] == 4
+    assert (metrics["wins"], metrics["losses"], metrics["draws"]) == (2, 2, 0)
+    assert metrics["win_rate"] == 50.0
+    assert metrics["profit_total_abs"] == 0.0
+    assert metrics["final_balance"] == 1000.0
+    assert metrics["profit_factor"] == 1.0
+    assert metrics["expectancy"] == 0.0
+    assert metrics["holding_avg_hours"] == 33.0
+    assert metrics["trades_per_day"] == 0.4
+    assert (metrics["max_consecutive_wins"], metrics["max_consecutive_losses"]) == (1, 1)
+    assert (metrics["best_pair"], metrics["worst_pair"]) == ("BTC/USDT", "ETH/USDT")
+
+
+def test_drawdown():
+    metrics = compute_trade_metrics(_trades(), 1000.0, START, END)
+    # 资金 1100 → 1050 → 1080 → 1000: 最大回撤 100，相对于最高资金 1100
+    assert metrics["max_drawdown_abs"] == 100.0
+    assert metrics["max_drawdown_pct"] == 9.09
+    assert metrics["max_drawdown_start"] == "2023-01-02T00:00:00+00:00"
+    assert metrics["max_drawdown_end"] == "2023-01-08T00:00:00+00:00"
+    # 1 月 2 日之后一直没有恢复，到回测结束共 9 天
+    assert metrics["max_drawdown_duration_days"] == 9.0
+
+    curve = equity_curve(prepare_trades(_trades()), 1000.0)
+    assert curve["balance"].tolist() == [1100.0, 1050.0, 1080.0, 1000.0]
+    assert curve["drawdown_abs"].tolist() == [0.0, 50.0, 20.0, 100.0]
+
+
+def test_exposure():
+    metrics = compute_trade_metrics(_trades(), 1000.0, START, END)
+    # 持仓区间: 1/1-1/3、1/4-1/5、1/6-1/8，共 5 天；持仓天数合计 5.5 天
+    assert metrics["exposure_pct"] == 50.0
+    assert metrics["avg_open_trades"] == 0.55
+    assert metrics["max_open_trades"] == 2
+
+
+def test_per_pair_breakdown():
+    rows = compute_trade_metrics(_trades(), 1000.0, START, END)["results_per_pair"]
+    assert [row["pair"] for row in rows] == ["BTC/USDT", "ETH/USDT"]
+    assert rows[0]["profit_total_abs"] == 130.0 and rows[0]["win_rate"] == 100.0
+    assert rows[1]["profit_total_abs"] == -130.0 and rows[1]["profit_factor"] == 0.0
+
+
+def test_profit_abs_from_stake_amount():
+    trades = _trades().drop(columns="profit_abs")
+    metrics = compute_trade_metrics(trades, 1000.0, START, END, stake_amount=100.0)
+    assert metrics["profit_total_abs"] == 0.0
+    assert metrics["max_drawdown_abs"] == 10.0
+
+    with pytest.raises(ValueError):
+        compute_trade_metrics(trades, 1000.0, START, END)
+    with pytest.raises(ValueError):
+        compute_trade_metrics(trades.drop(columns="close_date"), 1000.0, stake_amount=100.0)
+
+
+def test_no_trades():
+    empty = _trades().iloc[:0]
+    metrics = compute_trade_metrics(empty, 1000.0, START, END)
+    assert metrics["total_trades"] == 0
+    assert metrics["max_drawdown_pct"] == 0.0
+    assert metrics["results_per_pair"] == []
+    assert metrics["backtest_start"] == START
@@ -0,0 +1,124 @@
+"""
+滚动窗口评估测试: 窗口切分、汇总指标，以及回测结果的处理（回测函数用固定结果代替）
+"""
+import pytest
+
+from backend.tools import walk_forward
+from backend.tools.walk_forward import aggregate_walk_forward, split_walk_forward_windows, stability_score
+
+
+def test_split_windows():
+    windows = split_walk_forward_windows("20230101-20230201", 4, 0.75)
+    assert windows == [
+        {"train_timerange": "20230101-20230106", "test_timerange": "20230106-20230108"},
+        {"train_timerange": "20230108-20230113", "test_timerange": "20230113-20230115"},
+        {"train_timerange": "20230115-20230120", "test_timerange": "20230120-20230122"},
+        # 最后一个窗口延伸到时间范围的结尾
+        {"train_timerange": "20230122-20230127", "test_timerange": "20230127-20230201"},
+    ]
+
+
+def test_split_windows_reduces_count_for_short_range():
+    windows = split_walk_forward_windows("20230101-20230105", 10, 0.75)
+    assert len(windows) == 2
+    # 每段至少 1 天
+    assert windows[0] == {"train_timerange": "20230101-20230102", "test_timerange": "20230102-20230103"}
+
+
+@pytest.mark.parametrize("timerange", ["20230101-", "-20230201", "20230101-20230102"])
+def test_split_windows_rejects_open_or_short_range(timerange):
+    with pytest.raises(ValueError):
+        split_walk_forward_windows(timerange, 4, 0.75)
+
+
+def test_stability_score():
+    assert stability_score([]) == 0.0
+    assert stability_score([2.0, 2.0, 2.0]) == 1.0
+    assert stability_score([-1.0, -2.0]) == 0.0
+    assert 0 < stability_score([1.0, 3.0, -1.0]) < stability_score([1.0, 3.0, 1.0]) < 1
+
+
+def _window(profit, trades=10, win_rate=50.0, profit_factor=1.0, drawdown=5.0, sharpe=1.0):
+    return {"total_trades": trades, "profit_total_pct": profit, "max_drawdown_pct": drawdown,
+            "win_rate": win_rate, "sharpe": sharpe, "profit_factor": profit_factor}
+
+
+def test_aggregate():
+    summary = aggregate_walk_forward([
+        {"test": _window(10.0, trades=10, win_rate=60.0, profit_factor=2.0, drawdown=3.0, sharpe=2.0)},
+        {"test": _window(-5.0, trades=30, win_rate=40.0, profit_factor=0.5, drawdown=8.0, sharpe=0.0)},
+    ])
+    assert summary["total_trades"] == 40
+    assert summary["profit_total_pct"] == 4.5
+    assert summary["max_drawdown_pct"] == 8.0
+    assert summary["win_rate"] == 45.0
+    assert summary["profit_factor"] == 0.875
+    assert summary["sharpe"] == 1.0
+    assert summary["profitable_windows"] == 1
+    assert summary["walk_forward_efficiency"] is None
+
+
+def test_aggregate_efficiency_with_train_segments():
+    summary = aggregate_walk_forward([
+        {"train": _window(10.0), "test": _window(4.0)},
+        {"train": _window(10.0), "test": _window(6.0)},
+    ])
+    assert summary["walk_forward_efficiency"] == 0.5
+
+
+def _fake_backtest(calls, result=None):
+    def run(strategy_code, timerange, pair_list=None, timeframe="5m", progress_callback=None, cancel_event=None):
+        calls.append(timerange)
+        return result if result is not None else {"success": True, "metrics": _window(2.0)}
+    return run
+
+
+@pytest.mark.parametrize("train_backtest, expected_runs", [(False, 4), (True, 8)])
+def test_run_walk_forward_segments(monkeypatch, train_backtest, expected_runs):
+    calls = []
+    monkeypatch.setattr(walk_forward, "run_freqtrade_backtest_auto", _fake_backtest(calls))
+    result = walk_forward.run_walk_forward("code", "20230101-20230201", windows=4, train_ratio=0.75,
+                                           train_backtest=train_backtest)
+    assert result["success"]
+    assert len(calls) == expected_runs
+    assert ("20230101-20230106" in calls) == train_backtest
+    assert result["metrics"]["total_trades"] == 40
+    assert result["walk_forward"]["walk_forward_efficiency"] == (1.0 if train_backtest else None)
+
+
+def test_run_walk_forward_rejects_mock_results(monkeypatch):
+    mock_result = {"success": True, "mock_mode": True, "metrics": _window(2.0)}
+    monkeypatch.setattr(walk_forward, "run_freqtrade_backtest_auto", _fake_backtest([], mock_result))
+    result = walk_forward.run_walk_forward("code", "20230101-20230201", windows=4, train_ratio=0.75)
+    assert result["error_type"] == "execution_error"
+
+
+def test_run_walk_forward_reports_window_error(monkeypatch):
+    error = {"error": "boom", "error_type": "code_error"}
+    monkeypatch.setattr(walk_forward, "run_freqtrade_backtest_auto", _fake_backtest([], error))
+    result = walk_forward.run_walk_forward("code", "20230101-20230201", windows=4, train_ratio=0.75)
+    assert result["error_type"] == "code_error"
+    assert result["error"].startswith("窗口 1")
+
+
+def test_run_walk_forward_cancels_other_windows(monkeypatch):
+    cancelled = []
+
+    def run(strategy_code, timerange, pair_list=None, timeframe="5m", progress_callback=None, cancel_event=None):
+        if timerange == "20230120-20230122":
+            return {"error": "boom", "error_type": "code_error"}
+        # 其余窗口一直运行到被取消
+        assert cancel_event.wait(5)
+        cancelled.append(timerange)
+        return {"error": "回测任务已取消", "error_type": "cancelled"}
+
+    monkeypatch.setattr(walk_forward, "run_freqtrade_backtest_auto", run)
+    result = walk_forward.run_walk_forward("code", "20230101-20230201", windows=4, train_ratio=0.75)
+    assert result["error_type"] == "code_error"
+    assert result["error"].startswith("窗口 3")
+    assert len(cancelled) == 3
+
+
+def test_run_walk_forward_invalid_timerange():
+    result = walk_forward.run_walk_forward("code", "20230101-", windows=4)
+    assert result["error_type"] == "execution_error"